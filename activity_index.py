@@ -0,0 +1,131 @@
+from threading import Lock
+
+from activity_normalizer import normalize_key
+
+from typing import Dict, List, Set, Tuple, Iterable, Callable
+
+# Names containing less of the query's trigrams than this are not considered a match
+MIN_SIMILARITY: float = 0.5
+
+def trigrams(key: str) -> Set[str]:
+    # Padded like pg_trgm, so the start and end of a name weigh more than its middle
+    padded: str = f"  {key} "
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ActivityIndex:
+    """
+    Trigram index of every recorded activity name, for fuzzy lookups and autocomplete. The trigrams are shared
+    by every user, each user only keeps the set of names they have recorded. Names are added as they are first
+    recorded, and a user's names are loaded once the first time they are searched.
+    """
+
+    def __init__(self, load_user_activities: Callable[[int], Iterable[str]]) -> None:
+        self.load_user_activities: Callable[[int], Iterable[str]] = load_user_activities
+
+        self.keys: Dict[str, str] = {} # name -> normalized name
+        self.postings: Dict[str, Set[str]] = {} # trigram -> names
+
+        self.user_names: Dict[int, Set[str]] = {}
+        self.loading_names: Dict[int, Set[str]] = {} # names recorded while the user is being loaded
+        self.lock: Lock = Lock()
+
+    def _index_name(self, name: str) -> None:
+        if name in self.keys: return
+
+        key: str = normalize_key(name)
+        self.keys[name] = key
+
+        for trigram in trigrams(key):
+            self.postings.setdefault(trigram, set()).add(name)
+
+    def add(self, user_id: int, name: str) -> None:
+        with self.lock:
+            self._index_name(name)
+
+            # Users that aren't loaded yet will find the name in the database when they are
+            if user_id in self.user_names:
+                self.user_names[user_id].add(name)
+            elif user_id in self.loading_names:
+                self.loading_names[user_id].add(name)
+
+    def _get_user_names(self, user_id: int) -> Set[str]:
+        with self.lock:
+            names: Set[str] | None = self.user_names.get(user_id)
+
+            if names is not None: return names
+
+            self.loading_names.setdefault(user_id, set())
+
+        loaded_names: Set[str] = set(self.load_user_activities(user_id))
+
+        with self.lock:
+            loaded_names |= self.loading_names.pop(user_id, set())
+
+            for name in loaded_names:
+                self._index_name(name)
+
+            return self.user_names.setdefault(user_id, loaded_names)
+
+    def search(self, query: str, user_id: int | None = None, limit: int = 25) -> List[str]:
+        """
+        Returns up to `limit` names matching the query, best first: exact matches, then prefixes, then names
+        containing the query, then names with enough trigrams in common. Only the user's names are searched
+        if a user is given.
+        """
+
+        names: Set[str] | None = None if user_id is None else self._get_user_names(user_id)
+        query_key: str = normalize_key(query)
+
+        with self.lock:
+            candidates: Iterable[str] = self.keys if names is None else names
+
+            if query_key == "":
+                return sorted(candidates, key=str.casefold)[:limit]
+
+            query_trigrams: Set[str] = trigrams(query_key)
+            overlaps: Dict[str, int] = {}
+
+            posting_sizes: int = sum(len(self.postings.get(trigram, ())) for trigram in query_trigrams)
+
+            if names is not None and len(names) < posting_sizes:
+                # Scoring a user's few names directly beats walking postings shared with every other user
+                for name in names:
+                    overlap: int = len(query_trigrams & trigrams(self.keys[name]))
+
+                    if overlap > 0: overlaps[name] = overlap
+            else:
+                for trigram in query_trigrams:
+                    for name in self.postings.get(trigram, ()):
+                        if names is None or name in names:
+                            overlaps[name] = overlaps.get(name, 0) + 1
+
+            # Queries shorter than a trigram can sit inside a name without sharing any of its trigrams
+            if len(query_key) < 3:
+                for name in candidates:
+                    if query_key in self.keys[name]:
+                        overlaps.setdefault(name, 0)
+
+            ranked: List[Tuple[int, float, str]] = []
+
+            for name, overlap in overlaps.items():
+                key: str = self.keys[name]
+                # How much of the query the name contains, so a typo in part of a long name still matches
+                similarity: float = overlap / len(query_trigrams)
+
+                if key == query_key: tier = 3
+                elif key.startswith(query_key): tier = 2
+                elif query_key in key: tier = 1
+                elif similarity >= MIN_SIMILARITY: tier = 0
+                else: continue
+
+                ranked.append((tier, similarity, name))
+
+        ranked.sort(key=lambda match: (-match[0], -match[1], len(match[2])))
+
+        return [name for _, _, name in ranked[:limit]]
+
+    def best_match(self, query: str, user_id: int | None = None) -> str:
+        matches: List[str] = self.search(query, user_id, 1)
+
+        return matches[0] if len(matches) > 0 else ""
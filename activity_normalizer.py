@@ -0,0 +1,233 @@
+import re
+import logging
+
+from fnmatch import translate as translate_glob
+from json import loads as parse_json
+from os import stat
+from threading import Thread, Event
+
+from database import DatabaseManager
+
+from typing import Dict, List, Tuple
+
+# Keys in activity_matches.json with these prefixes are patterns matched against the whole activity name,
+# every other key is an exact name (matched as is first, then case-folded with whitespace and punctuation stripped)
+REGEX_PREFIX: str = "re:"
+GLOB_PREFIX: str = "glob:"
+
+def normalize_key(activity_name: str) -> str:
+    return re.sub(r"[\W_]+", "", activity_name.casefold())
+
+class ActivityRules:
+    """
+    activity_matches.json compiled into exact lookups plus case-insensitive patterns tried in file order
+    """
+
+    MAX_CACHE_SIZE: int = 10000
+
+    def __init__(self, matches: Dict[str, str]) -> None:
+        self.exact: Dict[str, str] = {}
+        self.normalized: Dict[str, str] = {}
+        self.patterns: List[Tuple[re.Pattern, str]] = []
+
+        for key, target in matches.items():
+            if key.startswith(REGEX_PREFIX):
+                pattern: str = key[len(REGEX_PREFIX):]
+            elif key.startswith(GLOB_PREFIX):
+                pattern = translate_glob(key[len(GLOB_PREFIX):])
+            else:
+                self.exact[key] = target
+                self.normalized.setdefault(normalize_key(key), target)
+                continue
+
+            # Each rule keeps its own pattern: joined into one regex, the inline flags, backreferences
+            # or group names of one rule could break the others or change what they match
+            try:
+                self.patterns.append((re.compile(pattern, re.IGNORECASE), target))
+            except re.error as e:
+                raise ValueError(f"Invalid activity rule '{key}': {str(e)}")
+
+        self.cache: Dict[str, str] = {}
+
+    def _resolve(self, activity_name: str) -> str:
+        if activity_name in self.exact: return self.exact[activity_name]
+
+        normalized_name: str = normalize_key(activity_name)
+
+        if normalized_name in self.normalized: return self.normalized[normalized_name]
+
+        for pattern, target in self.patterns:
+            if pattern.fullmatch(activity_name) is not None:
+                return target
+
+        return activity_name
+
+    def resolve(self, activity_name: str) -> str:
+        real_activity_name: str | None = self.cache.get(activity_name)
+
+        if real_activity_name is not None: return real_activity_name
+
+        real_activity_name = self._resolve(activity_name)
+
+        # Activity names are unbounded, so the memo is simply dropped once it fills up
+        if len(self.cache) >= self.MAX_CACHE_SIZE:
+            self.cache = {}
+
+        self.cache[activity_name] = real_activity_name
+
+        return real_activity_name
+
+class ActivityNormalizer:
+    """
+    Maps raw activity names to the name stats are stored under, reloading the rules whenever the file changes
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+
+        self.modified_time: float = stat(path).st_mtime
+        self.rules: ActivityRules = self._load()
+
+        self.stopped: Event = Event()
+        self.thread: Thread | None = None
+
+    def _load(self) -> ActivityRules:
+        with open(self.path, "r") as activity_matches_file:
+            return ActivityRules(parse_json(activity_matches_file.read()))
+
+    def normalize(self, activity_name: str) -> str:
+        return self.rules.resolve(activity_name)
+
+    def reload_if_changed(self) -> bool:
+        modified_time: float = stat(self.path).st_mtime
+
+        if modified_time == self.modified_time: return False
+
+        self.modified_time = modified_time
+
+        try:
+            self.rules = self._load()
+        except Exception as e:
+            logging.error(f"[ACTIVITY MATCHES] Error while reloading '{self.path}', keeping the previous rules! Error: {str(e)}")
+            return False
+
+        logging.info(f"[ACTIVITY MATCHES] Reloaded '{self.path}' ({len(self.rules.exact)} names, {len(self.rules.patterns)} patterns)")
+
+        return True
+
+    def _watch(self, interval: float) -> None:
+        while not self.stopped.wait(interval):
+            try:
+                self.reload_if_changed()
+            except OSError as e:
+                logging.error(f"[ACTIVITY MATCHES] Error while checking '{self.path}'! Error: {str(e)}")
+
+    def watch(self, interval: float) -> None:
+        self.thread = Thread(target=self._watch, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+def remerge_rich_presence_time(rich_presence_time: Dict[str, Dict[str, float]], normalize: callable) -> Dict[str, Dict[str, float]]:
+    """
+    Merges the stats of every activity name that normalizes to the same name. Names normalized to "" are dropped.
+    """
+
+    merged: Dict[str, Dict[str, float]] = {}
+
+    for activity_name, status_times in rich_presence_time.items():
+        real_activity_name: str = normalize(activity_name)
+
+        if real_activity_name == "": continue
+
+        merged_times: Dict[str, float] = merged.setdefault(real_activity_name, {})
+
+        for status, minutes in status_times.items():
+            merged_times[status] = merged_times.get(status, 0) + minutes
+
+    return merged
+
+def remerge_database(database_manager: DatabaseManager, normalize: callable, dry_run: bool = False, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Re-merges every stored rich_presence_time and session under the current rules. Run it while the bot is stopped,
+    only rich_presence_time is rewritten so the rest of each user is left as stored.
+    """
+
+    counts: Dict[str, int] = {"users": 0, "activities": 0, "sessions": 0}
+
+    database_manager.reset_cache()
+
+    def flush(items: List[Dict] | Dict[int, Dict], store: callable) -> None:
+        if not dry_run and len(items) > 0:
+            store(items)
+
+        items.clear()
+
+    rich_presence_times: Dict[int, Dict[str, Dict[str, float]]] = {}
+
+    for user in database_manager.iter_users():
+        rich_presence_time: Dict[str, Dict[str, float]] = user.get("rich_presence_time", {})
+        merged: Dict[str, Dict[str, float]] = remerge_rich_presence_time(rich_presence_time, normalize)
+
+        if merged == rich_presence_time: continue
+
+        counts["users"] += 1
+        counts["activities"] += len(rich_presence_time) - len(merged)
+
+        rich_presence_times[user["_id"]] = merged
+
+        if len(rich_presence_times) >= batch_size: flush(rich_presence_times, database_manager.set_rich_presence_times)
+
+    flush(rich_presence_times, database_manager.set_rich_presence_times)
+
+    sessions: List[Dict] = []
+
+    for session in database_manager.iter_sessions():
+        real_activity_name: str = normalize(session["activity"])
+
+        if real_activity_name in ("", session["activity"]): continue
+
+        counts["sessions"] += 1
+
+        session["activity"] = real_activity_name
+        sessions.append(session)
+
+        if len(sessions) >= batch_size: flush(sessions, database_manager.import_sessions)
+
+    flush(sessions, database_manager.import_sessions)
+
+    database_manager.reset_cache()
+
+    return counts
+
+if __name__ == "__main__":
+    from sys import argv
+    from yaml import safe_load
+
+    from database import create_database_manager
+
+    logging.root.setLevel(logging.INFO)
+
+    with open("./config.yaml", "r") as cfg:
+        config: Dict = safe_load(cfg.read())
+
+    normalizer: ActivityNormalizer = ActivityNormalizer(config["activity_matches_path"])
+
+    if len(argv) >= 2 and argv[1] == "remerge":
+        # python3 activity_normalizer.py remerge [--dry-run]
+        dry_run: bool = "--dry-run" in argv[2:]
+
+        database_manager: DatabaseManager = create_database_manager(config)
+        counts: Dict[str, int] = remerge_database(database_manager, normalizer.normalize, dry_run)
+        database_manager.close()
+
+        print(f"{'Would merge' if dry_run else 'Merged'} {counts['activities']} activities across {counts['users']} users and renamed {counts['sessions']} sessions.")
+
+    elif len(argv) >= 3 and argv[1] == "test":
+        # python3 activity_normalizer.py test <activity name>...
+        for activity_name in argv[2:]:
+            print(f"{activity_name!r} -> {normalizer.normalize(activity_name)!r}")
+
+    else:
+        print("Usage: python3 activity_normalizer.py remerge [--dry-run] | test <activity name>...")
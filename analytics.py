@@ -1,15 +1,16 @@
-import matplotlib.pyplot as plot
-import plotly.graph_objects as go
-
-from time import time
+from math import ceil
 from random import uniform
 from typing import Dict, List, Tuple
 
 from database import DatabaseManager
+from activity_index import ActivityIndex
+from render_service import RenderJob
+from renderers import render_pie, render_table
 
 class GraphManager:
     """
-    Manages all the graph drawing and visualisations of the user data
+    Gathers the data behind every graph and visualisation of the user data. Each graph is returned as a
+    RenderJob for the RenderService to draw, or as a string saying why there is nothing to draw.
     """
 
     COLORS: Dict[str, Tuple[int, int, int]] = {
@@ -22,6 +23,8 @@ class GraphManager:
         "black": (0, 0, 0)
     }
 
+    TABLE_PAGE_SIZE: int = 25
+
     DISPLAY_STATUS: Dict[str, str] = {
         "online": "Online",
         "idle": "Idle",
@@ -31,26 +34,39 @@ class GraphManager:
 
     def __init__(self, database_manager: DatabaseManager) -> None:
         self.dbManager: DatabaseManager = database_manager
-        plot.rcParams['text.color'] = 'white'
+
+        # Kept up to date by the database as users are credited for new activities
+        self.activity_index: ActivityIndex = ActivityIndex(self._get_user_activities)
+        self.dbManager.on_new_activity = self.activity_index.add
+
+    def _get_user_activities(self, user_id: int) -> List[str]:
+        user_data: Dict | None = self.dbManager.get_user(user_id)
+
+        return [] if user_data is None else list(user_data["rich_presence_time"])
 
     def _random_color(self) -> Tuple[int, int, int]:
         return (uniform(0, 1), uniform(0, 1), uniform(0, 1))
     
-    def _search_list(self, str_list: List[str], query: str) -> str:
-        best_string: str = ""
-        best_score: int = 100000
-        for string in str_list:
-            if query.lower() not in string.lower(): continue
+    def _table_job(self, graph: str, activity_hours: List[Tuple[str, float]], page: int, limit: int | None) -> RenderJob:
+        """
+        One page of TABLE_PAGE_SIZE ranked activities out of the top limit, plus the total of every activity given
+        """
+
+        ranked_hours: List[Tuple[str, float]] = activity_hours[:limit]
 
-            score: int = 0
+        pages: int = max(1, ceil(len(ranked_hours) / self.TABLE_PAGE_SIZE))
+        page = min(max(page, 1), pages)
 
-            score += len(string) - len(query) # how close in length the words are (also gives them negative if string is short than query)
-            
-            if score < best_score:
-                best_score = score
-                best_string = string
+        start: int = (page - 1) * self.TABLE_PAGE_SIZE
+        page_hours: List[Tuple[str, float]] = ranked_hours[start:start + self.TABLE_PAGE_SIZE]
 
-        return best_string
+        total_name: str = "Total" if len(ranked_hours) == len(activity_hours) else "Total (all activities)"
+
+        ranks: List = [*range(start + 1, start + len(page_hours) + 1), "-"]
+        names: List[str] = [activity_name for activity_name, _ in page_hours] + [total_name]
+        hours: List[float] = [hour for _, hour in page_hours] + [round(sum(hour for _, hour in activity_hours), 2)]
+
+        return RenderJob(graph, render_table, (ranks, names, hours, f"Page {page} of {pages}" if pages > 1 else ""))
 
     def get_user_id(self, username: str) -> int | None:
         return self.dbManager.get_user_id(username)
@@ -79,44 +95,26 @@ class GraphManager:
 
         return new_str_list
 
-    def format_time(self, percent: float, time_list: List[float]) -> str:
-        if percent < 5: return ""
-        
-        absolute = int(round(percent / 100. * sum(time_list)))
-
-        hours: int = absolute // 60
-        mins: int = absolute % 60
-
-        return f"{percent:.1f}%\n({hours}h {mins}m)"
-
-    def get_user_simple_time(self, user_id: int, username: str) -> str:
+    def get_user_simple_time(self, user_id: int, username: str) -> RenderJob | str:
         user_data = self.dbManager.get_user(user_id)
 
         if user_data is None: return ""
 
-        simple_time: Dict[str, int] = user_data[str(user_id)]["simple_time"]
+        simple_time: Dict[str, int] = user_data["simple_time"]
 
         time_list: List[int] = [int(time) for time in simple_time.values()]
         
         labels: Tuple[str] = ("Online", "Idle", "Do Not Disturb", "Offline")
         colors: Tuple[Tuple[int, int, int]] = (self.COLORS["green"], self.COLORS["yellow"], self.COLORS["red"], self.COLORS["grey"])
 
-        file_name: str = f"{user_id}_simple_times.png"
+        return RenderJob("user_simple_time", render_pie, (time_list, labels, colors, f"{username}'s basic status breakdown"))
 
-        plot.pie(time_list, labels=labels, colors=colors, autopct=lambda percent: self.format_time(percent, time_list))
-        plot.title(f"{username}'s basic status breakdown")
-        plot.savefig(file_name, facecolor='none')
-        plot.close()
-
-        return file_name
-        # remember to delete the file once sent
-
-    def get_user_rich_time(self, user_id: int, username: str) -> str:
+    def get_user_rich_time(self, user_id: int, username: str) -> RenderJob | str:
         user_data = self.dbManager.get_user(user_id)
 
         if user_data is None: return ""
 
-        activities: Dict[str, Dict] = user_data[str(user_id)]["rich_presence_time"]
+        activities: Dict[str, Dict] = user_data["rich_presence_time"]
         activity_names: List[str] = []
         activity_times: List[int] = []
         colors: List[Tuple[int, int, int]] = []
@@ -126,176 +124,71 @@ class GraphManager:
             activity_times.append(sum(activities[activity].values()))
             colors.append(self._random_color())
 
-        file_name: str = f"{user_id}_rich_times.png"
-
-        plot.pie(activity_times, labels=self.remove_minority_items(activity_names, activity_times),
-                 colors=colors, autopct=lambda percent: self.format_time(percent, activity_times))
-        plot.title(f"{username}'s rich status breakdown")
-        plot.savefig(file_name, facecolor='none')
-        plot.close()
+        return RenderJob("user_rich_time", render_pie, (activity_times, self.remove_minority_items(activity_names, activity_times),
+                                                        colors, f"{username}'s rich status breakdown"))
 
-        return file_name
-        # remember to delete the file once sent
-
-    def get_user_rich_time_table(self, user_id: int, username: str) -> str:
+    def get_user_rich_time_table(self, user_id: int, username: str, page: int = 1, limit: int | None = None) -> RenderJob | str:
         user_data = self.dbManager.get_user(user_id)
 
         if user_data is None: return ""
 
-        activities: Dict[str, Dict] = user_data[str(user_id)]["rich_presence_time"]
-        activity_names: List[str] = []
-        activity_times: List[int] = []
+        activities: Dict[str, Dict] = user_data["rich_presence_time"]
 
-        for activity in activities:
-            activity_names.append(activity)
-            activity_times.append(round(sum(activities[activity].values()) / 60, 2))
-
-        if len(activity_names) == 0:
+        if len(activities) == 0:
             return "user_no_status"
 
-        sorted_pairs = sorted(zip(activity_times, activity_names), reverse=True)
-        sorted_activity_times, sorted_activity_names = zip(*sorted_pairs)
-
-        ranks = list(range(1, len(activity_names)+1))
-        names = list(sorted_activity_names)
-        hours = list(sorted_activity_times)
-
-        ranks.append("-")
-        names.append("Total")
-        hours.append(sum(activity_times))
+        activity_hours: List[Tuple[str, float]] = [(activity, round(sum(activities[activity].values()) / 60, 2)) for activity in activities]
+        activity_hours.sort(key=lambda item: item[1], reverse=True)
 
-        fig = go.Figure(
-            data=[go.Table(header=dict(values=["Rank", "Name", "Hours"]),
-            cells=dict(values=[ranks, names, hours]))
-        ])
+        return self._table_job("user_rich_time_table", activity_hours, page, limit)
 
-        estimated_height = 400 + max(0, (len(activity_names) - 10) * 30)
-
-        file_name: str = f"{user_id}_rich_times_table.png"
-        fig.write_image(file_name, height=estimated_height)
-
-        return file_name
-        # remember to delete the file once sent
-
-    def get_user_rich_time_specific(self, user_id: int, username: str, query: str) -> str:
+    def get_user_rich_time_specific(self, user_id: int, username: str, query: str) -> RenderJob | str:
         user_data = self.dbManager.get_user(user_id)
 
         if user_data is None: return ""
 
-        activities: Dict[str, Dict] = user_data[str(user_id)]["rich_presence_time"]
-        best_activity: str = self._search_list(activities, query)
+        activities: Dict[str, Dict] = user_data["rich_presence_time"]
+        best_activity: str = self.activity_index.best_match(query, user_id)
 
-        if best_activity == "": return "no_best_activity"
+        if best_activity not in activities: return "no_best_activity"
 
-        simple_time: Dict[str, int] = user_data[str(user_id)]["rich_presence_time"][best_activity]
+        simple_time: Dict[str, int] = user_data["rich_presence_time"][best_activity]
         time_list: List[int] = [int(time) for time in simple_time.values()]
         
         labels: Tuple[str] = ("Online", "Idle", "Do Not Disturb", "Offline")
         colors: Tuple[Tuple[int, int, int]] = (self.COLORS["green"], self.COLORS["yellow"], self.COLORS["red"], self.COLORS["grey"])
 
-        file_name: str = f"{user_id}_rich_custom_times.png"
+        return RenderJob("user_rich_time_specific", render_pie, (time_list, labels, colors, f"{username}'s rich status for '{best_activity}' breakdown"))
 
-        plot.pie(time_list, labels=labels, colors=colors, autopct=lambda percent: self.format_time(percent, time_list))
-        plot.title(f"{username}'s rich status for '{best_activity}' breakdown")
-        plot.savefig(file_name, facecolor='none')
-        plot.close()
-
-        return file_name
-        # remember to delete the file once sent
-
-    def get_server_simple_time(self, members: list, server_name: str) -> str:
+    def get_server_simple_time(self, members: list, server_name: str) -> RenderJob | str:
         server_statuses: Dict[str, int] = {"Online": 0, "Idle": 0, "Do Not Disturb": 0, "Offline": 0}
         colors: Tuple[Tuple[int, int, int]] = (self.COLORS["green"], self.COLORS["yellow"], self.COLORS["red"], self.COLORS["grey"])
-        file_name: str = f'{server_name.replace(" ", "_")}_server_simple.png'
-
-        for user_id in members:
-            user_time_data = self.dbManager.get_user_time_dict(user_id)
-
-            if user_time_data is None: return ""
 
+        for user_time_data in self.dbManager.get_users(members, ("simple_time",)).values():
             user_statuses = user_time_data["simple_time"]
 
             for status in user_statuses:
                 server_statuses[self.DISPLAY_STATUS[status]] += user_statuses[status]
-        
-        plot.pie(server_statuses.values(), labels=self.remove_minority_keys(server_statuses),
-                 colors=colors, autopct=lambda percent: self.format_time(percent, server_statuses.values()))
-        plot.title(f"{server_name}'s simple status breakdown")
-        plot.savefig(file_name, facecolor='none')
-        plot.close()
 
-        return file_name
+        if sum(server_statuses.values()) == 0: return ""
+        
+        return RenderJob("server_simple_time", render_pie, (list(server_statuses.values()), self.remove_minority_keys(server_statuses),
+                                                            colors, f"{server_name}'s simple status breakdown"))
     
-    def get_server_rich_time(self, members: list, server_name: str) -> str:
-        server_activities: Dict[str, int] = {}
-        colors: List[Tuple[int, int, int]] = []
-        file_name: str = f'{server_name.replace(" ", "_")}_server_rich.png'
-
-        for user_id in members:
-            user_data = self.dbManager.get_user(user_id)
-
-            if user_data is None: return ""
+    def get_server_rich_time(self, members: list, server_name: str) -> RenderJob | str:
+        server_activities: Dict[str, float] = dict(self.dbManager.get_rich_presence_totals(members))
 
-            activities: Dict[str, Dict] = user_data[str(user_id)]["rich_presence_time"]
+        if len(server_activities) == 0: return ""
 
-            for activity in activities:
-                if activity in server_activities:
-                    server_activities[activity] += sum(activities[activity].values())
-                else:
-                    server_activities[activity] = sum(activities[activity].values())
-                    colors.append(self._random_color())
+        colors: List[Tuple[int, int, int]] = [self._random_color() for _ in server_activities]
         
-        plot.pie(server_activities.values(), labels=self.remove_minority_keys(server_activities),
-                 colors=colors, autopct=lambda percent: self.format_time(percent, server_activities.values()))
-        plot.title(f"{server_name}'s rich status breakdown")
-        plot.savefig(file_name, facecolor='none')
-        plot.close()
-
-        return file_name
-
-    def get_server_rich_time_table(self, members: list, server_name: str) -> str:
-        file_name: str = f'{server_name.replace(" ", "_")}_server_rich_table.png'
-
-        activity_names = []
-        activity_times = []
-
-        for user_id in members:
-            user_data = self.dbManager.get_user(user_id)
-
-            if user_data is None: return ""
-
-            activities: Dict[str, Dict] = user_data[str(user_id)]["rich_presence_time"]
-
-            for activity in activities:
-                activity_time = round(sum(activities[activity].values()) / 60, 2)
-                
-                if activity not in activity_names:
-                    activity_names.append(activity)
-                    activity_times.append(activity_time)
-                else:
-                    index = activity_names.index(activity)
-                    activity_times[index] = round(activity_times[index] + activity_time, 2)
-
-        sorted_pairs = sorted(zip(activity_times, activity_names), reverse=True)
-        sorted_activity_times, sorted_activity_names = zip(*sorted_pairs)
-
-        ranks = list(range(1, len(activity_names)+1))
-        names = list(sorted_activity_names)
-        hours = list(sorted_activity_times)
-
-        ranks.append("-")
-        names.append("Total")
-        hours.append(sum(activity_times))
-
-        fig = go.Figure(
-            data=[go.Table(header=dict(values=["Rank", "Name", "Hours"]),
-            cells=dict(values=[ranks, names, hours]))
-        ])
+        return RenderJob("server_rich_time", render_pie, (list(server_activities.values()), self.remove_minority_keys(server_activities),
+                                                          colors, f"{server_name}'s rich status breakdown"))
 
-        estimated_height = 400 + max(0, (len(activity_names) - 10) * 30)
+    def get_server_rich_time_table(self, members: list, server_name: str, page: int = 1, limit: int | None = None) -> RenderJob | str:
+        # Not limited in the database, the total row covers the activities outside the top limit too
+        activity_totals: List[Tuple[str, float]] = self.dbManager.get_rich_presence_totals(members)
 
-        file_name: str = f"{server_name}_rich_times_table.png"
-        fig.write_image(file_name, height=estimated_height)
+        if len(activity_totals) == 0: return ""
 
-        return file_name
-        # remember to delete the file once sent
+        return self._table_job("server_rich_time_table", [(activity_name, round(minutes / 60, 2)) for activity_name, minutes in activity_totals], page, limit)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+"""
+Offline sweep benchmark. Builds synthetic guilds and runs Server.sweep against an in-memory database that
+counts operations and bytes, so throughput can be compared across commits without Discord or MongoDB.
+
+    python3 benchmark.py --members 5000 --guilds 3 --sweeps 5 --output results.json
+    python3 benchmark.py --compare results.json
+
+Every run also sweeps a second population with more members than --cache-size. Tracked users then outnumber
+the cache, which catches eviction costs that grow with the number of tracked users.
+"""
+
+import json
+import logging
+import resource
+import subprocess
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from copy import deepcopy
+from multiprocessing import get_context
+from random import Random
+from threading import Lock
+from time import perf_counter
+from types import SimpleNamespace
+
+from database import DatabaseManager, UserChanges, STATUSES
+from bot import Server, SkipList, MemberRegistry, ActivityManager
+
+from typing import Dict, List, Tuple, Iterator
+
+# The bot's default 'cache_size'
+DEFAULT_CACHE_SIZE: int = 10000
+
+# Members of the second run, as a multiple of the cache size
+OVER_CACHE_FACTOR: float = 1.5
+
+def _payload_size(payload: object) -> int:
+    return len(json.dumps(payload, default=list))
+
+class MemoryDatabaseManager(DatabaseManager):
+    """
+    In-memory storage backend that counts every operation and the bytes it would send
+    """
+
+    def __init__(self, cache_size: int = 10000) -> None:
+        self.users: Dict[int, Dict] = {}
+        self.sessions: Dict[str, Dict] = {}
+        self.lock: Lock = Lock()
+
+        self.operations: int = 0
+        self.bytes: int = 0
+
+        # The flush timer is left idle, the benchmark flushes after every sweep
+        super().__init__(cache_size, flush_interval=3600)
+
+    def _count(self, payload: object) -> None:
+        self.operations += 1
+        self.bytes += _payload_size(payload)
+
+    def _insert_users(self, users: Dict[int, Dict]) -> None:
+        if not users: return
+
+        with self.lock:
+            self._count(users)
+
+            for user_id, user in users.items():
+                if user_id not in self.users:
+                    self.users[user_id] = {"_id": user_id, "username_history": [], **deepcopy(user)}
+
+    def _load_user(self, user_id: int) -> Dict | None:
+        with self.lock:
+            user: Dict | None = self.users.get(user_id)
+            self._count(user)
+
+            return None if user is None else deepcopy(user)
+
+    def _load_users(self, user_ids: List[int], fields: Tuple[str, ...]) -> Dict[int, Dict]:
+        with self.lock:
+            users: Dict[int, Dict] = {user_id: {field: deepcopy(self.users[user_id].get(field)) for field in fields} for user_id in user_ids if user_id in self.users}
+            self._count(users)
+
+            return users
+
+    def _aggregate_rich_presence_totals(self, user_ids: List[int], limit: int | None) -> List[Tuple[str, float]]:
+        totals: Dict[str, float] = {}
+
+        with self.lock:
+            for user_id in user_ids:
+                for app_name, status_times in self.users.get(user_id, {}).get("rich_presence_time", {}).items():
+                    totals[app_name] = totals.get(app_name, 0) + sum(status_times.values())
+
+            self._count(totals)
+
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def _load_active_session_names(self, user_id: int, active_sessions: List[str]) -> Dict[str, str]:
+        with self.lock:
+            names: Dict[str, str] = {session_id: self.sessions[session_id]["activity"] for session_id in active_sessions if session_id in self.sessions}
+            self._count(names)
+
+            return names
+
+    def _load_session_activities(self, session_ids: List[str]) -> Dict[str, str]:
+        with self.lock:
+            names: Dict[str, str] = {session_id: self.sessions[session_id]["activity"] for session_id in session_ids if session_id in self.sessions}
+            self._count(names)
+
+            return names
+
+    def _write_changes(self, changes: List[UserChanges]) -> None:
+        with self.lock:
+            for user_changes in changes:
+                self._count({slot: getattr(user_changes, slot) for slot in UserChanges.__slots__})
+
+                user: Dict = self.users[user_changes.user_id]
+                user.update(user_changes.fields)
+
+                if "username" in user_changes.fields and user_changes.fields["username"] not in user["username_history"]:
+                    user["username_history"].append(user_changes.fields["username"])
+
+                for status, minutes in user_changes.simple_time_deltas.items():
+                    user["simple_time"][status] = user["simple_time"].get(status, 0) + minutes
+
+                for app_name, status_times in user_changes.rich_presence_deltas.items():
+                    app_times: Dict[str, float] = user["rich_presence_time"].setdefault(app_name, {status: 0 for status in STATUSES})
+
+                    for status, minutes in status_times.items():
+                        app_times[status] += minutes
+
+                for session_id, session in user_changes.new_sessions.items():
+                    self.sessions[session_id] = deepcopy(session)
+
+                for session_id, delta in user_changes.session_deltas.items():
+                    session: Dict = self.sessions[session_id]
+                    session["end_time"] = delta["end_time"]
+
+                    for status, minutes in delta["status"].items():
+                        session["status"][status] = session["status"].get(status, 0) + minutes
+
+                active_sessions: List[str] = [session_id for session_id in user["active_sessions"] if session_id not in user_changes.removed_sessions]
+                user["active_sessions"] = active_sessions + [session_id for session_id in user_changes.added_sessions if session_id not in active_sessions]
+
+    def _load_sessions(self, user_id: int) -> Dict[str, Dict] | None:
+        with self.lock:
+            if user_id not in self.users: return None
+
+            sessions: Dict[str, Dict] = {
+                session_id: {"name": session["activity"], "status": dict(session["status"]), "start_time": session["start_time"], "end_time": session["end_time"]}
+                for session_id, session in self.sessions.items() if session["user_id"] == user_id
+            }
+            self._count(sessions)
+
+            return sessions
+
+    def get_user_id(self, username: str) -> int | None:
+        with self.lock:
+            self._count(username)
+
+            for field in ("username", "username_history"):
+                matches: List[Dict] = [
+                    user for user in self.users.values()
+                    if username.lower() in [name.lower() for name in ([user.get(field) or ""] if field == "username" else user[field])]
+                ]
+
+                if len(matches) > 0:
+                    return max(matches, key=lambda user: user["last_update"])["_id"]
+
+        return None
+
+    def get_username_history(self, user_id: int) -> List[str]:
+        with self.lock:
+            return list(self.users.get(user_id, {}).get("username_history", []))
+
+    def iter_users(self) -> Iterator[Dict]:
+        for user in list(self.users.values()):
+            yield deepcopy(user)
+
+    def iter_sessions(self) -> Iterator[Dict]:
+        for session in list(self.sessions.values()):
+            yield deepcopy(session)
+
+    def import_users(self, users: List[Dict]) -> None:
+        with self.lock:
+            for user in users:
+                self._count(user)
+                self.users[user["_id"]] = deepcopy(user)
+
+    def set_rich_presence_times(self, rich_presence_times: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+        with self.lock:
+            self._count(rich_presence_times)
+
+            for user_id, rich_presence_time in rich_presence_times.items():
+                if user_id in self.users:
+                    self.users[user_id]["rich_presence_time"] = deepcopy(rich_presence_time)
+
+    def import_sessions(self, sessions: List[Dict]) -> None:
+        with self.lock:
+            for session in sessions:
+                self._count(session)
+                self.sessions[session["_id"]] = deepcopy(session)
+
+    def _drop_all(self) -> None:
+        with self.lock:
+            self.users.clear()
+            self.sessions.clear()
+
+class SyntheticPopulation:
+    """
+    Synthetic users shared between a number of guilds, with a configurable status mix and activity churn
+    """
+
+    def __init__(self, members: int, guilds: int, shared: float, status_mix: Dict[str, float], activities: int, seed: int) -> None:
+        self.random: Random = Random(seed)
+        self.status_mix: Dict[str, float] = status_mix
+        self.activity_names: List[str] = [f"Game {i}" for i in range(activities)]
+
+        self.guilds: List[SimpleNamespace] = []
+        self.members_by_user: Dict[int, List[SimpleNamespace]] = {}
+
+        for guild_index in range(guilds):
+            guild: SimpleNamespace = SimpleNamespace(id=guild_index + 1, name=f"Guild {guild_index + 1}", members=[])
+            guild.get_member = lambda user_id, guild=guild: next((member for member in guild.members if member.id == user_id), None)
+
+            self.guilds.append(guild)
+
+        # Every user joins one guild, and `shared` of them also join every other guild
+        for user_id in range(1, members + 1):
+            home: SimpleNamespace = self.guilds[user_id % guilds]
+            user_guilds: List[SimpleNamespace] = self.guilds if self.random.random() < shared else [home]
+
+            status, activities = self._random_presence()
+
+            for guild in user_guilds:
+                member: SimpleNamespace = SimpleNamespace(id=user_id, name=f"user{user_id}", bot=False, guild=guild,
+                                                          status=SimpleNamespace(name=status), activities=activities)
+
+                guild.members.append(member)
+                self.members_by_user.setdefault(user_id, []).append(member)
+
+    def _random_presence(self) -> Tuple[str, List[SimpleNamespace]]:
+        status: str = self.random.choices(list(self.status_mix), weights=list(self.status_mix.values()))[0]
+
+        if status == "offline": return status, []
+
+        return status, [SimpleNamespace(name=name) for name in self.random.sample(self.activity_names, self.random.randint(0, 2))]
+
+    def churn(self, fraction: float) -> int:
+        """
+        Gives `fraction` of users a new random presence, returns how many changed
+        """
+
+        changed_user_ids: List[int] = self.random.sample(list(self.members_by_user), int(len(self.members_by_user) * fraction))
+
+        for user_id in changed_user_ids:
+            status, activities = self._random_presence()
+
+            for member in self.members_by_user[user_id]:
+                member.status = SimpleNamespace(name=status)
+                member.activities = activities
+
+        return len(changed_user_ids)
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_benchmark(members: int, guilds: int, sweeps: int, churn: float, shared: float, status_mix: Dict[str, float],
+                  activities: int, workers: int, seed: int, cache_size: int = DEFAULT_CACHE_SIZE) -> Dict:
+    population: SyntheticPopulation = SyntheticPopulation(members, guilds, shared, status_mix, activities, seed)
+    database_manager: MemoryDatabaseManager = MemoryDatabaseManager(cache_size=cache_size)
+
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sweep")
+    member_locks: List[Lock] = [Lock() for _ in range(ActivityManager.MEMBER_LOCK_STRIPES)]
+    skip_list: SkipList = SkipList(checkpoint_interval=3600)
+    member_registry: MemberRegistry = MemberRegistry(cycle_length=3600, get_guild={guild.id: guild for guild in population.guilds}.get)
+
+    servers: List[Server] = [
+        Server(database_manager, guild, 0, lambda activity_name: activity_name, executor, workers * 4, member_locks, skip_list, member_registry)
+        for guild in population.guilds
+    ]
+
+    memberships: int = sum(len(guild.members) for guild in population.guilds)
+    start_time: float = perf_counter()
+
+    for sweep in range(sweeps):
+        if sweep > 0:
+            population.churn(churn)
+
+        # Each pass over every server is a new sweep cycle
+        member_registry.claims.clear()
+
+        for server in servers:
+            server.sweep()
+
+        database_manager.flush()
+
+    wall_time: float = perf_counter() - start_time
+    executor.shutdown()
+    database_manager.close()
+
+    return {
+        "commit": _git_commit(),
+        "parameters": {"members": members, "guilds": guilds, "sweeps": sweeps, "churn": churn, "shared": shared,
+                       "status_mix": status_mix, "activities": activities, "workers": workers, "seed": seed, "cache_size": cache_size},
+        "wall_time_s": wall_time,
+        "members_per_s": memberships * sweeps / wall_time,
+        "db_ops_per_member": database_manager.operations / (memberships * sweeps),
+        "db_bytes_per_member": database_manager.bytes / (memberships * sweeps),
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "cache_evictions": database_manager.cache.evictions
+    }
+
+RESULT_FIELDS: Tuple[Tuple[str, str, bool], ...] = (
+    # field, label, higher is better
+    ("members_per_s", "Members/s", True),
+    ("db_ops_per_member", "DB ops/member", False),
+    ("db_bytes_per_member", "DB bytes/member", False),
+    ("peak_memory_mb", "Peak memory (MB)", False),
+    ("wall_time_s", "Wall time (s)", False)
+)
+
+def print_results(results: Dict, baseline: Dict | None = None) -> None:
+    print(f"Commit {results['commit']}: {json.dumps(results['parameters'])}")
+
+    if baseline is not None and baseline["parameters"] != results["parameters"]:
+        print(f"Warning: baseline ({baseline['commit']}) was run with different parameters: {json.dumps(baseline['parameters'])}")
+
+    for field, label, higher_is_better in RESULT_FIELDS:
+        line: str = f"  {label:<18} {results[field]:>12.2f}"
+
+        if baseline is not None and baseline[field] != 0:
+            change: float = (results[field] - baseline[field]) / baseline[field] * 100
+            worse: bool = change < 0 if higher_is_better else change > 0
+
+            line += f"   {change:+.1f}% vs {baseline['commit']}{'  (regression)' if worse and abs(change) >= 5 else ''}"
+
+        print(line)
+
+    print(f"  {'Cache evictions':<18} {results.get('cache_evictions', 0):>12.0f}")
+
+def _parse_status_mix(text: str) -> Dict[str, float]:
+    status_mix: Dict[str, float] = {}
+
+    for part in text.split(","):
+        status, weight = part.split("=")
+
+        if status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}', expected one of {', '.join(STATUSES)}")
+
+        status_mix[status] = float(weight)
+
+    return status_mix
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser(description="Benchmark sweeps against synthetic guilds and an in-memory database")
+    parser.add_argument("--members", type=int, default=5000, help="unique users")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--sweeps", type=int, default=5)
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of users whose presence changes between sweeps")
+    parser.add_argument("--shared", type=float, default=0.1, help="fraction of users in every guild")
+    parser.add_argument("--status-mix", type=_parse_status_mix, default="online=0.3,idle=0.1,dnd=0.1,offline=0.5")
+    parser.add_argument("--activities", type=int, default=50, help="distinct activity names")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="users kept in the write-back cache, defaults to the bot's")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    logging.root.setLevel(logging.WARNING)
+
+    baseline: Dict | None = None
+
+    if args.compare is not None:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # A new process per run, since peak memory is read from the process' high-water mark, which never goes down
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn"), max_tasks_per_child=1,
+                             initializer=logging.root.setLevel, initargs=(logging.WARNING,)) as executor:
+        results: Dict = executor.submit(run_benchmark, args.members, args.guilds, args.sweeps, args.churn, args.shared, args.status_mix,
+                                        args.activities, args.workers, args.seed, args.cache_size).result()
+
+        # Tracked users are never evicted, so this run loads every user into a cache that is already full
+        results["over_cache"] = executor.submit(run_benchmark, int(args.cache_size * OVER_CACHE_FACTOR), args.guilds, args.sweeps, args.churn,
+                                                args.shared, args.status_mix, args.activities, args.workers, args.seed, args.cache_size).result()
+
+    print_results(results, baseline)
+
+    print("\nTracking more users than the cache holds:")
+    print_results(results["over_cache"], None if baseline is None else baseline.get("over_cache"))
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
@@ -1,24 +1,31 @@
 import logging
 import asyncio
 
-from discord import app_commands, activity, Intents, Interaction, Guild, Message, Member, Status, File
+from discord import app_commands, activity, Intents, Interaction, Guild, Member, Status, File
 from discord.ext import commands
 
-from os import remove, execv
+from os import execv
 from sys import executable, argv
-from threading import Thread
-from time import time, sleep
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from io import BytesIO
+from time import time, perf_counter
 from datetime import datetime
+from random import uniform
+from functools import partial
 from dateutil.relativedelta import relativedelta
 
-from database import DatabaseManager
+from database import DatabaseManager, create_database_manager
 from analytics import GraphManager
+from render_service import RenderService, RenderError, RenderBusy, RenderTimeout
+from image_cache import ImageCache
+from startup import StartupTimer
+from activity_normalizer import ActivityNormalizer
+from checkpoint import save_checkpoint, load_checkpoint
+from metrics import MetricsServer, SWEEP_DURATION, SWEEP_MEMBERS, SWEEP_LAG, SWEEP_OVERRUNS, MEMBER_LATENCY, PRESENCE_UPDATES, DB_OPERATIONS, DB_ERRORS, GRAPH_RENDER_DURATION
 from yaml import safe_load
-from json import loads as parse_json
 
-from webserver import WebServer
-
-from typing import List, Dict
+from typing import List, Dict, Set, Tuple, Iterable, FrozenSet
 
 
 logging.basicConfig()
@@ -34,7 +41,7 @@ class ActivityBot(commands.Bot):
     Discord activity bot
     """
 
-    def __init__(self, config_path: str) -> None:
+    def __init__(self, config_path: str, startup_timer: StartupTimer | None = None) -> None:
         """
         intents:
             Read Messages / View Channels
@@ -43,6 +50,8 @@ class ActivityBot(commands.Bot):
         """
         global DEBUG
 
+        self.startup_timer: StartupTimer = startup_timer or StartupTimer()
+
         self.CONFIG: Dict = self._load_cfg(config_path)
         self.TOKEN: str = self.__get_token()
 
@@ -59,15 +68,28 @@ class ActivityBot(commands.Bot):
         
         super().__init__(intents=intents, command_prefix="^")
 
-        self.database_manager: DatabaseManager = DatabaseManager()
+        self.database_manager: DatabaseManager = create_database_manager(self.CONFIG)
+        self.startup_timer.mark("connect")
+
         self.activity_manager: ActivityManager = ActivityManager(self)
         self.graph_manager: GraphManager = GraphManager(self.database_manager)
+        self.render_service: RenderService = RenderService(self.CONFIG['render_workers'], self.CONFIG['render_timeout'], self.CONFIG['max_queued_renders'],
+                                                           ImageCache(self.CONFIG['image_cache_size_mb'] * 1024 * 1024, self.CONFIG['image_cache_ttl']))
         
+        # The web server serves /metrics itself, otherwise a standalone endpoint is started
+        if self.CONFIG['enable_metrics'] and not self.ENABLE_WEBSERVER:
+            MetricsServer(self.CONFIG['metrics_port']).run()
+
         if self.ENABLE_WEBSERVER:
-            self.web_server: Thread = Thread(target=lambda: WebServer(self.graph_manager, self.WEBSERVER_PORT))
+            # Flask is only imported when the web server is enabled
+            from webserver import WebServer
+
+            self.web_server: Thread = Thread(target=lambda: WebServer(self.graph_manager, self.render_service, self.WEBSERVER_PORT))
             self.web_server.start()
         
         self.running: bool = False
+        self.shut_down: bool = False
+        self.restart_requested: bool = False
         self.init_time = time()
 
         asyncio.run(self.__init_cogs())
@@ -94,33 +116,278 @@ class ActivityBot(commands.Bot):
         with open(path, "r") as cfg:
             return safe_load(cfg.read())
 
+    async def shutdown(self) -> None:
+        """
+        Drains the sweeps and queued presence updates, writes back everything pending and checkpoints
+        which users were being tracked, so the next process can credit the time across the restart
+        """
+
+        if self.shut_down: return
+
+        self.shut_down = True
+
+        await asyncio.to_thread(self.activity_manager.drain)
+        await asyncio.to_thread(self.database_manager.close)
+
+        self.render_service.close()
+
+        # Only written once everything is flushed, so every checkpointed time matches a stored last_update
+        save_checkpoint(self.CONFIG['tracking_checkpoint_path'], self.activity_manager.skip_list.checkpoint())
+
+    async def close(self) -> None:
+        await self.shutdown()
+
+        await super().close()
+
+    async def restart(self) -> None:
+        # The process is replaced once run() returns, after the client has shut down cleanly
+        self.restart_requested = True
+
+        await self.close()
+
+    async def restart_timer(self) -> None:
+        await asyncio.sleep(max(0, self.init_time + self.RESTART_HOUR_TIMER * 60 * 60 - time()))
+
+        logging.warning(f"Reason for restart: Time since bot initialization > {self.RESTART_HOUR_TIMER} hours!")
+
+        await self.restart()
+
     def run_activity_manager(self) -> None:
         self.activity_manager.main()
 
     def main(self) -> None:
         self.run(self.TOKEN)
 
+        if self.restart_requested:
+            logging.warning("Bot is restarting... Command: \"execv(executable, ['python'] + argv)\"")
+            execv(executable, ['python'] + argv)
+
+class MemberFingerprint:
+    """
+    A members presence as of their last update
+    """
+
+    __slots__ = ("fingerprint", "since", "member", "server")
+
+    def __init__(self, fingerprint: Tuple, since: float, member: Member, server: "Server") -> None:
+        self.fingerprint: Tuple = fingerprint
+        self.since: float = since
+        self.member: Member = member
+        self.server: Server = server
+
+class SkipList:
+    """
+    Remembers every members presence as of their last update. Sweeps skip members whose presence hasn't changed,
+    and their time keeps accruing from `since` until it is credited on a change, on a read or at the next checkpoint.
+    """
+
+    MATERIALIZE_MIN_AGE: int = 60 # members updated more recently than this are not materialized on read (secs)
+
+    def __init__(self, checkpoint_interval: float, resumed: Dict[int, float] | None = None) -> None:
+        self.checkpoint_interval: float = checkpoint_interval
+        self.entries: Dict[int, MemberFingerprint] = {}
+
+        # {user id: since} carried over from the previous process, until each user is processed again
+        self.resumed: Dict[int, float] = resumed or {}
+
+    def record(self, member: Member, fingerprint: Tuple, since: float, server: "Server") -> None:
+        self.entries[member.id] = MemberFingerprint(fingerprint, since, member, server)
+        self.resumed.pop(member.id, None)
+
+    def checkpoint(self) -> Dict[int, float]:
+        # Resumed users this process never saw aren't carried over, they were not tracked here
+        return {user_id: entry.since for user_id, entry in list(self.entries.items())}
+
+    def should_skip(self, member_id: int, fingerprint: Tuple, now: float) -> bool:
+        entry: MemberFingerprint | None = self.entries.get(member_id)
+
+        if entry is None or entry.fingerprint != fingerprint: return False
+
+        return now - entry.since < self.checkpoint_interval
+
+    def is_tracked(self, member_id: int, last_update: float) -> bool:
+        """
+        Whether the member has been watched since `last_update`, in which case all of that time can be credited
+        """
+
+        entry: MemberFingerprint | None = self.entries.get(member_id)
+
+        if entry is None: return self.resumed.get(member_id) == last_update
+
+        return entry.since == last_update
+
+    def materialize(self, user_ids: Iterable[int]) -> None:
+        """
+        Credits the time accrued by skipped members, so reads of a single user see up to date totals
+        """
+
+        now: float = time()
+
+        for user_id in user_ids:
+            entry: MemberFingerprint | None = self.entries.get(user_id)
+
+            if entry is not None and now - entry.since >= self.MATERIALIZE_MIN_AGE:
+                entry.server.process_member(entry.member)
+
+    def pending_time(self, user_ids: List[int]) -> Dict[int, Tuple[str, FrozenSet[str], float]]:
+        """
+        Returns {user id: (status, activity names, minutes)} accrued by skipped members since they were last credited.
+        Reads over a whole guild add it to what they read rather than processing and writing every member.
+        """
+
+        now: float = time()
+        pending: Dict[int, Tuple[str, FrozenSet[str], float]] = {}
+
+        for user_id in user_ids:
+            entry: MemberFingerprint | None = self.entries.get(user_id)
+
+            if entry is None: continue
+
+            status, activity_names, _ = entry.fingerprint
+            pending[user_id] = (status, activity_names, max(0, now - entry.since) / 60)
+
+        return pending
+
+class MemberRegistry:
+    """
+    Indexes which members each guild has, and makes sure a user shared by several guilds is only processed once
+    per sweep cycle, using the guild that most recently saw their presence change
+    """
+
+    CLAIM_MARGIN: float = 0.05 # fraction of a cycle left unclaimed, for sweeps that start early or run longer than the last
+
+    def __init__(self, cycle_length: float, get_guild: callable) -> None:
+        self.cycle_length: float = cycle_length
+        self.get_guild: callable = get_guild
+
+        self.lock: Lock = Lock()
+        self.claims: Dict[int, float] = {}
+        self.presence_guilds: Dict[int, int] = {}
+        self.members_by_guild: Dict[int, List[int]] = {}
+
+    def claim(self, member_id: int, now: float) -> bool:
+        """
+        Returns False if another guild already processed the member this cycle
+        """
+
+        with self.lock:
+            if now - self.claims.get(member_id, 0) < self.cycle_length: return False
+
+            self.claims[member_id] = now
+
+            return True
+
+    def note_presence(self, member: Member) -> None:
+        self.presence_guilds[member.id] = member.guild.id
+
+    def freshest_member(self, member: Member) -> Member:
+        guild_id: int | None = self.presence_guilds.get(member.id)
+
+        if guild_id is None or guild_id == member.guild.id: return member
+
+        guild: Guild | None = self.get_guild(guild_id)
+        fresh_member: Member | None = None if guild is None else guild.get_member(member.id)
+
+        return member if fresh_member is None else fresh_member
+
+    def set_guild_members(self, guild_id: int, member_ids: List[int]) -> None:
+        self.members_by_guild[guild_id] = member_ids
+
+    def get_member_ids(self, guild: Guild) -> List[int]:
+        """
+        Non-bot member ids of the guild as of its last sweep, scanning the guild if it hasn't been swept yet
+        """
+
+        member_ids: List[int] | None = self.members_by_guild.get(guild.id)
+
+        if member_ids is None:
+            member_ids = [member.id for member in guild.members if not member.bot]
+
+        return member_ids
+
 class Server:
     """
     Guild parent. Manages values like sweep time.
     """
 
-    SWEEP_INTERVAL: int = 1 # Should be 5 (mins)
+    STALE_UPDATE_TIME: int = 60 * 20 # time since a users last update after which it is not credited (secs)
 
-    def __init__(self, database_manager: DatabaseManager, guild: Guild, offset: int, get_real_activity: callable) -> None:
+    def __init__(self, database_manager: DatabaseManager, guild: Guild, offset: float, get_real_activity: callable,
+                 executor: ThreadPoolExecutor, max_pending: int, member_locks: List[Lock], skip_list: SkipList,
+                 member_registry: MemberRegistry) -> None:
         self.database_manager: DatabaseManager = database_manager
         self.guild: Guild = guild
         self.get_real_activity: callable = get_real_activity
 
+        self.executor: ThreadPoolExecutor = executor
+        self.max_pending: int = max_pending
+        self.member_locks: List[Lock] = member_locks
+        self.skip_list: SkipList = skip_list
+        self.member_registry: MemberRegistry = member_registry
+
+        # Completed sweeps, the version of the server's stats for cached graphs
+        self.sweep_count: int = 0
+
+        # Scheduling, managed by SweepManager. The first sweep waits `offset` secs, so servers don't all start at once
+        self.next_sweep: float = time() + offset
+        self.last_sweep_time: float = 0
+        self.last_sweep_duration: float = 0
+        self.lag: float = 0
+
+    def fingerprint(self, member: Member) -> Tuple:
+        activity_names: List[str] = [self.get_real_activity(activity.name) for activity in member.activities if activity.name is not None]
+
+        return (member.status.name, frozenset(name for name in activity_names if name != ""), member.name)
+
     def process_member(self, member: Member) -> None:
+        """
+        Credits the time since the members last update to the status and activities in `member`, closing sessions
+        for activities it no longer has and opening ones for new activities
+        """
+
+        with self._member_lock(member.id):
+            self._process_member(member)
+
+    def process_presence_change(self, before: Member, after: Member) -> None:
+        """
+        Credits the time since the last update to the presence the member had before the change, then opens
+        sessions for the activities they have now
+        """
+
+        with self._member_lock(after.id):
+            entry: MemberFingerprint | None = self.skip_list.entries.get(after.id)
+
+            # discord.py sends the event once for every guild shared with the member, so every copy after
+            # the first finds the new presence already recorded
+            if entry is not None and entry.fingerprint == self.fingerprint(after): return
+
+            # Time since the last update belongs to the presence that was recorded, so a `before` that doesn't
+            # match it (e.g. a copy delayed behind a later change) isn't credited or allowed to close sessions
+            if entry is None or entry.fingerprint == self.fingerprint(before):
+                self._process_member(before)
+
+            self._process_member(after)
+
+    def _member_lock(self, member_id: int) -> Lock:
+        # Presence events and sweeps can process the same member at once, so each member is serialised by a striped lock
+        return self.member_locks[member_id % len(self.member_locks)]
+
+    @MEMBER_LATENCY.timed()
+    def _process_member(self, member: Member) -> None:
         self.database_manager.add_user(member.id)
 
-        user_data: Dict = self.database_manager.get_user_time_dict(member.id)
-        user_simple_time: Dict[str, float] = user_data["simple_time"]
+        last_update: float = self.database_manager.get_user_last_update(member.id)
+        curr_time: float = time()
 
-        if time() - user_data["last_update"] > 60 * 20: # if the user has not been updated in the last 20 mins, do not update in case of bot crash
-            user_data["last_update"] = time()
-        
+        if curr_time - last_update > self.STALE_UPDATE_TIME: # if the user has not been updated in the last 20 mins, do not update in case of bot crash
+            # Skipped members were watched the whole time, so only untracked gaps are dropped
+            if not self.skip_list.is_tracked(member.id, last_update):
+                last_update = curr_time
+
+        minutes: float = (curr_time - last_update) / 60
+        status: str = member.status.name
+
+        active_sessions: Dict[str, str] = self.database_manager.get_active_session_names(member.id)
         used_active_sessions = []
 
         for activity in member.activities:
@@ -130,42 +397,92 @@ class Server:
 
             if real_activity_name == "": continue
 
-            activity_time: Dict[str, float] = self.database_manager.get_user_rich_time_dict(member.id, real_activity_name)
-            activity_time[member.status.name] += (time() - user_data["last_update"]) / 60
-
-            self.database_manager.update_user_rich_presence_time(member.id, real_activity_name, activity_time)
+            self.database_manager.increment_user_rich_presence_time(member.id, real_activity_name, status, minutes)
 
             # Session updating
-            ret_status, session_id = self.database_manager.update_user_session(member.id, real_activity_name, member.status.name)
+            session_id: str = ""
+
+            for active_session_id, session_name in active_sessions.items():
+                if session_name == real_activity_name:
+                    session_id = active_session_id
+                    break
 
-            if ret_status == False or session_id == "": # Activity not present
-                session_id = self.database_manager.new_user_session(member.id, real_activity_name, member.status.name)
+            if session_id == "": # Activity not present
+                session_id = self.database_manager.new_user_session(member.id, real_activity_name, status, minutes)
+                active_sessions[session_id] = real_activity_name
+            else:
+                self.database_manager.update_session(member.id, session_id, status, minutes)
 
             used_active_sessions.append(session_id)
 
-        for session_id in self.database_manager.get_active_sessions(member.id):
+        for session_id in active_sessions:
             if session_id not in used_active_sessions:
                 self.database_manager.remove_active_session_id(member.id, session_id)
 
-        user_simple_time[member.status.name] += (time() - user_data["last_update"]) / 60
-
-        self.database_manager.update_user_simple_time(member.id, user_simple_time)
+        self.database_manager.increment_user_simple_time(member.id, status, minutes)
         self.database_manager.update_user_username(member.id, member.name)
-        self.database_manager.set_user_last_update(member.id) # Very important
+        self.database_manager.set_user_last_update(member.id, curr_time) # Very important
 
+        self.skip_list.record(member, self.fingerprint(member), curr_time, self)
 
-    def sweep(self) -> Dict[int, Dict]:
-        threads = []
+    def _collect(self, futures: Set[Future]) -> None:
+        for future in futures:
+            if future.exception() is not None:
+                logging.error(f"[SWEEP THREAD] Error while processing member in '{self.guild.name}'! Error: {str(future.exception())}")
+
+    def sweep(self) -> None:
+        """
+        Processes every member on the shared worker pool. At most max_pending members are queued at once,
+        so a huge guild waits for workers instead of flooding the pool.
+        """
+
+        start_time: float = perf_counter()
+        pending: Set[Future] = set()
+        member_count: int = 0
+        skipped_count: int = 0
+        shared_count: int = 0
+
+        # Members are loaded in bulk the first time they're seen and kept in memory after that,
+        # so processing them only ever writes
+        member_ids: List[int] = [member.id for member in self.guild.members if not member.bot]
+        self.database_manager.track_users(member_ids)
 
         for member in self.guild.members:
             if member.bot: continue
+
             if DEBUG and ("captaindeathead" not in member.name): continue
 
-            threads.append(Thread(target=lambda member=member: self.process_member(member)))
-            threads[-1].start()
+            if self.skip_list.should_skip(member.id, self.fingerprint(member), time()):
+                skipped_count += 1
+                continue
+
+            if not self.member_registry.claim(member.id, time()):
+                shared_count += 1
+                continue
+
+            member = self.member_registry.freshest_member(member)
+
+            if len(pending) >= self.max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(done)
+
+            pending.add(self.executor.submit(self.process_member, member))
+            member_count += 1
+
+        done, _ = wait(pending)
+        self._collect(done)
 
-        for thread in threads:
-            thread.join()
+        self.member_registry.set_guild_members(self.guild.id, member_ids)
+        self.sweep_count += 1
+
+        wall_time: float = perf_counter() - start_time
+
+        SWEEP_DURATION.observe(wall_time, guild=self.guild.id)
+        SWEEP_MEMBERS.inc(member_count, outcome="processed")
+        SWEEP_MEMBERS.inc(skipped_count, outcome="unchanged")
+        SWEEP_MEMBERS.inc(shared_count, outcome="shared")
+
+        logging.info(f"[SWEEP THREAD] Swept {member_count} members of '{self.guild.name}' in {wall_time:.2f}s ({member_count / max(wall_time, 1e-6):.1f} members/s), skipped {skipped_count} unchanged members and {shared_count} already swept in another server")
 
 class CommandsManager(commands.Cog):
     """
@@ -179,6 +496,34 @@ class CommandsManager(commands.Cog):
 
         self.graph_manager: GraphManager = graph_manager
 
+    async def render(self, key: Tuple, version: callable, graph: callable, *args) -> bytes | str:
+        """
+        Gathers the graph's data off the event loop and awaits the render workers drawing it, unless it is cached
+        for the current version() of its data. Returns the PNG bytes, or the reason there is nothing to draw.
+        """
+
+        return await self.bot.render_service.render_cached(key, version, graph, *args)
+
+    def user_version(self, user_id: int) -> callable:
+        return partial(self.bot.database_manager.get_user_version, user_id)
+
+    def server_version(self, guild: Guild) -> callable:
+        return partial(self.bot.activity_manager.get_server_version, guild.id)
+
+    async def cog_app_command_error(self, interaction: Interaction, error: app_commands.AppCommandError) -> None:
+        error = getattr(error, "original", error)
+
+        if not isinstance(error, RenderError): raise error
+
+        logging.warning(f"[RENDER] {str(error)}")
+
+        if isinstance(error, RenderBusy):
+            await interaction.followup.send("Too many graphs are being drawn right now, please try again in a moment.")
+        elif isinstance(error, RenderTimeout):
+            await interaction.followup.send("Drawing the graph took too long, please try again later.")
+        else:
+            await interaction.followup.send("Unknown error - An error occured during the graphs creation, please try again.")
+
     def format_time_since(self, old_time_since_epoch: int) -> str:
         old = datetime.fromtimestamp(old_time_since_epoch)
         now = datetime.now()
@@ -206,6 +551,9 @@ class CommandsManager(commands.Cog):
 
     @commands.Cog.listener("on_presence_update")
     async def on_presence_update(self, before: Member, after: Member) -> None:
+        if self.bot.running:
+            self.bot.activity_manager.handle_presence_update(before, after)
+
         if before.status == after.status:
             return
 
@@ -221,7 +569,7 @@ class CommandsManager(commands.Cog):
     async def ping(self, interaction: Interaction):
         logging.info("Recieved 'ping' command...")
 
-        return await interaction.response.send_message("`🟢 Activity bot is online...`")
+        return await interaction.response.send_message(f"`🟢 Activity bot is online...`\n```{self.bot.activity_manager.status_summary()}```")
     
     @app_commands.command(name="help", description="Get instructions on how to use the bot.")
     async def help(self, interaction: Interaction):
@@ -269,14 +617,12 @@ class CommandsManager(commands.Cog):
             await interaction.followup.send(f"{username} is banned from Activity Bot. If you feel this is a mistake, please DM @captaindeathead for assistance.")
             return
 
-        graph_file: str = self.graph_manager.get_user_simple_time(user_id, username)
+        graph: bytes | str = await self.render((user_id, username), self.user_version(user_id), self.graph_manager.get_user_simple_time, user_id, username)
 
-        if graph_file == "":
+        if graph == "":
             await interaction.followup.send(f"{username} is not found in the database. Please DM @captaindeathead for assistance.")
         else:
-            await interaction.followup.send(file=File(graph_file))
-
-        remove(graph_file)
+            await interaction.followup.send(file=File(BytesIO(graph), filename=f"{user_id}_simple_times.png"))
 
     @app_commands.command(name="server_simple_status", description="Graph of time spent in the server.")
     async def server_simple_status(self, interaction: Interaction):
@@ -291,21 +637,17 @@ class CommandsManager(commands.Cog):
         if server is None:
             return await interaction.followup.send("Server not found.")
 
-        member_list = []
-        for member in server.members:
-            if not member.bot: member_list.append(member.id)
+        member_list: List[int] = self.bot.activity_manager.member_registry.get_member_ids(server)
 
         if len(member_list) == 0:
             return await interaction.followup.send("Guild info not found!")
 
-        graph_file = self.graph_manager.get_server_simple_time(member_list, server_name)
-
-        if graph_file == "":
-            return await interaction.followup.send("Unknown error - Graph file not found!\nThis is likely because an error occured during the graphs creation.")
+        graph: bytes | str = await self.render((server.id, server_name), self.server_version(server), self.graph_manager.get_server_simple_time, member_list, server_name)
 
-        await interaction.followup.send(file=File(graph_file))
+        if graph == "":
+            return await interaction.followup.send(f"No activity has been recorded in {server_name} yet.")
 
-        remove(graph_file)
+        await interaction.followup.send(file=File(BytesIO(graph), filename=f"{server.id}_server_simple.png"))
 
     @app_commands.command(name="rich_status", description="Graph of time spent on a users rich presence.")
     async def rich_status_graph(self, interaction: Interaction, user: Member | None = None, presence: str | None = None):
@@ -324,23 +666,30 @@ class CommandsManager(commands.Cog):
             return
 
         if isinstance(presence, str):
-            graph_file: str = self.graph_manager.get_user_rich_time_specific(user_id, username, presence)
+            graph: bytes | str = await self.render((user_id, username, presence), self.user_version(user_id), self.graph_manager.get_user_rich_time_specific, user_id, username, presence)
         else:
-            graph_file: str = self.graph_manager.get_user_rich_time(user_id, username)
+            graph: bytes | str = await self.render((user_id, username), self.user_version(user_id), self.graph_manager.get_user_rich_time, user_id, username)
 
-        if graph_file == "":
+        if graph == "":
             await interaction.followup.send(f"{username} is not found in the database. Please DM @captaindeathead for assistance.")
-            return
-        elif graph_file == "no_best_activity":
+        elif graph == "no_best_activity":
             await interaction.followup.send(f"'{presence}' was not found in {username}'s rich activities! Try a different query (Type '/help' for info).")
-            return
         else:
-            await interaction.followup.send(file=File(graph_file))
+            await interaction.followup.send(file=File(BytesIO(graph), filename=f"{user_id}_rich_times.png"))
+
+    @rich_status_graph.autocomplete("presence")
+    async def presence_autocomplete(self, interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
+        user: Member | None = getattr(interaction.namespace, "user", None)
+        user_id: int = interaction.user.id if user is None else user.id
 
-        remove(graph_file)
+        activity_names: List[str] = await asyncio.to_thread(self.graph_manager.activity_index.search, current, user_id, 25)
+
+        # Discord caps choices at 100 characters
+        return [app_commands.Choice(name=activity_name[:100], value=activity_name[:100]) for activity_name in activity_names]
 
     @app_commands.command(name="rich_status_table", description="Table of time spent on a users rich presence.")
-    async def rich_status_table(self, interaction: Interaction, user: Member | None = None):
+    @app_commands.describe(page="Page of the table, 25 activities per page", top="Only rank the top (x) activities")
+    async def rich_status_table(self, interaction: Interaction, user: Member | None = None, page: int = 1, top: int | None = None):
         await interaction.response.defer()
 
         logging.info("Recieved 'rich_status_table' command...")
@@ -355,21 +704,20 @@ class CommandsManager(commands.Cog):
             await interaction.followup.send(f"{username} is banned from Activity Bot. If you feel this is a mistake, please DM @captaindeathead for assistance.")
             return
 
-        table: str = self.graph_manager.get_user_rich_time_table(user_id, username)
+        top = None if top is None else max(top, 1)
+
+        table: bytes | str = await self.render((user_id, username, page, top), self.user_version(user_id), self.graph_manager.get_user_rich_time_table, user_id, username, page, top)
 
         if table == "":
             await interaction.followup.send(f"{username} is not found in the database. Please DM @captaindeathead for assistance.")
-            return
         elif table == "user_no_status":
             await interaction.followup.send(f"{username} has no status's recorded.")
-            return
         else:
-            await interaction.followup.send("Note: If you are on desktop, click on the image and select `Open in browser` to zoom in.", file=File(table))
-
-        remove(table)
+            await interaction.followup.send("Note: If you are on desktop, click on the image and select `Open in browser` to zoom in.", file=File(BytesIO(table), filename=f"{user_id}_rich_times_table.png"))
 
     @app_commands.command(name="server_rich_status", description="Graph / table of time a server spends on each rich presence.")
-    async def rich_server_graph(self, interaction: Interaction, table: bool = False):
+    @app_commands.describe(page="Page of the table, 25 activities per page", top="Only rank the top (x) activities in the table")
+    async def rich_server_graph(self, interaction: Interaction, table: bool = False, page: int = 1, top: int | None = None):
         await interaction.response.defer()
 
         logging.info(f"Recieved 'server_rich_status' command...")
@@ -381,36 +729,25 @@ class CommandsManager(commands.Cog):
         if server is None:
             return await interaction.followup.send("Server not found.")
 
-        member_list = []
-        for member in server.members:
-            if not member.bot: member_list.append(member.id)
+        member_list: List[int] = self.bot.activity_manager.member_registry.get_member_ids(server)
         
         if member_list == []:
             return await interaction.followup.send("Guild info not found!")
         
+        top = None if top is None else max(top, 1)
+
         if table:
-            return_filename = self.graph_manager.get_server_rich_time_table(member_list, server_name)
+            graph: bytes | str = await self.render((server.id, server_name, page, top), self.server_version(server), self.graph_manager.get_server_rich_time_table, member_list, server_name, page, top)
         else:
-            return_filename = self.graph_manager.get_server_rich_time(member_list, server_name)
+            graph: bytes | str = await self.render((server.id, server_name), self.server_version(server), self.graph_manager.get_server_rich_time, member_list, server_name)
 
-        if return_filename == "":
-            return await interaction.followup.send("Unknown error - Graph file not found!\nThis is likely because an error occured during the graphs creation.")
+        if graph == "":
+            return await interaction.followup.send(f"No activity has been recorded in {server_name} yet.")
         
         if table:
-            await interaction.followup.send("Note: If you are on desktop, click on the image and select `Open in browser` to zoom in.", file=File(return_filename))
+            await interaction.followup.send("Note: If you are on desktop, click on the image and select `Open in browser` to zoom in.", file=File(BytesIO(graph), filename=f"{server.id}_rich_times_table.png"))
         else:
-            await interaction.followup.send(file=File(return_filename))
-
-        remove(return_filename)
-
-    @commands.Cog.listener()
-    async def on_message(self, message: Message) -> None:
-        if time() - self.bot.init_time >= self.bot.RESTART_HOUR_TIMER * 60 * 60: # 2 hours = 2 * 60 mins * 60 secs
-            logging.warning("Bot is restarting... Reason: Time since bot initialization > 2 hours! Command: \"execv(executable, ['python'] + argv)\". Waiting 5 mins before proceding...")
-            
-            self.bot.init_time = time()
-            await asyncio.sleep(60*5) # wait 5 mins before restart
-            await execv(executable, ['python'] + argv)
+            await interaction.followup.send(file=File(BytesIO(graph), filename=f"{server.id}_server_rich.png"))
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -419,6 +756,7 @@ class CommandsManager(commands.Cog):
         await self.bot.tree.sync()
 
         self.bot.running = True
+        self.bot.startup_timer.mark("login")
 
         logging.info(f"Bot successfully started as {self.bot.user}.")
 
@@ -426,42 +764,118 @@ class CommandsManager(commands.Cog):
 
         self.bot.run_activity_manager()
 
+        self.bot.restart_task = asyncio.create_task(self.bot.restart_timer())
+
 class SweepManager:
     """
-    Waits, and triggers sweeps on each server when the time comes
+    Schedules reconciliation sweeps, crediting time to members whose presence hasn't changed.
+    Every server is swept once per reconcile_interval (give or take the jitter), and up to max_concurrent_sweeps
+    servers are swept at once. Presence changes themselves are credited as they happen.
     """
 
-    def __init__(self, update_servers: callable) -> None:
+    SCHEDULER_TICK: float = 1 # max time between scheduling checks (secs)
+
+    def __init__(self, update_servers: callable, startup_timer: StartupTimer, reconcile_interval: float,
+                 sweep_jitter: float, max_concurrent_sweeps: int, take_presence_update_count: callable) -> None:
         self.update_servers: callable = update_servers
+        self.startup_timer: StartupTimer = startup_timer
+        self.reconcile_interval: float = reconcile_interval
+        self.sweep_jitter: float = sweep_jitter
+        self.max_concurrent_sweeps: int = max_concurrent_sweeps
+        self.take_presence_update_count: callable = take_presence_update_count
+
+        if self.reconcile_interval >= Server.STALE_UPDATE_TIME:
+            logging.warning(f"[SWEEP THREAD] reconcile_interval ({self.reconcile_interval}s) is not below {Server.STALE_UPDATE_TIME}s, so idle members will not be credited!")
 
         self.servers: List[Server] = update_servers()
 
+        # Server sweeps wait on member work in the sweep pool, so they need a pool of their own
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self.max_concurrent_sweeps, thread_name_prefix="guild-sweep")
+        self.running: Dict[int, Future] = {}
+
         self.thread: Thread = Thread(target=self.main)
         self.alive: bool = True
+        self.killed: Event = Event()
 
         self.stopped: bool = False
 
     def kill(self) -> None:
         self.alive = False
+        self.killed.set()
 
         logging.warning(f"[SWEEP MARKED AS DEAD] Please wait until all servers have been processed...  EST. TIME LEFT: 60s")
 
+    def _next_sweep_time(self, scheduled_time: float) -> float:
+        jitter: float = uniform(-self.sweep_jitter, self.sweep_jitter) * self.reconcile_interval
+
+        return scheduled_time + self.reconcile_interval + jitter
+
+    def _sweep_server(self, server: Server) -> None:
+        start_time: float = time()
+        server.lag = start_time - server.next_sweep
+        SWEEP_LAG.set(server.lag, guild=server.guild.id)
+
+        try:
+            server.sweep()
+
+        except Exception as e:
+            logging.error(f"[SWEEP THREAD] Error while sweeping '{server.guild.name}'! Error: {str(e)}")
+
+        server.last_sweep_time = time()
+        server.last_sweep_duration = server.last_sweep_time - start_time
+
+        if server.last_sweep_duration > self.reconcile_interval:
+            SWEEP_OVERRUNS.inc(guild=server.guild.id)
+            logging.warning(f"[SWEEP THREAD] Overrun! Sweeping '{server.guild.name}' took {server.last_sweep_duration:.1f}s, longer than its {self.reconcile_interval}s interval.")
+
+        server.next_sweep = self._next_sweep_time(server.next_sweep)
+
+        # Fell more than a whole interval behind, so start afresh instead of sweeping back to back to catch up
+        if server.next_sweep < server.last_sweep_time:
+            logging.warning(f"[SWEEP THREAD] Overrun! '{server.guild.name}' is {server.last_sweep_time - server.next_sweep:.1f}s behind schedule.")
+            server.next_sweep = self._next_sweep_time(server.last_sweep_time)
+
+    def _schedule(self) -> None:
+        for guild_id, future in list(self.running.items()):
+            if future.done():
+                del self.running[guild_id]
+
+        now: float = time()
+
+        for server in sorted(self.servers, key=lambda server: server.next_sweep):
+            if len(self.running) >= self.max_concurrent_sweeps or server.next_sweep > now: break
+            if server.guild.id in self.running: continue
+
+            self.running[server.guild.id] = self.executor.submit(self._sweep_server, server)
+
+        # First sweeps are staggered across a whole interval, so tracking is back as soon as any server has swept
+        if not self.startup_timer.reported and any(server.last_sweep_time > 0 for server in self.servers):
+            self.startup_timer.mark("first_sweep")
+            self.startup_timer.report()
+
     def main(self) -> None:
+        last_report_time: float = time()
+
         while self.alive:
             self.servers = self.update_servers()
 
             if len(self.servers) == 0:
                 logging.warning("[SWEEP THREAD] Servers list empty! Waiting 10 seconds and trying again...")
-                sleep(10)
+                self.killed.wait(10)
                 continue
 
-            for server in self.servers:
-                server.sweep()
-                next_sweep: int = 5
+            self._schedule()
+
+            if time() - last_report_time >= self.reconcile_interval:
+                last_report_time = time()
+                max_lag: float = max(server.lag for server in self.servers)
+
+                logging.info(f"[SWEEP THREAD] {len(self.servers)} servers, {len(self.running)} sweeping, max lag {max_lag:.1f}s, {self.take_presence_update_count()} presence updates handled since the last report.")
 
-                logging.info(f"[SWEEP THREAD] Sleeping for {next_sweep}s...  (SWEEPING SERVERS {self.servers.index(server)+1}/{len(self.servers)})")
-                sleep(next_sweep)
+            next_due: float = min(server.next_sweep for server in self.servers) - time()
+            self.killed.wait(min(max(next_due, 0), self.SCHEDULER_TICK))
 
+        self.executor.shutdown()
         self.stopped = True
 
     def run(self) -> None:
@@ -472,36 +886,62 @@ class ActivityManager:
     Tracks the users activity and status
     """
 
+    MEMBER_LOCK_STRIPES: int = 64
+
     def __init__(self, bot: ActivityBot) -> None:
         self.bot: ActivityBot = bot
 
         self.guilds: List[Guild] = []
         self.servers: List[Server] = []
 
-        self.ACTIVITY_MATCHES: Dict[str, str] = self._load_activity_matches()
+        self.activity_normalizer: ActivityNormalizer = ActivityNormalizer(self.bot.CONFIG["activity_matches_path"])
+        self.activity_normalizer.watch(self.bot.CONFIG["activity_matches_reload_interval"])
 
-        self.update_servers()
+        # One pool is shared by every server, so the number of concurrent database calls stays bounded
+        self.SWEEP_WORKERS: int = self.bot.CONFIG['sweep_workers']
+        self.sweep_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self.SWEEP_WORKERS, thread_name_prefix="sweep")
+        self.member_locks: List[Lock] = [Lock() for _ in range(self.MEMBER_LOCK_STRIPES)]
 
-        self.sweep_manager: SweepManager = SweepManager(self.update_servers)
+        self.skip_list: SkipList = SkipList(self.bot.CONFIG['checkpoint_interval'],
+                                            load_checkpoint(self.bot.CONFIG['tracking_checkpoint_path'], self.bot.CONFIG['tracking_checkpoint_max_age']))
+        self.bot.database_manager.before_read = self.skip_list.materialize
+        self.bot.database_manager.pending_time = self.skip_list.pending_time
 
-    def _load_activity_matches(self) -> Dict[str, str]:
-        with open(self.bot.CONFIG["activity_matches_path"], "r") as activity_matches_file:
-            return parse_json(activity_matches_file.read())
+        # A server's next sweep comes at least (1 - sweep_jitter) intervals after its last one, so claims last just under
+        # that: a user shared by several guilds is processed once per cycle, and never blocked from their own server's next sweep
+        claim_window: float = self.bot.CONFIG['reconcile_interval'] * (1 - self.bot.CONFIG['sweep_jitter'] - MemberRegistry.CLAIM_MARGIN)
+        self.member_registry: MemberRegistry = MemberRegistry(claim_window, self.bot.get_guild)
+
+        self.servers_by_guild: Dict[int, Server] = {}
+        self.presence_update_count: int = 0
+
+        self.update_servers()
+
+        self.sweep_manager: SweepManager = SweepManager(self.update_servers, self.bot.startup_timer, self.bot.CONFIG['reconcile_interval'],
+                                                         self.bot.CONFIG['sweep_jitter'], self.bot.CONFIG['max_concurrent_sweeps'],
+                                                         self.take_presence_update_count)
 
     def _load_guilds(self) -> List[Server]:
         servers: List[Server] = []
-        
-        offset: int = 0
-        
-        for guild in self.guilds:
-            servers.append(Server(self.bot.database_manager, guild, offset, self.get_real_activity))
 
-            offset += 1
+        # First sweeps are spread evenly over one interval
+        offset_step: float = self.bot.CONFIG['reconcile_interval'] / max(len(self.guilds), 1)
+
+        for index, guild in enumerate(self.guilds):
+            server: Server | None = self.servers_by_guild.get(guild.id)
+
+            # Existing servers keep their schedule
+            if server is None:
+                server = Server(self.bot.database_manager, guild, index * offset_step, self.get_real_activity,
+                                self.sweep_executor, self.SWEEP_WORKERS * 4, self.member_locks, self.skip_list,
+                                self.member_registry)
+
+            servers.append(server)
 
         return servers
     
     def get_real_activity(self, activity_name: str) -> str:
-        return self.ACTIVITY_MATCHES.get(activity_name, activity_name)
+        return self.activity_normalizer.normalize(activity_name)
         
     def fetch_guilds(self) -> List[Guild]:
         logging.info("Updating guilds...")
@@ -516,12 +956,86 @@ class ActivityManager:
         return guilds
     
     def update_servers(self) -> List[Server]:
-        if len(self.bot.guilds) != len(self.servers):
+        """
+        Servers are only rebuilt when the bot joins or leaves a guild
+        """
+
+        guilds: Dict[int, Guild] = {guild.id: guild for guild in self.bot.guilds}
+
+        if guilds.keys() != self.servers_by_guild.keys():
             self.guilds = self.fetch_guilds()
 
-        self.servers = self._load_guilds()
+            self.servers = self._load_guilds()
+            self.servers_by_guild = {server.guild.id: server for server in self.servers}
+
+        # discord.py can swap a guild object out after an outage, so servers always point at the current one
+        for server in self.servers:
+            server.guild = guilds.get(server.guild.id, server.guild)
 
         return self.servers
+
+    def handle_presence_update(self, before: Member, after: Member) -> None:
+        """
+        Queues a presence change on the sweep pool, so its database work runs off the event loop
+        """
+
+        server: Server | None = self.servers_by_guild.get(after.guild.id)
+
+        if server is None or after.bot or not self.sweep_manager.alive: return
+        if DEBUG and ("captaindeathead" not in after.name): return
+
+        self.member_registry.note_presence(after)
+
+        self.presence_update_count += 1
+        PRESENCE_UPDATES.inc()
+        self.sweep_executor.submit(self._apply_presence_update, server, before, after)
+
+    def _apply_presence_update(self, server: Server, before: Member, after: Member) -> None:
+        try:
+            server.process_presence_change(before, after)
+
+        except Exception as e:
+            logging.error(f"[PRESENCE UPDATE] Error while processing presence update for '{after.id}'! Error: {str(e)}")
+
+    def drain(self) -> None:
+        """
+        Stops scheduling sweeps and waits for running sweeps and queued presence updates to finish
+        """
+
+        self.sweep_manager.kill()
+        self.activity_normalizer.stop()
+
+        if self.sweep_manager.thread.is_alive():
+            self.sweep_manager.thread.join()
+
+        self.sweep_executor.shutdown()
+
+    def status_summary(self) -> str:
+        servers: List[Server] = self.servers
+        cache = self.bot.database_manager.cache
+        lookups: int = cache.hits + cache.misses
+
+        return "\n".join([
+            f"Servers: {len(servers)}, max sweep lag: {max((server.lag for server in servers), default=0):.1f}s",
+            f"Sweeps: {SWEEP_DURATION.count():.0f}, avg {SWEEP_DURATION.mean():.2f}s, avg member {MEMBER_LATENCY.mean() * 1000:.1f}ms",
+            f"Members processed: {SWEEP_MEMBERS.get(outcome='processed'):.0f}, skipped: {SWEEP_MEMBERS.get(outcome='unchanged') + SWEEP_MEMBERS.get(outcome='shared'):.0f}",
+            f"Presence updates: {PRESENCE_UPDATES.total():.0f}",
+            f"Database operations: {DB_OPERATIONS.total():.0f}, errors: {DB_ERRORS.total():.0f}",
+            f"Cache: {len(cache.states)} users, {0 if lookups == 0 else cache.hits / lookups * 100:.1f}% hit rate",
+            f"Graphs rendered: {GRAPH_RENDER_DURATION.count():.0f}, avg {GRAPH_RENDER_DURATION.mean():.2f}s, queued: {self.bot.render_service.queued}",
+            f"Image cache: {len(self.bot.render_service.cache.images)} graphs, {self.bot.render_service.cache.hit_rate() * 100:.1f}% hit rate"
+        ])
+
+    def get_server_version(self, guild_id: int) -> int:
+        server: Server | None = self.servers_by_guild.get(guild_id)
+
+        return 0 if server is None else server.sweep_count
+
+    def take_presence_update_count(self) -> int:
+        count: int = self.presence_update_count
+        self.presence_update_count = 0
+
+        return count
     
     def main(self) -> None:
         self.sweep_manager.run()
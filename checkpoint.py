@@ -0,0 +1,51 @@
+import logging
+
+from json import dumps as dump_json, loads as parse_json
+from os import replace, remove
+from time import time
+
+from typing import Dict
+
+def save_checkpoint(path: str, tracked: Dict[int, float]) -> None:
+    """
+    Writes {user id: time tracked since} to disk. Written to a temporary file first so a crash mid-write
+    never leaves half a checkpoint behind.
+    """
+
+    checkpoint: Dict = {"written_at": time(), "tracked": {str(user_id): since for user_id, since in tracked.items()}}
+
+    with open(f"{path}.tmp", "w") as checkpoint_file:
+        checkpoint_file.write(dump_json(checkpoint))
+
+    replace(f"{path}.tmp", path)
+
+    logging.info(f"[CHECKPOINT] Saved tracking state of {len(tracked)} users to '{path}'")
+
+def load_checkpoint(path: str, max_age: float) -> Dict[int, float]:
+    """
+    Returns {user id: time tracked since} from the checkpoint left by the previous process, or nothing if there is none
+    or it is older than max_age. The checkpoint is removed once read, so it can only ever be resumed from once.
+    """
+
+    try:
+        with open(path, "r") as checkpoint_file:
+            checkpoint: Dict = parse_json(checkpoint_file.read())
+
+        remove(path)
+
+    except FileNotFoundError:
+        return {}
+
+    except Exception as e:
+        logging.error(f"[CHECKPOINT] Error while loading '{path}', starting without it! Error: {str(e)}")
+        return {}
+
+    age: float = time() - checkpoint["written_at"]
+
+    if age > max_age:
+        logging.warning(f"[CHECKPOINT] Ignoring checkpoint written {age:.0f}s ago (max age {max_age}s)")
+        return {}
+
+    logging.info(f"[CHECKPOINT] Resuming tracking state of {len(checkpoint['tracked'])} users from {age:.0f}s ago")
+
+    return {int(user_id): since for user_id, since in checkpoint["tracked"].items()}
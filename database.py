@@ -1,18 +1,23 @@
-from pymongo import MongoClient
-from pymongo.database import Database
-from pymongo.server_api import ServerApi
-from pymongo.collection import Collection
-from pymongo.cursor import Cursor
+import logging
 
+from abc import ABC, abstractmethod
 from time import time
 from copy import deepcopy
+from threading import Lock, RLock, Thread, Event
+from contextlib import contextmanager
+from collections import OrderedDict
 
-from typing import Dict
+from metrics import DB_ERRORS, DB_FLUSH_DURATION, CACHE_SIZE, CACHE_HITS, CACHE_MISSES, CACHE_EVICTIONS
 
-URI: str = ""
+from typing import Dict, List, Tuple, Set, Iterator, Iterable, Callable
 
-with open("./mongodb_URI.txt", "r") as f:
-    URI = f.read()
+STATUSES: Tuple[str, ...] = ("online", "idle", "dnd", "offline")
+
+SCHEMA_VERSION: int = 2
+
+# Max users fetched per query by get_users
+USER_FETCH_CHUNK_SIZE: int = 500
+TRACKING_FIELDS: Tuple[str, ...] = ("username", "last_update", "last_online", "simple_time", "rich_presence_time", "active_sessions")
 
 DEFAULT_USER_STATISTICS: Dict = {
     "last_update": time(),
@@ -24,16 +29,259 @@ DEFAULT_USER_STATISTICS: Dict = {
         "dnd": 0,
         "offline": 0
     },
-    "rich_presence_time": {},
-    "sessions": {}
+    "rich_presence_time": {}
 }
 
-class DatabaseManager:
+class UserChanges:
+    """
+    Everything that changed in a user's state since it was last flushed
+    """
+
+    __slots__ = ("user_id", "fields", "simple_time_deltas", "rich_presence_deltas", "added_sessions", "removed_sessions", "new_sessions", "session_deltas")
+
+    def __init__(self, user_id: int) -> None:
+        self.user_id: int = user_id
+
+        self.fields: Dict[str, float | str] = {} # field -> new value
+        self.simple_time_deltas: Dict[str, float] = {}
+        self.rich_presence_deltas: Dict[str, Dict[str, float]] = {}
+
+        self.added_sessions: Set[str] = set()
+        self.removed_sessions: Set[str] = set()
+        self.new_sessions: Dict[str, Dict] = {} # session id -> full session
+        self.session_deltas: Dict[str, Dict] = {} # session id -> {"end_time": ..., "status": {status: minutes}}
+
+class UserState:
+    """
+    Cached tracking state of a single user, plus everything that changed since it was last flushed
+    """
+
+    __slots__ = ("user_id", "last_update", "last_online", "username", "simple_time", "rich_presence_time", "active_sessions",
+                 "dirty_fields", "simple_time_deltas", "rich_presence_deltas", "added_sessions", "removed_sessions", "new_sessions", "session_deltas")
+
+    def __init__(self, user_id: int, user: Dict, active_sessions: Dict[str, str]) -> None:
+        self.user_id: int = user_id
+
+        # Projected loads give fields an older document lacks as None, so None is treated as missing
+        self.last_update: float = user.get("last_update") or time()
+        self.last_online: float = user.get("last_online") or time()
+        self.username: str | None = user.get("username")
+
+        self.simple_time: Dict[str, float] = {status: (user.get("simple_time") or {}).get(status, 0) for status in STATUSES}
+        self.rich_presence_time: Dict[str, Dict[str, float]] = deepcopy(user.get("rich_presence_time") or {})
+        self.active_sessions: Dict[str, str] = active_sessions # session id -> activity name
+
+        self.clear_changes()
+
+    def clear_changes(self) -> None:
+        self.dirty_fields: Set[str] = set()
+        self.simple_time_deltas: Dict[str, float] = {}
+        self.rich_presence_deltas: Dict[str, Dict[str, float]] = {}
+
+        self.added_sessions: Set[str] = set()
+        self.removed_sessions: Set[str] = set()
+        self.new_sessions: Dict[str, Dict] = {}
+        self.session_deltas: Dict[str, Dict] = {}
+
+    def take_changes(self) -> UserChanges:
+        changes: UserChanges = UserChanges(self.user_id)
+
+        changes.fields = {field: getattr(self, field) for field in self.dirty_fields}
+        changes.simple_time_deltas = self.simple_time_deltas
+        changes.rich_presence_deltas = self.rich_presence_deltas
+        changes.added_sessions = self.added_sessions
+        changes.removed_sessions = self.removed_sessions
+        changes.new_sessions = self.new_sessions
+        changes.session_deltas = self.session_deltas
+
+        self.clear_changes()
+
+        return changes
+
+    def restore_changes(self, changes: UserChanges) -> None:
+        """
+        Puts back changes taken for a write that failed, merged with anything that changed since they were taken
+        """
+
+        self.dirty_fields.update(changes.fields)
+
+        for status, minutes in changes.simple_time_deltas.items():
+            self.simple_time_deltas[status] = self.simple_time_deltas.get(status, 0) + minutes
+
+        for app_name, status_times in changes.rich_presence_deltas.items():
+            app_deltas: Dict[str, float] = self.rich_presence_deltas.setdefault(app_name, {status: 0 for status in STATUSES})
+
+            for status, minutes in status_times.items():
+                app_deltas[status] += minutes
+
+        # A session that was added and has been removed since is just never marked active, like before a flush
+        for session_id in changes.added_sessions:
+            if session_id in self.removed_sessions:
+                self.removed_sessions.discard(session_id)
+            else:
+                self.added_sessions.add(session_id)
+
+        self.removed_sessions.update(session_id for session_id in changes.removed_sessions if session_id not in self.added_sessions)
+
+        # Sessions updated since are folded into the taken ones, the later end time wins
+        for session_id, session_delta in changes.session_deltas.items():
+            newer_delta: Dict | None = self.session_deltas.get(session_id)
+
+            if newer_delta is not None:
+                for status, minutes in session_delta["status"].items():
+                    newer_delta["status"][status] = newer_delta["status"].get(status, 0) + minutes
+            else:
+                self.session_deltas[session_id] = session_delta
+
+        for session_id, session in changes.new_sessions.items():
+            newer_delta = self.session_deltas.pop(session_id, None)
+
+            if newer_delta is not None:
+                session["end_time"] = newer_delta["end_time"]
+
+                for status, minutes in newer_delta["status"].items():
+                    session["status"][status] = session["status"].get(status, 0) + minutes
+
+            self.new_sessions[session_id] = session
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.dirty_fields or self.simple_time_deltas or self.rich_presence_deltas or self.added_sessions
+                    or self.removed_sessions or self.new_sessions or self.session_deltas)
+
+    def to_dict(self) -> Dict:
+        return {
+            "username": self.username,
+            "last_update": self.last_update,
+            "last_online": self.last_online,
+            "active_sessions": list(self.active_sessions),
+            "simple_time": dict(self.simple_time),
+            "rich_presence_time": {app_name: dict(status_times) for app_name, status_times in self.rich_presence_time.items()}
+        }
+
+class UserStateCache:
+    """
+    Write-back cache of per-user tracking state. The bot is the only writer, so a cached state stays
+    authoritative and only its changes have to be written back. Only clean states of untracked users are evicted.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size: int = max(1, max_size)
+
+        self.states: Dict[int, UserState] = {}
+        self.lock: RLock = RLock()
+
+        # Only states that can be evicted are kept in LRU order, so eviction never has to look past the oldest one.
+        # Edited states are held out of it until they have been flushed, tracked states are never in it.
+        self.evictable: OrderedDict[int, None] = OrderedDict()
+        self.edited: Set[int] = set()
+
+        # Users being tracked are never evicted, so sweeps don't have to read them back
+        self.pinned: Set[int] = set()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, user_id: int) -> UserState | None:
+        with self.lock:
+            state: UserState | None = self.states.get(user_id)
+
+            if state is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            if user_id in self.evictable:
+                self.evictable.move_to_end(user_id)
+
+            return state
+
+    def add(self, state: UserState) -> UserState:
+        """
+        Caches the state and returns it, or returns the state that is already cached for that user
+        """
+
+        with self.lock:
+            if state.user_id in self.states:
+                if state.user_id in self.evictable:
+                    self.evictable.move_to_end(state.user_id)
+
+                return self.states[state.user_id]
+
+            self._evict(self.max_size - 1)
+            self.states[state.user_id] = state
+
+            if state.user_id not in self.pinned:
+                self.evictable[state.user_id] = None
+
+            return state
+
+    def edit(self, state: UserState) -> UserState:
+        """
+        Caches the state like add, and holds it in the cache until it has been flushed
+        """
+
+        with self.lock:
+            state = self.add(state)
+
+            self.evictable.pop(state.user_id, None)
+            self.edited.add(state.user_id)
+
+            return state
+
+    def pin(self, user_ids: Iterable[int]) -> None:
+        with self.lock:
+            for user_id in user_ids:
+                self.pinned.add(user_id)
+                self.evictable.pop(user_id, None)
+
+    def take_edited(self) -> List[UserState]:
+        """
+        Returns every state edited since the last call, every dirty state is one of them
+        """
+
+        with self.lock:
+            states: List[UserState] = [self.states[user_id] for user_id in self.edited if user_id in self.states]
+            self.edited = set()
+
+            return states
+
+    def release(self, states: Iterable[UserState]) -> None:
+        """
+        Lets flushed states be evicted again, unless they were edited since or are tracked
+        """
+
+        with self.lock:
+            for state in states:
+                if state.user_id in self.edited or state.user_id in self.pinned or self.states.get(state.user_id) is not state: continue
+
+                self.evictable[state.user_id] = None
+
+            self._evict(self.max_size)
+
+    def remove(self, user_id: int) -> None:
+        with self.lock:
+            self.states.pop(user_id, None)
+            self.evictable.pop(user_id, None)
+
+    def _evict(self, max_size: int) -> None:
+        while len(self.states) > max_size and len(self.evictable) > 0:
+            evict_user_id, _ = self.evictable.popitem(last=False)
+
+            del self.states[evict_user_id]
+            self.evictions += 1
+
+class DatabaseManager(ABC):
     """
-    Manager for the users database
+    Storage interface for the users and their sessions. Tracking state is cached and written back in
+    batches, so backends only have to load users and persist the changes handed to them.
 
-    Structure:
+    Users:
         - user id
+            - username
+            - every username the user has had
             - last update time
             - last online time
             - active session's id's
@@ -43,7 +291,7 @@ class DatabaseManager:
                 - time spent idle
                 - time spent dnd
                 - time spent offline
-            
+
             - rich presence time
                 - rich presence app
                     - time spent online
@@ -51,295 +299,561 @@ class DatabaseManager:
                     - time spent dnd
                     - time spent offline
 
-            - sessions
-                - session id (user_id followed by session start time)
-                    - activity name
-                    - status
-                        - online
-                        - idle
-                        - dnd
-                    - start time
-                    - end time
+    Sessions:
+        - session id (user_id followed by session start time)
+            - user id
+            - activity name
+            - status
+                - online
+                - idle
+                - dnd
+            - start time
+            - end time
 
     There should also be an option for just the past week, or at least make it possible to know when a piece of data is made (Sessions).
     """
 
-    def __init__(self) -> None:
-        self.db_client: MongoClient = MongoClient(URI, server_api=ServerApi('1'))
-        self.db: Database = self.db_client["db"]
-        self.users: Collection = self.db["users"]
+    def __init__(self, cache_size: int = 10000, flush_interval: float = 60) -> None:
+        self.cache: UserStateCache = UserStateCache(cache_size)
+        self.flush_lock: Lock = Lock()
+
+        self.known_users: Set[int] = set()
+
+        # Called with the id of a single user about to be read, so callers that defer writes can credit them first
+        self.before_read: Callable[[Iterable[int]], None] | None = None
+
+        # Called with the user ids of a read over many users, returns the time they have accrued but not been credited
+        # as {user id: (status, activity names, minutes)}, which is added to what is read instead of being written first
+        self.pending_time: Callable[[List[int]], Dict[int, Tuple[str, Iterable[str], float]]] | None = None
+
+        # Called with (user id, activity name) the first time a user is credited for an activity
+        self.on_new_activity: Callable[[int, str], None] | None = None
+
+        self.flush_interval: float = flush_interval
+        self.closed: Event = Event()
+
+        self.flush_thread: Thread = Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
 
-    def get_user(self, user_id: int) -> Cursor | None:
-        for user in self.users.find({str(user_id): {"$exists": True}}): return user
+        CACHE_SIZE.function = lambda: len(self.cache.states)
+        CACHE_HITS.function = lambda: self.cache.hits
+        CACHE_MISSES.function = lambda: self.cache.misses
+        CACHE_EVICTIONS.function = lambda: self.cache.evictions
 
+    @abstractmethod
+    def _insert_users(self, users: Dict[int, Dict]) -> None:
+        """
+        Stores every {user id: user} that doesn't exist yet
+        """
+
+    @abstractmethod
+    def _load_user(self, user_id: int) -> Dict | None:
+        """
+        Returns {"_id", **DEFAULT_USER_STATISTICS} for the user, without their sessions
+        """
+
+    @abstractmethod
+    def _load_users(self, user_ids: List[int], fields: Tuple[str, ...]) -> Dict[int, Dict]:
+        """
+        Returns {user id: {field: value}} with only the given fields, for every user that exists
+        """
+
+    @abstractmethod
+    def _aggregate_rich_presence_totals(self, user_ids: List[int], limit: int | None) -> List[Tuple[str, float]]:
+        """
+        Returns [(activity name, minutes)] summed over every status and the given users, biggest first
+        """
+
+    @abstractmethod
+    def _load_active_session_names(self, user_id: int, active_sessions: List[str]) -> Dict[str, str]:
+        """
+        Returns {session id: activity name} for the given active sessions
+        """
+
+    @abstractmethod
+    def _load_session_activities(self, session_ids: List[str]) -> Dict[str, str]:
+        """
+        Returns {session id: activity name} for every given session that exists, whoever it belongs to
+        """
+
+    @abstractmethod
+    def _write_changes(self, changes: List[UserChanges]) -> None:
+        """
+        Persists the flushed changes of every user
+        """
+
+    @abstractmethod
+    def _load_sessions(self, user_id: int) -> Dict[str, Dict] | None:
+        """
+        Returns {session id: {name, status, start_time, end_time}} for every session of the user
+        """
+
+    @abstractmethod
     def get_user_id(self, username: str) -> int | None:
-        for user in self.users.find():
-            user_id_str = list(user)[1]
-            curr_user_name = user[user_id_str]['username']
-            
-            if curr_user_name == username:
-                return int(user_id_str)
-            
-        return None
+        """
+        Case-insensitive lookup by current username, falling back to previous usernames.
+        If more than one user matches, the most recently updated one wins.
+        """
 
-    def get_user_time_dict(self, user_id: int) -> Dict | None:
-        user: Cursor | None = self.get_user(user_id)
+    @abstractmethod
+    def get_username_history(self, user_id: int) -> List[str]:
+        ...
 
-        if user is None: return None
+    @abstractmethod
+    def iter_users(self) -> Iterator[Dict]:
+        """
+        Yields every user as {"_id", "username", "username_history", **DEFAULT_USER_STATISTICS}
+        """
 
-        return user[str(user_id)]
-    
-    def get_user_rich_time_dict(self, user_id: int, activity_name: str) -> Dict | None:
-        user: Cursor | None = self.get_user(user_id)
+    @abstractmethod
+    def iter_sessions(self) -> Iterator[Dict]:
+        """
+        Yields every session as {"_id", "user_id", "activity", "status", "start_time", "end_time"}
+        """
 
-        if user is None: return None
+    @abstractmethod
+    def import_users(self, users: List[Dict]) -> None:
+        """
+        Stores users in the shape yielded by iter_users, replacing any existing ones
+        """
 
-        return user[str(user_id)]["rich_presence_time"].get(activity_name, {"online": 0, "idle": 0, "dnd": 0, "offline": 0})
+    @abstractmethod
+    def set_rich_presence_times(self, rich_presence_times: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+        """
+        Replaces the rich_presence_time of existing users, leaving the rest of each user untouched
+        """
 
-    def get_user_sessions(self, user_id: int) -> Dict | None:
-        user: Cursor | None = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+    @abstractmethod
+    def import_sessions(self, sessions: List[Dict]) -> None:
+        """
+        Stores sessions in the shape yielded by iter_sessions, replacing any existing ones
+        """
 
-        if user is None: return None
+    @abstractmethod
+    def _drop_all(self) -> None:
+        ...
+
+    def _flush_loop(self) -> None:
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                DB_ERRORS.inc(backend="cache", command="flush")
+                logging.error(f"[DATABASE] Error while flushing cached users! Error: {str(e)}")
+
+    def close(self) -> None:
+        """
+        Stops the flush timer and writes back everything that is still pending
+        """
+
+        self.closed.set()
+        self.flush()
+
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.cache.lock:
+                states: List[UserState] = self.cache.take_edited()
+                taken: List[Tuple[UserState, UserChanges]] = [(state, state.take_changes()) for state in states if state.dirty]
+
+            if len(taken) > 0:
+                try:
+                    with DB_FLUSH_DURATION.time():
+                        self._write_changes([changes for _, changes in taken])
+
+                except Exception:
+                    # Backends write all of the changes or none of them, so they are put back for the next flush
+                    with self.cache.lock:
+                        for state, changes in taken:
+                            self.cache.edit(state).restore_changes(changes)
+
+                    raise
+
+            self.cache.release(states)
+
+    def reset_cache(self) -> None:
+        """
+        Writes back and forgets every cached user, for tools that rewrite users directly
+        """
+
+        self.flush()
+
+        # Anything changed since the flush stays cached so it isn't lost
+        with self.cache.lock:
+            for user_id in [user_id for user_id, state in self.cache.states.items() if not state.dirty]:
+                self.cache.remove(user_id)
 
-        if "sessions" not in user_dict[str(user_id)] or "active_sessions" not in user_dict[str(user_id)]:
-            self.add_sessions_field(user_id)
+    def _get_state(self, user_id: int, create: bool = True) -> UserState | None:
+        state: UserState | None = self.cache.get(user_id)
 
-        return user_dict[str(user_id)]["sessions"]
+        if state is not None: return state
 
-    def get_active_sessions(self, user_id: int) -> list[str]:
-        user: Cursor | None = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        if create:
+            self.add_user(user_id)
+
+        user: Dict | None = self._load_user(user_id)
 
         if user is None: return None
-        if "active_sessions" not in user_dict[str(user_id)]:
-            self.add_sessions_field(user_id)
 
-        return user_dict[str(user_id)]["active_sessions"]
+        # Anything cached has to be writable, so make sure the user is stored before caching them
+        self.add_user(user_id)
 
-    def add_user(self, user_id: int) -> None:
-        if self.get_user(user_id): return
+        return self.cache.add(UserState(user_id, user, self._load_active_session_names(user_id, user.get("active_sessions", []))))
 
-        new_user: Dict = {str(user_id): deepcopy(DEFAULT_USER_STATISTICS)}
-        
-        self.users.insert_one(new_user)
+    def track_users(self, user_ids: Iterable[int]) -> int:
+        """
+        Pins the users in the cache so their tracking state is never read back while they are tracked.
+        Users that aren't cached yet are loaded in chunks of USER_FETCH_CHUNK_SIZE, users that don't exist
+        yet are created. Returns how many users were loaded or created.
+        """
 
-    def add_sessions_field(self, user_id: int) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+        user_ids = list(user_ids)
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        with self.cache.lock:
+            self.cache.pin(user_ids)
+            uncached_user_ids: List[int] = [user_id for user_id in user_ids if user_id not in self.cache.states]
 
-        user_dict_copy: Dict = deepcopy(user_dict)
+        for i in range(0, len(uncached_user_ids), USER_FETCH_CHUNK_SIZE):
+            chunk: List[int] = uncached_user_ids[i:i + USER_FETCH_CHUNK_SIZE]
 
-        new_user_dict: Dict = {"$set": user_dict_copy}
-        new_user_dict["$set"][str(user_id)]["active_sessions"] = []
-        new_user_dict["$set"][str(user_id)]["sessions"] = {}
+            # Anything cached has to be writable, so the chunk is stored (and moved out of any older layout) first
+            self._insert_users({user_id: self._new_user() for user_id in chunk if user_id not in self.known_users})
+            self.known_users.update(chunk)
 
-        self.users.update_one(user_dict, new_user_dict)
+            users: Dict[int, Dict] = self._load_users(chunk, TRACKING_FIELDS)
 
-    def update_user_username(self, user_id: int, username: str) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+            session_names: Dict[str, str] = self._load_session_activities([session_id for user in users.values() for session_id in user["active_sessions"] or []])
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+            for user_id in chunk:
+                user: Dict | None = users.get(user_id)
 
-        user_dict_copy: Dict = deepcopy(user_dict)
+                if user is None:
+                    user = self._new_user()
+                    active_sessions: Dict[str, str] = {}
+                else:
+                    user_session_ids: List[str] = user["active_sessions"] or []
+                    active_sessions = {session_id: session_names[session_id] for session_id in user_session_ids if session_id in session_names}
 
-        new_user_dict: Dict = {"$set": user_dict_copy}
-        new_user_dict["$set"][str(user_id)]["username"] = username
+                    # Sessions the bulk lookup couldn't find (e.g. still embedded in a legacy user) are loaded one by one
+                    if len(active_sessions) < len(user_session_ids):
+                        active_sessions = self._load_active_session_names(user_id, user_session_ids)
 
-        self.users.update_one(user_dict, new_user_dict)
+                self.cache.add(UserState(user_id, user, active_sessions))
 
-    def update_user_simple_time(self, user_id: int, status_times: Dict[str, int]) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+        if len(uncached_user_ids) > 0:
+            logging.info(f"[DATABASE] Loaded tracking state of {len(uncached_user_ids)} users ({len(self.cache.pinned)} tracked)")
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        return len(uncached_user_ids)
 
-        user_dict_copy: Dict = deepcopy(user_dict)
+    @contextmanager
+    def _edit_state(self, user_id: int) -> Iterator[UserState]:
+        state: UserState = self._get_state(user_id)
 
-        new_user_dict: Dict = {"$set": user_dict_copy}
-        new_user_dict["$set"][str(user_id)]["simple_time"] = {
-            "online": status_times["online"],
-            "idle": status_times["idle"],
-            "dnd": status_times["dnd"],
-            "offline": status_times["offline"]
-        }
+        # Re-adding under the lock makes sure the state wasn't evicted between loading and editing it
+        with self.cache.lock:
+            yield self.cache.edit(state)
 
-        self.users.update_one(user_dict, new_user_dict)
+    def _materialize(self, user_ids: Iterable[int]) -> None:
+        if self.before_read is not None:
+            self.before_read(user_ids)
 
-    def update_user_rich_presence_time(self, user_id: int, app_name: str, status_times: Dict[str, int]) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
-
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
-        
-        user_dict_copy: Dict = deepcopy(user_dict)
-
-        new_user_dict: Dict = {"$set": user_dict_copy}
-        new_user_dict["$set"][str(user_id)]["rich_presence_time"][app_name] = {
-            "online": status_times["online"],
-            "idle": status_times["idle"],
-            "dnd": status_times["dnd"],
-            "offline": status_times["offline"]
-        }
+    def get_user(self, user_id: int) -> Dict | None:
+        self._materialize((user_id,))
 
-        self.users.update_one(user_dict, new_user_dict)
+        state: UserState | None = self.cache.get(user_id)
 
-    def get_user_last_online(self, user_id: int) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+        if state is not None:
+            with self.cache.lock:
+                return {"_id": user_id, **state.to_dict()}
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        return self._load_user(user_id)
 
-        if "last_online" not in user_dict[str(user_id)]:
-            self.set_user_last_online(user_id, time())
+    def _get_pending_time(self, user_ids: List[int]) -> Dict[int, Tuple[str, Iterable[str], float]]:
+        return {} if self.pending_time is None else self.pending_time(user_ids)
 
-            user: Cursor = self.get_user(user_id)
-            user_dict: Dict = {str(user_id): user[str(user_id)]}
+    def get_users(self, user_ids: Iterable[int], fields: Tuple[str, ...] = ("simple_time", "rich_presence_time")) -> Dict[int, Dict]:
+        """
+        Returns {user id: {field: value}} for every user that exists, including time they have accrued but not
+        been credited yet. Cached users are served from the cache, the rest are fetched in chunks of
+        USER_FETCH_CHUNK_SIZE with only the requested fields.
+        """
 
-        return user_dict[str(user_id)]["last_online"]
+        user_ids = list(user_ids)
+        users: Dict[int, Dict] = self._get_stored_users(user_ids, fields)
 
-    def set_user_last_online(self, user_id: int, online_time: float) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+        for user_id, (status, activity_names, minutes) in self._get_pending_time(list(users)).items():
+            user: Dict = users[user_id]
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+            if "simple_time" in fields:
+                user["simple_time"][status] = user["simple_time"].get(status, 0) + minutes
 
-        user_dict_copy = deepcopy(user_dict)
-        user_dict_copy[str(user_id)].update({"last_online": online_time})
+            if "rich_presence_time" in fields:
+                for activity_name in activity_names:
+                    status_times: Dict[str, float] = user["rich_presence_time"].setdefault(activity_name, {curr_status: 0 for curr_status in STATUSES})
+                    status_times[status] = status_times.get(status, 0) + minutes
 
-        new_user_dict = {"$set": user_dict_copy}
+        return users
 
-        self.users.update_one(user_dict, new_user_dict)
+    def _get_stored_users(self, user_ids: List[int], fields: Tuple[str, ...]) -> Dict[int, Dict]:
+        users: Dict[int, Dict] = {}
+        uncached_user_ids: List[int] = []
 
-    def get_user_last_update(self, user_id: int) -> float:
-        if not self.get_user(user_id): self.add_user(user_id)
+        for user_id in user_ids:
+            state: UserState | None = self.cache.get(user_id)
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+            if state is None:
+                uncached_user_ids.append(user_id)
+                continue
 
-        return user_dict[str(user_id)]["last_update"]
+            with self.cache.lock:
+                user: Dict = state.to_dict()
 
-    def set_user_last_update(self, user_id: int) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+            users[user_id] = {field: user[field] for field in fields}
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        for i in range(0, len(uncached_user_ids), USER_FETCH_CHUNK_SIZE):
+            users.update(self._load_users(uncached_user_ids[i:i + USER_FETCH_CHUNK_SIZE], fields))
 
-        if "last_online" not in user_dict[str(user_id)]:
-            self.set_user_last_online(user_id, time())
+        return users
 
-        user_dict_copy = deepcopy(user_dict)
-        user_dict_copy[str(user_id)].update({"last_update": time()})
+    def get_rich_presence_totals(self, user_ids: Iterable[int], limit: int | None = None) -> List[Tuple[str, float]]:
+        """
+        Returns [(activity name, minutes)] summed over the given users, biggest first and cut to the top `limit`.
+        Pending changes are flushed first so the rollup can run entirely inside the database, time the users have
+        accrued but not been credited is added to its results.
+        """
 
-        new_user_dict = {"$set": user_dict_copy}
+        user_ids = list(user_ids)
 
-        self.users.update_one(user_dict, new_user_dict)
+        self.flush()
+        totals: List[Tuple[str, float]] = self._aggregate_rich_presence_totals(user_ids, limit)
 
-    def new_user_session(self, user_id: int, activity_name: str, status: str) -> str:
-        if not self.get_user(user_id): self.add_user(user_id)
+        pending_minutes: Dict[str, float] = {}
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
-        
-        start_time = time()
+        for _, activity_names, minutes in self._get_pending_time(user_ids).values():
+            for activity_name in activity_names:
+                pending_minutes[activity_name] = pending_minutes.get(activity_name, 0) + minutes
 
-        active_session_id = str(user_id) + str(start_time)
+        if len(pending_minutes) == 0: return totals
 
-        #print(f"New user session: {user_id=}, {activity_name=}, {status=}")
+        # Every pending activity has been credited before, so it is in the rollup unless it fell outside the top `limit`,
+        # where it stays until its time is credited
+        totals = [(activity_name, minutes + pending_minutes.get(activity_name, 0)) for activity_name, minutes in totals]
 
-        if "sessions" not in user_dict[str(user_id)] or "active_sessions" not in user_dict[str(user_id)]:
-            self.add_sessions_field(user_id)
+        return sorted(totals, key=lambda item: item[1], reverse=True)
 
-        user_dict_copy: dict = deepcopy(user_dict)
+    def get_user_time_dict(self, user_id: int) -> Dict | None:
+        state: UserState | None = self._get_state(user_id, create=False)
 
-        active_sessions = user_dict_copy[str(user_id)]["active_sessions"]
-        active_sessions.append(active_session_id)
+        if state is None: return None
 
-        user_dict_copy[str(user_id)].update({"active_sessions": active_sessions})
+        with self.cache.lock:
+            return state.to_dict()
 
-        new_user_dict: Dict = user_dict_copy
-        new_user_dict[str(user_id)]["sessions"][active_session_id] = {
-            'name': activity_name,
-            'status': {
-                'online': 0,
-                'idle': 0,
-                'dnd': 0
-            },
-            'start_time': start_time,
-            'end_time': start_time
-        }
-        new_user_dict: Dict = {"$set": new_user_dict}
+    def get_user_rich_time_dict(self, user_id: int, activity_name: str) -> Dict | None:
+        state: UserState | None = self._get_state(user_id, create=False)
 
-        self.users.update_one(user_dict, new_user_dict)
-        self.update_user_session(user_id, activity_name, status)
+        if state is None: return None
 
-        return active_session_id
+        with self.cache.lock:
+            return dict(state.rich_presence_time.get(activity_name, {"online": 0, "idle": 0, "dnd": 0, "offline": 0}))
 
-    def remove_active_session_id(self, user_id: int, session_id: str) -> None:
-        if not self.get_user(user_id): self.add_user(user_id)
+    def get_user_sessions(self, user_id: int) -> Dict | None:
+        self._materialize((user_id,))
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        state: UserState | None = self.cache.get(user_id)
 
-        active_sessions = self.get_active_sessions(user_id)
-        if session_id in active_sessions:
-            active_sessions.remove(session_id)
+        if state is not None and state.dirty:
+            self.flush()
 
-        user_dict_copy = deepcopy(user_dict)
+        return self._load_sessions(user_id)
 
-        new_user_dict: Dict = user_dict_copy
-        new_user_dict[str(user_id)]["active_sessions"] = active_sessions
-        new_user_dict: Dict = {"$set": user_dict_copy}
+    def get_active_sessions(self, user_id: int) -> list[str] | None:
+        state: UserState | None = self._get_state(user_id, create=False)
 
-        self.users.update_one(user_dict, new_user_dict)
+        if state is None: return None
 
-    def update_user_session(self, user_id: int, activity_name: str, status: str) -> tuple[bool, str]:
-        # Returns:
-        #  - True -> status is good
-        #  - False -> status is not good
+        with self.cache.lock:
+            return list(state.active_sessions)
 
-        #print(f"Updating user session for: {user_id=}, {activity_name=}, {status=}")
+    def get_active_session_names(self, user_id: int) -> Dict[str, str]:
+        """
+        Returns {session id: activity name} for every active session
+        """
 
-        if not self.get_user(user_id): self.add_user(user_id)
+        state: UserState | None = self._get_state(user_id, create=False)
 
-        user: Cursor = self.get_user(user_id)
-        user_dict: Dict = {str(user_id): user[str(user_id)]}
+        if state is None: return {}
 
-        if "sessions" not in user_dict[str(user_id)] or "active_sessions" not in user_dict[str(user_id)]:
-            self.add_sessions_field(user_id)
+        with self.cache.lock:
+            return dict(state.active_sessions)
 
-        active_sessions = user[str(user_id)]["active_sessions"]
-        user_sessions = user_dict[str(user_id)]["sessions"]
+    def _new_user(self) -> Dict:
+        new_user: Dict = deepcopy(DEFAULT_USER_STATISTICS)
+        new_user["last_update"] = time()
+        new_user["last_online"] = time()
 
-        active_session_id = ""
+        return new_user
 
-        for session_id in active_sessions:
-            session = user_sessions[session_id]
+    def add_user(self, user_id: int) -> None:
+        if user_id in self.known_users: return
 
-            if session["name"] == activity_name:
-                active_session_id = session_id
-                break
-            
-        if active_session_id == "":
-            return False, ""
+        self._insert_users({user_id: self._new_user()})
+        self.known_users.add(user_id)
 
-        user_dict_copy: dict = deepcopy(user_dict)
+    def add_sessions_field(self, user_id: int) -> None:
+        with self._edit_state(user_id) as state:
+            for session_id in list(state.active_sessions):
+                self._remove_active_session(state, session_id)
+
+    def update_user_username(self, user_id: int, username: str) -> None:
+        with self._edit_state(user_id) as state:
+            if state.username == username: return
+
+            state.username = username
+            state.dirty_fields.add("username")
+
+    def update_user_simple_time(self, user_id: int, status_times: Dict[str, int]) -> None:
+        with self._edit_state(user_id) as state:
+            for status in STATUSES:
+                self._add_simple_time(state, status, status_times[status] - state.simple_time[status])
+
+    def increment_user_simple_time(self, user_id: int, status: str, minutes: float) -> None:
+        with self._edit_state(user_id) as state:
+            self._add_simple_time(state, status, minutes)
+
+    def _add_simple_time(self, state: UserState, status: str, minutes: float) -> None:
+        state.simple_time[status] += minutes
+        state.simple_time_deltas[status] = state.simple_time_deltas.get(status, 0) + minutes
 
-        last_update = user_dict_copy[str(user_id)]["last_update"]
+    def update_user_rich_presence_time(self, user_id: int, app_name: str, status_times: Dict[str, int]) -> None:
+        with self._edit_state(user_id) as state:
+            curr_status_times: Dict[str, float] = state.rich_presence_time.get(app_name, {status: 0 for status in STATUSES})
+
+            for status in STATUSES:
+                self._add_rich_presence_time(state, app_name, status, status_times[status] - curr_status_times[status])
+
+    def increment_user_rich_presence_time(self, user_id: int, app_name: str, status: str, minutes: float) -> None:
+        with self._edit_state(user_id) as state:
+            new_activity: bool = app_name not in state.rich_presence_time
+            self._add_rich_presence_time(state, app_name, status, minutes)
+
+        if new_activity and self.on_new_activity is not None:
+            self.on_new_activity(user_id, app_name)
 
-        new_user_dict = user_dict_copy
-        
-        new_user_dict[str(user_id)]["sessions"][active_session_id]["end_time"] = time()
-        new_user_dict[str(user_id)]["sessions"][active_session_id]["status"][status] += (time() - last_update) / 60
+    def _add_rich_presence_time(self, state: UserState, app_name: str, status: str, minutes: float) -> None:
+        # Every status is kept in the delta so a new app gets all four fields in one write
+        state.rich_presence_time.setdefault(app_name, {curr_status: 0 for curr_status in STATUSES})[status] += minutes
+        state.rich_presence_deltas.setdefault(app_name, {curr_status: 0 for curr_status in STATUSES})[status] += minutes
 
-        new_user_dict: Dict = {"$set": user_dict_copy}
+    def get_user_last_online(self, user_id: int) -> float:
+        return self._get_state(user_id).last_online
 
-        self.users.update_one(user_dict, new_user_dict)
+    def set_user_last_online(self, user_id: int, online_time: float) -> None:
+        with self._edit_state(user_id) as state:
+            state.last_online = online_time
+            state.dirty_fields.add("last_online")
 
-        #print(f"Updating user session for: {user_id=}, {activity_name=}, {status=} -- Success!")
+    def get_user_last_update(self, user_id: int) -> float:
+        return self._get_state(user_id).last_update
+
+    def get_user_version(self, user_id: int) -> float:
+        """
+        Changes whenever the user's stats may have, for caching what is drawn from them
+        """
+
+        self._materialize((user_id,))
+
+        state: UserState | None = self._get_state(user_id, create=False)
+
+        return 0 if state is None else state.last_update
+
+    def set_user_last_update(self, user_id: int, update_time: float | None = None) -> None:
+        with self._edit_state(user_id) as state:
+            state.last_update = time() if update_time is None else update_time
+            state.dirty_fields.add("last_update")
+
+    def new_user_session(self, user_id: int, activity_name: str, status: str, minutes: float | None = None) -> str:
+        start_time: float = time()
+
+        with self._edit_state(user_id) as state:
+            if minutes is None:
+                minutes = (start_time - state.last_update) / 60
+
+            # Two sessions can start in the same millisecond, so the id is bumped until it is unique
+            start_ms: int = int(start_time * 1000)
+
+            while str(user_id) + str(start_ms) in state.active_sessions:
+                start_ms += 1
+
+            active_session_id: str = str(user_id) + str(start_ms)
+
+            session: Dict = {
+                '_id': active_session_id,
+                'user_id': user_id,
+                'activity': activity_name,
+                'status': {
+                    'online': 0,
+                    'idle': 0,
+                    'dnd': 0
+                },
+                'start_time': start_time,
+                'end_time': start_time
+            }
+
+            if status in session['status']:
+                session['status'][status] += minutes
+
+            state.active_sessions[active_session_id] = activity_name
+            state.new_sessions[active_session_id] = session
+            state.added_sessions.add(active_session_id)
+
+        return active_session_id
+
+    def update_session(self, user_id: int, session_id: str, status: str, minutes: float) -> None:
+        end_time: float = time()
+
+        with self._edit_state(user_id) as state:
+            # Sessions that haven't been written yet are updated in place
+            if session_id in state.new_sessions:
+                session: Dict = state.new_sessions[session_id]
+            else:
+                session: Dict = state.session_deltas.setdefault(session_id, {"status": {}})
+
+            session["end_time"] = end_time
+
+            if status != "offline":
+                session["status"][status] = session["status"].get(status, 0) + minutes
+
+    def remove_active_session_id(self, user_id: int, session_id: str) -> None:
+        with self._edit_state(user_id) as state:
+            self._remove_active_session(state, session_id)
+
+    def _remove_active_session(self, state: UserState, session_id: str) -> None:
+        state.active_sessions.pop(session_id, None)
+
+        if session_id in state.added_sessions:
+            state.added_sessions.discard(session_id)
+        else:
+            state.removed_sessions.add(session_id)
+
+    def update_user_session(self, user_id: int, activity_name: str, status: str, minutes: float | None = None) -> tuple[bool, str]:
+        # Returns:
+        #  - True -> status is good
+        #  - False -> status is not good
+
+        active_session_id: str = ""
+
+        for session_id, session_name in self.get_active_session_names(user_id).items():
+            if session_name == activity_name:
+                active_session_id = session_id
+                break
+
+        if active_session_id == "":
+            return False, ""
+
+        if minutes is None:
+            minutes = (time() - self.get_user_last_update(user_id)) / 60
+
+        self.update_session(user_id, active_session_id, status, minutes)
 
         return True, active_session_id
 
@@ -356,16 +870,85 @@ class DatabaseManager:
         delete: str = input("Press 'y' to confirm database deletion... ")
 
         if delete == "y":
-            self.db.drop_collection("users")
+            self._drop_all()
 
-            print("Deleted collection 'users'!")
+            print("Deleted all users and sessions!")
         else:
             print("Deletion cancelled!")
 
+def create_database_manager(config: Dict, backend: str | None = None) -> DatabaseManager:
+    """
+    Creates the storage backend chosen by 'database_backend' in the config, or the one given
+    """
+
+    backend = config['database_backend'] if backend is None else backend
+
+    if backend == "mongodb":
+        from mongo_database import MongoDatabaseManager
+
+        return MongoDatabaseManager(config['mongodb_uri_path'], config['db_batch_size'], config['cache_size'], config['cache_flush_interval'])
+
+    if backend == "sqlite":
+        from sqlite_database import SQLiteDatabaseManager
+
+        return SQLiteDatabaseManager(config['sqlite_path'], config['cache_size'], config['cache_flush_interval'])
+
+    raise ValueError(f"Unknown database backend '{backend}'! Expected 'mongodb' or 'sqlite'.")
+
+def _copy_in_batches(items: Iterable[Dict], store: callable, batch_size: int) -> int:
+    copied: int = 0
+    batch: List[Dict] = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) >= batch_size:
+            store(batch)
+            copied += len(batch)
+            batch = []
+
+    if len(batch) > 0:
+        store(batch)
+        copied += len(batch)
+
+    return copied
+
+def copy_database(source: DatabaseManager, destination: DatabaseManager, batch_size: int = 500) -> Tuple[int, int]:
+    """
+    Copies every user and session from one backend to another. Returns (users copied, sessions copied).
+    """
+
+    source.flush()
+
+    # Sessions go first so backends that store the active flag on the session can set it when the users arrive
+    sessions: int = _copy_in_batches(source.iter_sessions(), destination.import_sessions, batch_size)
+    logging.info(f"[COPY] Copied {sessions} sessions...")
+
+    users: int = _copy_in_batches(source.iter_users(), destination.import_users, batch_size)
+    logging.info(f"[COPY] Copied {users} users...")
+
+    return users, sessions
+
 if __name__ == "__main__":
-    dbManager = DatabaseManager()
-    #dbManager.add_user(0)
-    #dbManager.update_user_simple_time(0, {"online": 10, "idle": 20, "dnd": 30})
-    #dbManager.update_user_rich_presence_time(0, "test", {"online": 30, "idle": 20, "dnd": 30})
-    for user in dbManager.users.find(): print(user)
+    from sys import argv
+    from yaml import safe_load
+
+    logging.root.setLevel(logging.INFO)
+
+    with open("./config.yaml", "r") as cfg:
+        config: Dict = safe_load(cfg.read())
+
+    if len(argv) == 4 and argv[1] == "copy":
+        # python3 database.py copy <source backend> <destination backend>
+        source: DatabaseManager = create_database_manager(config, argv[2])
+        destination: DatabaseManager = create_database_manager(config, argv[3])
+
+        users, sessions = copy_database(source, destination)
+
+        destination.close()
+        print(f"Copied {users} users and {sessions} sessions from '{argv[2]}' to '{argv[3]}'!")
+        exit()
+
+    dbManager = create_database_manager(config)
+    for user in dbManager.iter_users(): print(user)
     #dbManager.delete_database()
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from typing import Tuple, Hashable
+
+class ImageCache:
+    """
+    LRU cache of drawn graphs, bounded by their total size in bytes. Each graph is cached with the version of
+    the data it was drawn from and only served while that version is current, a newer version replaces it.
+    Entries also expire after ttl seconds, for data that changes without its version changing.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes: int = max_bytes
+        self.ttl: float = ttl
+
+        # (graph, subject, query) -> (data version, image, expiry time)
+        self.images: OrderedDict[Tuple, Tuple[Hashable, bytes, float]] = OrderedDict()
+        self.size: int = 0
+        self.lock: Lock = Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: Tuple, version: Hashable) -> bytes | None:
+        with self.lock:
+            entry: Tuple[Hashable, bytes, float] | None = self.images.get(key)
+
+            if entry is None or entry[0] != version or entry[2] < time():
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.images.move_to_end(key)
+
+            return entry[1]
+
+    def put(self, key: Tuple, version: Hashable, image: bytes) -> None:
+        # A graph bigger than the whole cache would only evict everything else
+        if len(image) > self.max_bytes: return
+
+        with self.lock:
+            self._remove(key)
+
+            self.images[key] = (version, image, time() + self.ttl)
+            self.size += len(image)
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.images)))
+                self.evictions += 1
+
+    def _remove(self, key: Tuple) -> None:
+        entry: Tuple[Hashable, bytes, float] | None = self.images.pop(key, None)
+
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def hit_rate(self) -> float:
+        lookups: int = self.hits + self.misses
+
+        return 0 if lookups == 0 else self.hits / lookups
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
+from startup import StartupTimer
+
+startup_timer: StartupTimer = StartupTimer()
+
 from bot import ActivityBot
 
+startup_timer.mark("import")
+
 
 def main() -> None:
-    activity_bot = ActivityBot("./config.yaml")
+    activity_bot = ActivityBot("./config.yaml", startup_timer)
     activity_bot.main()
 
 
@@ -0,0 +1,273 @@
+import logging
+
+from abc import ABC, abstractmethod
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+from typing import Dict, List, Tuple, Iterator
+
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+def _label_values(labels: Dict[str, object]) -> LabelValues:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(label_values: LabelValues, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs: LabelValues = label_values + extra
+
+    if len(pairs) == 0: return ""
+
+    escaped: List[str] = []
+
+    for key, value in pairs:
+        value = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+
+    return "{" + ",".join(escaped) + "}"
+
+class Metric(ABC):
+    """
+    Base of every metric, one value per set of labels
+    """
+
+    TYPE: str = ""
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.lock: Lock = Lock()
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Returns the metric's lines in the Prometheus text format, without its HELP and TYPE lines
+        """
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.TYPE}", *self.samples()])
+
+class Counter(Metric):
+    TYPE: str = "counter"
+
+    def __init__(self, name: str, description: str, function: callable = None) -> None:
+        super().__init__(name, description)
+        self.values: Dict[LabelValues, float] = {}
+
+        # Counters with a function read a count kept elsewhere when rendered instead of being incremented
+        self.function: callable = function
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key: LabelValues = _label_values(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: object) -> float:
+        if self.function is not None: return self.function()
+
+        with self.lock:
+            return self.values.get(_label_values(labels), 0)
+
+    def total(self) -> float:
+        if self.function is not None: return self.function()
+
+        with self.lock:
+            return sum(self.values.values())
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+
+        with self.lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+class Gauge(Metric):
+    TYPE: str = "gauge"
+
+    def __init__(self, name: str, description: str, function: callable = None) -> None:
+        super().__init__(name, description)
+        self.values: Dict[LabelValues, float] = {}
+
+        # Gauges with a function are read when rendered instead of being set
+        self.function: callable = function
+
+    def set(self, value: float, **labels: object) -> None:
+        with self.lock:
+            self.values[_label_values(labels)] = value
+
+    def get(self, **labels: object) -> float:
+        if self.function is not None: return self.function()
+
+        with self.lock:
+            return self.values.get(_label_values(labels), 0)
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+
+        with self.lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+class Histogram(Metric):
+    TYPE: str = "histogram"
+
+    DEFAULT_BUCKETS: Tuple[float, ...] = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, description)
+        self.buckets: Tuple[float, ...] = buckets
+
+        # labels: [bucket counts..., count, sum]
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key: LabelValues = _label_values(labels)
+
+        with self.lock:
+            counts: List[float] = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        start_time: float = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start_time, **labels)
+
+    def timed(self, **labels: object) -> callable:
+        """
+        Decorator observing how long each call takes
+        """
+
+        def decorator(function: callable) -> callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self) -> float:
+        with self.lock:
+            return sum(counts[-2] for counts in self.values.values())
+
+    def mean(self, **labels: object) -> float:
+        with self.lock:
+            if len(labels) > 0:
+                matching: List[List[float]] = [self.values[_label_values(labels)]] if _label_values(labels) in self.values else []
+            else:
+                matching = list(self.values.values())
+
+            count: float = sum(counts[-2] for counts in matching)
+
+            return 0 if count == 0 else sum(counts[-1] for counts in matching) / count
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+
+        with self.lock:
+            for key, counts in self.values.items():
+                for i, bucket in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', str(bucket)),))} {counts[i]}")
+
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]}")
+
+        return lines
+
+class MetricsRegistry:
+    """
+    Holds every metric and renders them in the Prometheus text format
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        # Registering the same name twice returns the existing metric, so modules can be reloaded safely
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, function: callable = None) -> Counter:
+        return self._register(Counter(name, description, function))
+
+    def gauge(self, name: str, description: str, function: callable = None) -> Gauge:
+        return self._register(Gauge(name, description, function))
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+METRICS: MetricsRegistry = MetricsRegistry()
+
+SWEEP_DURATION: Histogram = METRICS.histogram("activity_bot_sweep_duration_seconds", "Wall time of a server sweep")
+SWEEP_MEMBERS: Counter = METRICS.counter("activity_bot_sweep_members_total", "Members seen by sweeps, by outcome")
+SWEEP_LAG: Gauge = METRICS.gauge("activity_bot_sweep_lag_seconds", "How late the last sweep of each server started")
+SWEEP_OVERRUNS: Counter = METRICS.counter("activity_bot_sweep_overruns_total", "Sweeps that took longer than their interval")
+MEMBER_LATENCY: Histogram = METRICS.histogram("activity_bot_member_process_seconds", "Time to credit one member")
+PRESENCE_UPDATES: Counter = METRICS.counter("activity_bot_presence_updates_total", "Presence updates handled")
+
+DB_OPERATIONS: Counter = METRICS.counter("activity_bot_db_operations_total", "Database round trips, by backend and command")
+DB_OPERATION_LATENCY: Histogram = METRICS.histogram("activity_bot_db_operation_seconds", "Database round trip latency")
+DB_ERRORS: Counter = METRICS.counter("activity_bot_db_errors_total", "Failed database operations and write errors")
+DB_FLUSH_DURATION: Histogram = METRICS.histogram("activity_bot_db_flush_seconds", "Time to write back the user cache")
+
+CACHE_SIZE: Gauge = METRICS.gauge("activity_bot_cache_users", "Users held in the write-back cache")
+CACHE_HITS: Counter = METRICS.counter("activity_bot_cache_hits_total", "Write-back cache hits")
+CACHE_MISSES: Counter = METRICS.counter("activity_bot_cache_misses_total", "Write-back cache misses")
+CACHE_EVICTIONS: Counter = METRICS.counter("activity_bot_cache_evictions_total", "Write-back cache evictions")
+
+GRAPH_RENDER_DURATION: Histogram = METRICS.histogram("activity_bot_graph_render_seconds", "Time to render a graph")
+RENDER_QUEUE_DEPTH: Gauge = METRICS.gauge("activity_bot_render_queue_depth", "Graphs waiting for or being drawn by a render worker")
+RENDER_REJECTED: Counter = METRICS.counter("activity_bot_render_rejected_total", "Graphs turned away because the render queue was full")
+RENDER_TIMEOUTS: Counter = METRICS.counter("activity_bot_render_timeouts_total", "Graphs that took longer than the render timeout")
+IMAGE_CACHE_BYTES: Gauge = METRICS.gauge("activity_bot_image_cache_bytes", "Size of the graphs held in the image cache")
+IMAGE_CACHE_HITS: Counter = METRICS.counter("activity_bot_image_cache_hits_total", "Graphs served from the image cache")
+IMAGE_CACHE_MISSES: Counter = METRICS.counter("activity_bot_image_cache_misses_total", "Graphs that had to be drawn")
+
+class MetricsServer:
+    """
+    Standalone /metrics endpoint for when the Flask web server is disabled
+    """
+
+    def __init__(self, port: int, registry: MetricsRegistry = METRICS) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler) -> None:
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+
+                body: bytes = registry.render().encode()
+
+                handler.send_response(200)
+                handler.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format: str, *args) -> None:
+                pass
+
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def run(self) -> None:
+        self.thread.start()
+
+        logging.info(f"[METRICS] Serving /metrics on port {self.server.server_address[1]}")
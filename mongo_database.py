@@ -0,0 +1,649 @@
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.server_api import ServerApi
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo import UpdateOne, ReplaceOne, ASCENDING
+from pymongo.collation import Collation
+from pymongo import monitoring
+from bson import ObjectId
+
+import logging
+
+from time import time, perf_counter, sleep
+from copy import deepcopy
+from threading import Lock
+from collections import deque
+
+from database import DatabaseManager, UserChanges, STATUSES, SCHEMA_VERSION
+from metrics import DB_OPERATIONS, DB_OPERATION_LATENCY, DB_ERRORS
+
+from typing import Dict, List, Tuple, Iterator
+
+# MongoDB field paths can't address keys containing '.' or starting with '$', so those characters are
+# stored as their full-width equivalents and converted back when read.
+KEY_ESCAPES: Tuple[Tuple[str, str], ...] = ((".", "\uff0e"), ("$", "\uff04"))
+
+# Usernames are matched case-insensitively, both in queries and in their indexes
+USERNAME_COLLATION: Collation = Collation(locale="en", strength=2)
+
+# Documents written before 'schema_version' 2 are keyed by the user id as a string under an ObjectId '_id'
+LEGACY_USER_FILTER: Dict = {"_id": {"$type": "objectId"}}
+
+def encode_key(key: str) -> str:
+    for char, escaped in KEY_ESCAPES:
+        key = key.replace(char, escaped)
+
+    return key
+
+def decode_key(key: str) -> str:
+    for char, escaped in KEY_ESCAPES:
+        key = key.replace(escaped, char)
+
+    return key
+
+def decode_keys(dictionary: Dict) -> Dict:
+    return {decode_key(key): value for key, value in dictionary.items()}
+
+def decode_rich_presence_time(rich_presence_time: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    # Older documents may hold the raw key alongside the escaped one, so merge them instead of overwriting
+    decoded: Dict[str, Dict[str, float]] = {}
+
+    for app_name, status_times in rich_presence_time.items():
+        merged: Dict[str, float] = decoded.setdefault(decode_key(app_name), {status: 0 for status in STATUSES})
+
+        for status in STATUSES:
+            merged[status] += status_times.get(status, 0)
+
+    return decoded
+
+def convert_legacy_user(legacy_user: Dict) -> Dict:
+    user_id_str: str = next(key for key in legacy_user if key != "_id")
+    user: Dict = deepcopy(legacy_user[user_id_str])
+
+    user["_id"] = int(user_id_str)
+    user["schema_version"] = SCHEMA_VERSION
+    user["rich_presence_time"] = {encode_key(app_name): status_times for app_name, status_times in decode_rich_presence_time(user.get("rich_presence_time", {})).items()}
+    user["sessions"] = {encode_key(session_id): session for session_id, session in user.get("sessions", {}).items()}
+    user.setdefault("active_sessions", [])
+
+    if "username" in user:
+        user["username_history"] = [user["username"]]
+
+    return user
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Counts every command the driver sends, so round trips and failures show up in the metrics
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        DB_OPERATIONS.inc(backend="mongodb", command=event.command_name)
+        DB_OPERATION_LATENCY.observe(event.duration_micros / 1e6, backend="mongodb", command=event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        DB_OPERATIONS.inc(backend="mongodb", command=event.command_name)
+        DB_OPERATION_LATENCY.observe(event.duration_micros / 1e6, backend="mongodb", command=event.command_name)
+        DB_ERRORS.inc(backend="mongodb", command=event.command_name)
+
+class WriteBatcher:
+    """
+    Collects write operations and sends them to a collection in unordered bulk writes
+    """
+
+    def __init__(self, collection: Collection, batch_size: int) -> None:
+        self.collection: Collection = collection
+        self.batch_size: int = max(1, batch_size)
+
+        self.operations: List[UpdateOne] = []
+        self.lock: Lock = Lock()
+
+        self.flush_stats: deque[Dict[str, float]] = deque(maxlen=100)
+        self.total_operations: int = 0
+        self.total_errors: int = 0
+
+    def add(self, operation: UpdateOne) -> None:
+        with self.lock:
+            self.operations.append(operation)
+
+            if len(self.operations) < self.batch_size: return
+
+            operations: List[UpdateOne] = self.operations
+            self.operations = []
+
+        if not self._write(operations):
+            self._requeue(operations)
+
+    def queue(self, operations: List[UpdateOne]) -> None:
+        """
+        Adds operations without writing anything, they go out with the next flush
+        """
+
+        with self.lock:
+            self.operations.extend(operations)
+
+    def flush(self) -> bool:
+        """
+        Returns False if some operations could not be written and were kept for the next flush
+        """
+
+        with self.lock:
+            operations: List[UpdateOne] = self.operations
+            self.operations = []
+
+        for i in range(0, len(operations), self.batch_size):
+            if not self._write(operations[i:i + self.batch_size]):
+                # The server is likely unreachable, so the rest is kept for the next flush rather than tried one batch at a time
+                self._requeue(operations[i:])
+                return False
+
+        return True
+
+    def _requeue(self, operations: List[UpdateOne]) -> None:
+        # Ahead of anything added since, so operations are still sent in the order they were made
+        with self.lock:
+            self.operations[:0] = operations
+
+    def _write(self, operations: List[UpdateOne]) -> bool:
+        """
+        Returns False if the batch was not written at all and has to be sent again
+        """
+
+        if len(operations) == 0: return True
+
+        start_time: float = perf_counter()
+        errors: int = 0
+        written: bool = True
+
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = len(e.details.get("writeErrors", []))
+            logging.error(f"[DATABASE] Bulk write finished with {errors} errors! First error: {e.details['writeErrors'][0] if errors else e}")
+        except PyMongoError as e:
+            # Any other driver error (e.g. a dropped connection) means the batch never got a reply
+            errors = len(operations)
+            written = False
+            logging.error(f"[DATABASE] Bulk write of {len(operations)} operations failed, retrying with the next flush! Error: {str(e)}")
+
+        latency_ms: float = (perf_counter() - start_time) * 1000
+
+        self.flush_stats.append({"operations": len(operations), "errors": errors, "latency_ms": latency_ms})
+        self.total_operations += len(operations)
+        self.total_errors += errors
+
+        # Per-document write errors come back in a successful reply, so the command listener doesn't see them
+        if written and errors > 0:
+            DB_ERRORS.inc(errors, backend="mongodb", command="write")
+
+        logging.info(f"[DATABASE] Flushed {len(operations)} writes in {latency_ms:.1f}ms ({errors} errors)")
+
+        return written
+
+class MongoDatabaseManager(DatabaseManager):
+    """
+    MongoDB storage backend. Users are documents keyed by '_id' in the 'users' collection and sessions
+    are documents in the 'sessions' collection.
+    """
+
+    def __init__(self, uri_path: str, batch_size: int = 500, cache_size: int = 10000, flush_interval: float = 60) -> None:
+        with open(uri_path, "r") as f:
+            uri: str = f.read()
+
+        self.db_client: MongoClient = MongoClient(uri, server_api=ServerApi('1'), event_listeners=[CommandMetrics()])
+        self.db: Database = self.db_client["db"]
+        self.users: Collection = self.db["users"]
+        self.sessions: Collection = self.db["sessions"]
+
+        self.batcher: WriteBatcher = WriteBatcher(self.users, batch_size)
+        self.session_batcher: WriteBatcher = WriteBatcher(self.sessions, batch_size)
+
+        self.legacy_users_remaining: bool = True
+        self.legacy_check_time: float = 0
+
+        self._create_indexes()
+
+        super().__init__(cache_size, flush_interval)
+
+    def _create_indexes(self) -> None:
+        self.users.create_index([("username", ASCENDING)], name="username_ci", collation=USERNAME_COLLATION)
+        self.users.create_index([("username_history", ASCENDING)], name="username_history_ci", collation=USERNAME_COLLATION)
+
+        self.sessions.create_index([("user_id", ASCENDING), ("start_time", ASCENDING)], name="user_id_start_time")
+        self.sessions.create_index([("activity", ASCENDING), ("start_time", ASCENDING)], name="activity_start_time")
+
+    def _user_filter(self, user_id: int) -> Dict:
+        return {"_id": user_id}
+
+    def _user_path(self, *keys: str) -> str:
+        return ".".join(encode_key(key) for key in keys)
+
+    def _legacy_user_filter(self, user_id: int) -> Dict:
+        return {str(user_id): {"$exists": True}}
+
+    def _has_legacy_users(self) -> bool:
+        # Re-checked at most once a minute so a finished migration stops the legacy fallbacks
+        if self.legacy_users_remaining and time() - self.legacy_check_time > 60:
+            self.legacy_users_remaining = self.users.find_one(LEGACY_USER_FILTER, {"_id": 1}) is not None
+            self.legacy_check_time = time()
+
+        return self.legacy_users_remaining
+
+    def _find_user(self, user_id: int, projection: Dict | None = None) -> Dict | None:
+        user: Dict | None = self.users.find_one(self._user_filter(user_id), projection)
+
+        if user is None and self._has_legacy_users():
+            legacy_user: Dict | None = self.users.find_one(self._legacy_user_filter(user_id))
+
+            if legacy_user is not None:
+                user = convert_legacy_user(legacy_user)
+
+        return user
+
+    def _insert_users(self, users: Dict[int, Dict]) -> None:
+        if not users: return
+
+        # Users still in the old layout are moved over the first time they are tracked or written to,
+        # every later write matches their new document
+        if self._has_legacy_users():
+            self.migrate_users(list(users))
+
+        self.users.bulk_write([UpdateOne(self._user_filter(user_id), {"$setOnInsert": {"schema_version": SCHEMA_VERSION, **user}}, upsert=True)
+                               for user_id, user in users.items()], ordered=False)
+
+    def _load_user(self, user_id: int) -> Dict | None:
+        user: Dict | None = self._find_user(user_id, {"sessions": 0})
+
+        if user is None: return None
+
+        user.pop("sessions", None)
+        user["rich_presence_time"] = decode_rich_presence_time(user.get("rich_presence_time", {}))
+
+        return user
+
+    def _load_users(self, user_ids: List[int], fields: Tuple[str, ...]) -> Dict[int, Dict]:
+        users: Dict[int, Dict] = {}
+
+        for user in self.users.find({"_id": {"$in": user_ids}}, {field: 1 for field in fields}):
+            users[user["_id"]] = user
+
+        if len(users) < len(user_ids) and self._has_legacy_users():
+            missing_user_ids: List[int] = [user_id for user_id in user_ids if user_id not in users]
+
+            for legacy_user in self.users.find({"$or": [self._legacy_user_filter(user_id) for user_id in missing_user_ids]}):
+                user: Dict = convert_legacy_user(legacy_user)
+                users[user["_id"]] = user
+
+        for user_id, user in users.items():
+            if "rich_presence_time" in fields:
+                user["rich_presence_time"] = decode_rich_presence_time(user.get("rich_presence_time", {}))
+
+            users[user_id] = {field: user.get(field) for field in fields}
+
+        return users
+
+    def _aggregate_rich_presence_totals(self, user_ids: List[int], limit: int | None) -> List[Tuple[str, float]]:
+        totals: Dict[str, float] = {}
+
+        if self._has_legacy_users():
+            # Legacy documents keep their statistics under the stringified id, which the pipeline can't reach
+            for user in self._get_stored_users(user_ids, ("rich_presence_time",)).values():
+                for app_name, status_times in user["rich_presence_time"].items():
+                    totals[app_name] = totals.get(app_name, 0) + sum(status_times.values())
+
+            return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        pipeline: List[Dict] = [
+            {"$match": {"_id": {"$in": user_ids}}},
+            {"$project": {"activities": {"$objectToArray": "$rich_presence_time"}}},
+            {"$unwind": "$activities"},
+            {"$group": {
+                "_id": "$activities.k",
+                "minutes": {"$sum": {"$sum": [f"$activities.v.{status}" for status in STATUSES]}}
+            }},
+            {"$sort": {"minutes": -1}}
+        ]
+
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+
+        # Escaped and raw spellings of the same activity are merged once decoded
+        for result in self.users.aggregate(pipeline):
+            app_name: str = decode_key(result["_id"])
+            totals[app_name] = totals.get(app_name, 0) + result["minutes"]
+
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def _load_active_session_names(self, user_id: int, active_sessions: List[str]) -> Dict[str, str]:
+        if not active_sessions: return {}
+
+        session_names: Dict[str, str] = {session["_id"]: session["activity"] for session in self.sessions.find({"_id": {"$in": active_sessions}}, {"activity": 1})}
+
+        # An active session that is still embedded in the user moves the user's sessions over
+        if len(session_names) < len(active_sessions) and self.backfill_user_sessions(user_id):
+            return self._load_active_session_names(user_id, active_sessions)
+
+        return {session_id: session_names[session_id] for session_id in active_sessions if session_id in session_names}
+
+    def _load_session_activities(self, session_ids: List[str]) -> Dict[str, str]:
+        if not session_ids: return {}
+
+        return {session["_id"]: session["activity"] for session in self.sessions.find({"_id": {"$in": session_ids}}, {"activity": 1})}
+
+    def _write_changes(self, changes: List[UserChanges]) -> None:
+        for user_changes in changes:
+            for operation in self._session_operations(user_changes):
+                self.session_batcher.add(operation)
+
+        user_operations: List[UpdateOne] = [operation for user_changes in changes for operation in self._user_operations(user_changes)]
+
+        # Sessions first, so a flushed active session id always has a session to point to.
+        # If some sessions are held back, so are the users, until a later flush writes the sessions.
+        if not self.session_batcher.flush():
+            self.batcher.queue(user_operations)
+            return
+
+        for operation in user_operations:
+            self.batcher.add(operation)
+
+        self.batcher.flush()
+
+    def _user_operations(self, changes: UserChanges) -> List[UpdateOne]:
+        update: Dict = {}
+        increments: Dict[str, float] = {}
+
+        if changes.fields:
+            update["$set"] = dict(changes.fields)
+
+        if "username" in changes.fields:
+            update["$addToSet"] = {"username_history": changes.fields["username"]}
+
+        for status, minutes in changes.simple_time_deltas.items():
+            increments[self._user_path("simple_time", status)] = minutes
+
+        for app_name, status_times in changes.rich_presence_deltas.items():
+            for status, minutes in status_times.items():
+                increments[self._user_path("rich_presence_time", app_name, status)] = minutes
+
+        if increments:
+            update["$inc"] = increments
+
+        operations: List[UpdateOne] = []
+
+        if update:
+            operations.append(UpdateOne(self._user_filter(changes.user_id), update))
+
+        # Adding to and pulling from the same array can't be done in a single update
+        if changes.added_sessions:
+            operations.append(UpdateOne(self._user_filter(changes.user_id), {"$addToSet": {"active_sessions": {"$each": list(changes.added_sessions)}}}))
+
+        if changes.removed_sessions:
+            operations.append(UpdateOne(self._user_filter(changes.user_id), {"$pull": {"active_sessions": {"$in": list(changes.removed_sessions)}}}))
+
+        return operations
+
+    def _session_operations(self, changes: UserChanges) -> List[UpdateOne]:
+        operations: List[UpdateOne] = []
+
+        for session_id, session in changes.new_sessions.items():
+            operations.append(UpdateOne({"_id": session_id}, {"$setOnInsert": session}, upsert=True))
+
+        for session_id, session_delta in changes.session_deltas.items():
+            update: Dict = {"$set": {"end_time": session_delta["end_time"]}}
+
+            if session_delta["status"]:
+                update["$inc"] = {f"status.{status}": minutes for status, minutes in session_delta["status"].items()}
+
+            operations.append(UpdateOne({"_id": session_id}, update))
+
+        return operations
+
+    def _load_sessions(self, user_id: int) -> Dict[str, Dict] | None:
+        user: Dict | None = self._find_user(user_id, {"sessions": 1})
+
+        if user is None: return None
+
+        # Sessions that have not been backfilled yet are still embedded in the user
+        sessions: Dict = decode_keys(user.get("sessions", {}))
+
+        for session in self.sessions.find({"user_id": user_id}).sort("start_time", ASCENDING):
+            sessions[session["_id"]] = {
+                "name": session["activity"],
+                "status": session["status"],
+                "start_time": session["start_time"],
+                "end_time": session["end_time"]
+            }
+
+        return sessions
+
+    def get_user_id(self, username: str) -> int | None:
+        for field in ("username", "username_history"):
+            user: Dict | None = self.users.find_one({field: username}, {"_id": 1}, collation=USERNAME_COLLATION, sort=[("last_update", -1)])
+
+            if user is not None: return user["_id"]
+
+        if not self._has_legacy_users(): return None
+
+        for user in self.users.find(LEGACY_USER_FILTER):
+            user_id_str = list(user)[1]
+            curr_user_name = user[user_id_str].get('username')
+
+            if curr_user_name is not None and curr_user_name.lower() == username.lower():
+                return int(user_id_str)
+
+        return None
+
+    def get_username_history(self, user_id: int) -> List[str]:
+        user: Dict | None = self._find_user(user_id, {"username_history": 1})
+
+        if user is None: return []
+
+        return user.get("username_history", [])
+
+    def iter_users(self) -> Iterator[Dict]:
+        for user in self.users.find({}, {"sessions": 0}):
+            if isinstance(user["_id"], ObjectId):
+                user = convert_legacy_user(user)
+
+            user.pop("sessions", None)
+            user.pop("schema_version", None)
+            user["rich_presence_time"] = decode_rich_presence_time(user.get("rich_presence_time", {}))
+
+            yield user
+
+    def iter_sessions(self) -> Iterator[Dict]:
+        for session in self.sessions.find():
+            yield session
+
+        # Embedded sessions that have not been backfilled yet
+        for user in self.users.find({"sessions": {"$exists": True}}, {"sessions": 1}):
+            for session_id, session in decode_keys(user["sessions"]).items():
+                yield self._embedded_session(user["_id"], session_id, session)
+
+        if not self._has_legacy_users(): return
+
+        for legacy_user in self.users.find(LEGACY_USER_FILTER):
+            user: Dict = convert_legacy_user(legacy_user)
+
+            for session_id, session in decode_keys(user["sessions"]).items():
+                yield self._embedded_session(user["_id"], session_id, session)
+
+    def import_users(self, users: List[Dict]) -> None:
+        operations: List[ReplaceOne] = []
+
+        for user in users:
+            document: Dict = deepcopy(user)
+            document["schema_version"] = SCHEMA_VERSION
+            document["rich_presence_time"] = {encode_key(app_name): status_times for app_name, status_times in user["rich_presence_time"].items()}
+
+            operations.append(ReplaceOne({"_id": user["_id"]}, document, upsert=True))
+
+        self.users.bulk_write(operations, ordered=False)
+
+    def set_rich_presence_times(self, rich_presence_times: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+        if not rich_presence_times: return
+
+        # iter_users yields legacy users under their new id, so they are moved over before being matched by it
+        if self._has_legacy_users():
+            self.migrate_users(list(rich_presence_times))
+
+        self.users.bulk_write([
+            UpdateOne(self._user_filter(user_id), {"$set": {"rich_presence_time": {encode_key(app_name): status_times for app_name, status_times in rich_presence_time.items()}}})
+            for user_id, rich_presence_time in rich_presence_times.items()
+        ], ordered=False)
+
+    def import_sessions(self, sessions: List[Dict]) -> None:
+        self.sessions.bulk_write([ReplaceOne({"_id": session["_id"]}, session, upsert=True) for session in sessions], ordered=False)
+
+    def _drop_all(self) -> None:
+        self.db.drop_collection("users")
+        self.db.drop_collection("sessions")
+
+    def migrate_users(self, user_ids: List[int]) -> int:
+        """
+        Moves the given users from the old '{"<user id>": {...}}' layout to '_id' keyed documents.
+        Returns how many of them were still in the old layout.
+        """
+
+        legacy_users: List[Dict] = list(self.users.find({"$or": [self._legacy_user_filter(user_id) for user_id in user_ids]}))
+
+        if len(legacy_users) == 0: return 0
+
+        self._insert_migrated_users(legacy_users)
+
+        return len(legacy_users)
+
+    def migrate_legacy_users(self, batch_size: int = 500, pause: float = 0.1) -> int:
+        """
+        Rewrites every document in the old layout in batches. Safe to run while the bot is up,
+        a user that is migrated by the bot in the meantime is just skipped.
+        """
+
+        migrated: int = 0
+        last_id: ObjectId | None = None
+
+        while True:
+            query: Dict = LEGACY_USER_FILTER if last_id is None else {"_id": {"$type": "objectId", "$gt": last_id}}
+            legacy_users: List[Dict] = list(self.users.find(query).sort("_id", 1).limit(batch_size))
+
+            if len(legacy_users) == 0: break
+
+            migrated += self._insert_migrated_users(legacy_users)
+            last_id = legacy_users[-1]["_id"]
+
+            logging.info(f"[MIGRATION] Migrated {migrated} users...")
+            sleep(pause)
+
+        self.legacy_users_remaining = self.users.find_one(LEGACY_USER_FILTER, {"_id": 1}) is not None
+
+        return migrated
+
+    def _insert_migrated_users(self, legacy_users: List[Dict]) -> int:
+        operations: List[UpdateOne] = []
+
+        for legacy_user in legacy_users:
+            user: Dict = convert_legacy_user(legacy_user)
+            operations.append(UpdateOne({"_id": user["_id"]}, {"$setOnInsert": user}, upsert=True))
+
+        result = self.users.bulk_write(operations, ordered=False)
+
+        # Only remove old documents that were actually copied, anything else already has a new document
+        upserted: List[ObjectId] = [legacy_users[index]["_id"] for index in result.upserted_ids]
+
+        for index, legacy_user in enumerate(legacy_users):
+            if index not in result.upserted_ids:
+                logging.warning(f"[MIGRATION] User {next(key for key in legacy_user if key != '_id')} already has a migrated document, leaving the old one untouched.")
+
+        if len(upserted) > 0:
+            self.users.delete_many({"_id": {"$in": upserted}})
+
+        return len(upserted)
+
+    def backfill_user_sessions(self, user_id: int) -> bool:
+        """
+        Moves the sessions embedded in a user's document into the sessions collection.
+        Returns False if the user has no embedded sessions.
+        """
+
+        user: Dict | None = self.users.find_one({"_id": user_id, "sessions": {"$exists": True}}, {"sessions": 1})
+
+        if user is None: return False
+
+        self._insert_backfilled_sessions([user])
+
+        return True
+
+    def backfill_sessions(self, batch_size: int = 100, pause: float = 0.1) -> int:
+        """
+        Moves every embedded session into the sessions collection in batches of users.
+        Safe to run while the bot is up, a session is only removed from its user once it has been copied.
+        """
+
+        backfilled: int = 0
+        last_id: int | None = None
+
+        while True:
+            query: Dict = {"sessions": {"$exists": True}, "_id": {"$not": {"$type": "objectId"}}}
+
+            if last_id is not None:
+                query["_id"]["$gt"] = last_id
+
+            users: List[Dict] = list(self.users.find(query, {"sessions": 1}).sort("_id", ASCENDING).limit(batch_size))
+
+            if len(users) == 0: break
+
+            backfilled += self._insert_backfilled_sessions(users)
+            last_id = users[-1]["_id"]
+
+            logging.info(f"[BACKFILL] Moved {backfilled} sessions...")
+            sleep(pause)
+
+        return backfilled
+
+    def _embedded_session(self, user_id: int, session_id: str, session: Dict) -> Dict:
+        return {
+            "_id": session_id,
+            "user_id": user_id,
+            "activity": session["name"],
+            "status": session["status"],
+            "start_time": session["start_time"],
+            "end_time": session["end_time"]
+        }
+
+    def _insert_backfilled_sessions(self, users: List[Dict]) -> int:
+        operations: List[UpdateOne] = []
+
+        for user in users:
+            for session_id, session in decode_keys(user["sessions"]).items():
+                operations.append(UpdateOne({"_id": session_id}, {"$setOnInsert": self._embedded_session(user["_id"], session_id, session)}, upsert=True))
+
+        if len(operations) > 0:
+            self.sessions.bulk_write(operations, ordered=False)
+
+        self.users.update_many({"_id": {"$in": [user["_id"] for user in users]}}, {"$unset": {"sessions": ""}})
+
+        return len(operations)
+
+if __name__ == "__main__":
+    from sys import argv
+    from yaml import safe_load
+
+    logging.root.setLevel(logging.INFO)
+
+    with open("./config.yaml", "r") as cfg:
+        config: Dict = safe_load(cfg.read())
+
+    dbManager = MongoDatabaseManager(config['mongodb_uri_path'])
+
+    if len(argv) > 1 and argv[1] == "migrate":
+        print(f"Migrated {dbManager.migrate_legacy_users()} users to schema version {SCHEMA_VERSION}!")
+        exit()
+
+    if len(argv) > 1 and argv[1] == "backfill_sessions":
+        print(f"Moved {dbManager.backfill_sessions()} sessions to the 'sessions' collection!")
+        exit()
+
+    for user in dbManager.users.find(): print(user)
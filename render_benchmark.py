@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Table renderer benchmark. Draws the same synthetic rich presence table with the Pillow renderer the bot uses
+and with the plotly/kaleido renderer it replaced, each in a fresh process, and reports cold start, warm latency
+and memory. The kaleido renderer needs `pip install plotly kaleido`, it is skipped otherwise.
+
+    python3 render_benchmark.py --rows 50 --renders 20
+"""
+
+import resource
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from random import Random
+from statistics import median
+from time import perf_counter
+
+from renderers import render_table
+
+from typing import Dict, List, Tuple
+
+def render_table_kaleido(ranks: List, names: List[str], hours: List[float], footer: str = "") -> bytes:
+    """
+    The table renderer from before the Pillow one, as it was
+    """
+
+    import plotly.graph_objects as go
+
+    fig = go.Figure(
+        data=[go.Table(header=dict(values=["Rank", "Name", "Hours"]),
+        cells=dict(values=[ranks, names, hours]))
+    ])
+
+    estimated_height = 400 + max(0, (len(ranks) - 11) * 30)
+
+    return fig.to_image(format="png", height=estimated_height)
+
+RENDERERS: Dict[str, callable] = {
+    "pillow": render_table,
+    "kaleido": render_table_kaleido
+}
+
+def synthetic_table(rows: int, seed: int) -> Tuple[List, List[str], List[float]]:
+    random: Random = Random(seed)
+
+    hours: List[float] = sorted((round(random.uniform(0, 500), 2) for _ in range(rows)), reverse=True)
+    names: List[str] = [f"Activity {random.randint(0, 10 ** 6)}" for _ in range(rows)]
+
+    return [*range(1, rows + 1), "-"], names + ["Total"], hours + [round(sum(hours), 2)]
+
+def _tree_rss_mb() -> float:
+    """
+    Resident memory of this process and everything it started (kaleido runs Chromium beside it). Linux only,
+    elsewhere it is 0 and only the peak of this process is reported.
+    """
+
+    from os import getpid
+
+    total_kb: int = 0
+    pending: List[int] = [getpid()]
+
+    while len(pending) > 0:
+        pid: int = pending.pop()
+
+        try:
+            with open(f"/proc/{pid}/status", "r") as status_file:
+                total_kb += next((int(line.split()[1]) for line in status_file if line.startswith("VmRSS:")), 0)
+
+            with open(f"/proc/{pid}/task/{pid}/children", "r") as children_file:
+                pending.extend(int(child) for child in children_file.read().split())
+
+        except OSError:
+            continue
+
+    return total_kb / 1024
+
+def measure(renderer: str, rows: int, renders: int, seed: int) -> Dict:
+    """
+    Runs in a fresh process, so the first render pays every import and start up cost like a new render worker would
+    """
+
+    table: Tuple[List, List[str], List[float]] = synthetic_table(rows, seed)
+
+    try:
+        start_time: float = perf_counter()
+        RENDERERS[renderer](*table)
+        cold_time: float = perf_counter() - start_time
+    except (ImportError, RuntimeError) as e:
+        # plotly reports a kaleido it can't drive (wrong version, no Chrome for kaleido 1.x) as a RuntimeError
+        return {"error": str(e).strip()}
+
+    warm_times: List[float] = []
+
+    for _ in range(renders):
+        start_time = perf_counter()
+        image: bytes = RENDERERS[renderer](*table)
+        warm_times.append(perf_counter() - start_time)
+
+    return {
+        "cold_start_s": cold_time,
+        "warm_median_ms": median(warm_times) * 1000,
+        "image_kb": len(image) / 1024,
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "memory_with_subprocesses_mb": _tree_rss_mb()
+    }
+
+RESULT_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("cold_start_s", "Cold start (s)"),
+    ("warm_median_ms", "Warm median (ms)"),
+    ("image_kb", "Image (KB)"),
+    ("peak_memory_mb", "Peak memory (MB)"),
+    ("memory_with_subprocesses_mb", "RSS incl. children (MB)")
+)
+
+def print_results(results: Dict[str, Dict]) -> None:
+    print(f"  {'':<24}" + "".join(f"{renderer:>12}" for renderer in results))
+
+    for field, label in RESULT_FIELDS:
+        print(f"  {label:<24}" + "".join(f"{result[field]:>12.2f}" if "error" not in result else f"{'-':>12}" for result in results.values()))
+
+    for renderer, result in results.items():
+        if "error" in result:
+            print(f"Skipped {renderer}: {result['error']}")
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser(description="Benchmark the Pillow table renderer against the plotly/kaleido one")
+    parser.add_argument("--rows", type=int, default=50, help="activities in the table")
+    parser.add_argument("--renders", type=int, default=20, help="warm renders after the first one")
+    parser.add_argument("--renderers", nargs="+", choices=list(RENDERERS), default=list(RENDERERS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict] = {}
+
+    for renderer in args.renderers:
+        # A new process per renderer, so neither one's imports or memory count against the other
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            results[renderer] = executor.submit(measure, renderer, args.rows, args.renders, args.seed).result()
+
+    print(f"Rendering a {args.rows} row table, median of {args.renders} warm renders:")
+    print_results(results)
@@ -0,0 +1,163 @@
+import logging
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Lock
+from time import perf_counter
+
+from image_cache import ImageCache
+from metrics import GRAPH_RENDER_DURATION, RENDER_QUEUE_DEPTH, RENDER_REJECTED, RENDER_TIMEOUTS, IMAGE_CACHE_BYTES, IMAGE_CACHE_HITS, IMAGE_CACHE_MISSES
+
+from typing import NamedTuple, Callable, Tuple, Hashable
+
+class RenderJob(NamedTuple):
+    """
+    A graph to draw: a function from renderers.py and the plain data it is drawn from
+    """
+
+    graph: str
+    function: Callable[..., bytes]
+    args: Tuple
+
+class RenderError(Exception):
+    ...
+
+class RenderBusy(RenderError):
+    ...
+
+class RenderTimeout(RenderError):
+    ...
+
+class RenderService:
+    """
+    Draws graphs in a pool of worker processes, so matplotlib and Pillow never block the event loop or the
+    web server, and pyplot's global state is never shared between threads. At most `workers` graphs are drawn
+    at once and at most `max_queued` wait for a worker, anything past that is turned away.
+    Drawn graphs are kept in an ImageCache shared by the commands and the web server.
+    """
+
+    def __init__(self, workers: int, timeout: float, max_queued: int, cache: ImageCache) -> None:
+        self.workers: int = workers
+        self.timeout: float = timeout
+        self.max_queued: int = max_queued
+        self.cache: ImageCache = cache
+
+        self.executor: ProcessPoolExecutor | None = None
+        self.lock: Lock = Lock()
+
+        self.queued: int = 0
+
+        RENDER_QUEUE_DEPTH.function = lambda: self.queued
+        IMAGE_CACHE_BYTES.function = lambda: self.cache.size
+        IMAGE_CACHE_HITS.function = lambda: self.cache.hits
+        IMAGE_CACHE_MISSES.function = lambda: self.cache.misses
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Only started once the first graph is asked for, so startup doesn't wait on it. Workers are spawned
+        # rather than forked, forking the bot's threads could copy a held lock into them
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+
+        return self.executor
+
+    def _finished(self, job: RenderJob, start_time: float, future: Future) -> None:
+        with self.lock:
+            self.queued -= 1
+
+        if not future.cancelled() and future.exception() is None:
+            GRAPH_RENDER_DURATION.observe(perf_counter() - start_time, graph=job.graph)
+
+    def submit(self, job: RenderJob) -> Future:
+        with self.lock:
+            if self.queued >= self.workers + self.max_queued:
+                RENDER_REJECTED.inc(graph=job.graph)
+                raise RenderBusy(f"{self.queued} graphs are already being drawn")
+
+            try:
+                future: Future = self._get_executor().submit(job.function, *job.args)
+            except BrokenProcessPool as e:
+                # A crashed worker breaks the whole pool, so it is replaced with a new one
+                logging.error(f"[RENDER] Render pool broke, restarting it! Error: {str(e)}")
+
+                self.executor = None
+                future = self._get_executor().submit(job.function, *job.args)
+
+            self.queued += 1
+
+        start_time: float = perf_counter()
+        future.add_done_callback(lambda future: self._finished(job, start_time, future))
+
+        return future
+
+    async def render(self, job: RenderJob) -> bytes:
+        """
+        Awaits the PNG bytes of the graph without blocking the event loop
+        """
+
+        future: Future = self.submit(job)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            RENDER_TIMEOUTS.inc(graph=job.graph)
+            raise RenderTimeout(f"'{job.graph}' took longer than {self.timeout}s to draw")
+        except BrokenProcessPool:
+            raise RenderError(f"The render worker drawing '{job.graph}' crashed")
+
+    def render_sync(self, job: RenderJob) -> bytes:
+        """
+        Blocks the calling thread until the graph is drawn, for the web server's threads
+        """
+
+        future: Future = self.submit(job)
+
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            RENDER_TIMEOUTS.inc(graph=job.graph)
+            raise RenderTimeout(f"'{job.graph}' took longer than {self.timeout}s to draw")
+        except BrokenProcessPool:
+            raise RenderError(f"The render worker drawing '{job.graph}' crashed")
+
+    def _gather(self, key: Tuple, version: Callable[[], Hashable], gather: Callable[..., RenderJob | str], args: Tuple) -> Tuple[Hashable, bytes | RenderJob | str]:
+        # The version is read before the data, so data that changes while gathering is re-drawn next time rather than kept
+        data_version: Hashable = version()
+        image: bytes | None = self.cache.get(key, data_version)
+
+        return data_version, gather(*args) if image is None else image
+
+    async def render_cached(self, key: Tuple, version: Callable[[], Hashable], gather: Callable[..., RenderJob | str], *args) -> bytes | str:
+        """
+        Returns the graph gathered by gather(*args) from the cache while version() is unchanged, otherwise gathers
+        and draws it. key is (subject, query...) of the graph. Returns the reason when there is nothing to draw.
+        """
+
+        key = (gather.__name__, *key)
+        data_version, result = await asyncio.to_thread(self._gather, key, version, gather, args)
+
+        if not isinstance(result, RenderJob): return result
+
+        image: bytes = await self.render(result)
+        self.cache.put(key, data_version, image)
+
+        return image
+
+    def render_cached_sync(self, key: Tuple, version: Callable[[], Hashable], gather: Callable[..., RenderJob | str], *args) -> bytes | str:
+        key = (gather.__name__, *key)
+        data_version, result = self._gather(key, version, gather, args)
+
+        if not isinstance(result, RenderJob): return result
+
+        image: bytes = self.render_sync(result)
+        self.cache.put(key, data_version, image)
+
+        return image
+
+    def close(self) -> None:
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
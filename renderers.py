@@ -0,0 +1,113 @@
+from io import BytesIO
+from functools import cache
+from types import ModuleType
+from typing import List, Tuple
+
+# Every renderer runs in a render worker process: it takes plain data and returns the PNG bytes,
+# so nothing here may touch the database or the bot.
+# matplotlib takes seconds to import, so it is only loaded once the first graph is drawn
+
+# Tables are drawn with Pillow in the layout and colours plotly's tables had
+TABLE_WIDTH: int = 700
+TABLE_MARGIN: int = 40
+TABLE_ROW_HEIGHT: int = 30
+TABLE_COLUMN_WIDTHS: Tuple[int, int, int] = (80, 0, 140) # rank, name (whatever is left), hours
+TABLE_FONT_SIZE: int = 14
+TABLE_HEADER_COLOR: str = "#C8D4E3"
+TABLE_CELL_COLOR: str = "#EBF0F8"
+TABLE_TEXT_COLOR: str = "#2A3F5F"
+
+@cache
+def _pyplot() -> ModuleType:
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    import matplotlib.pyplot as plot
+
+    plot.rcParams['text.color'] = 'white'
+
+    return plot
+
+@cache
+def _table_fonts() -> Tuple[object, object]:
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", TABLE_FONT_SIZE), ImageFont.truetype("DejaVuSans-Bold.ttf", TABLE_FONT_SIZE)
+    except OSError:
+        # Pillow's own font, scalable since Pillow 10.1
+        try:
+            font = ImageFont.load_default(TABLE_FONT_SIZE)
+        except TypeError:
+            font = ImageFont.load_default()
+
+        return font, font
+
+def format_time(percent: float, time_list: List[float]) -> str:
+    if percent < 5: return ""
+
+    absolute = int(round(percent / 100. * sum(time_list)))
+
+    hours: int = absolute // 60
+    mins: int = absolute % 60
+
+    return f"{percent:.1f}%\n({hours}h {mins}m)"
+
+def render_pie(values: List[float], labels: List[str], colors: List[Tuple[float, float, float]], title: str) -> bytes:
+    image: BytesIO = BytesIO()
+
+    plot = _pyplot()
+    plot.pie(values, labels=labels, colors=colors, autopct=lambda percent: format_time(percent, values))
+    plot.title(title)
+    plot.savefig(image, format="png", facecolor='none')
+    plot.close()
+
+    return image.getvalue()
+
+def _fit_text(text: str, font: object, width: int) -> str:
+    if font.getlength(text) <= width: return text
+
+    while len(text) > 0 and font.getlength(text + "…") > width:
+        text = text[:-1]
+
+    return text + "…"
+
+def render_table(ranks: List, names: List[str], hours: List[float], footer: str = "") -> bytes:
+    """
+    Draws a Rank / Name / Hours table, the last row being the total. The footer (e.g. the page) goes under it.
+    """
+
+    from PIL import Image, ImageDraw
+
+    font, bold_font = _table_fonts()
+
+    name_width: int = TABLE_WIDTH - 2 * TABLE_MARGIN - TABLE_COLUMN_WIDTHS[0] - TABLE_COLUMN_WIDTHS[2]
+    column_widths: Tuple[int, int, int] = (TABLE_COLUMN_WIDTHS[0], name_width, TABLE_COLUMN_WIDTHS[2])
+
+    rows: List[Tuple[str, str, str]] = [("Rank", "Name", "Hours"), *((str(rank), name, f"{hour:.2f}".rstrip("0").rstrip(".")) for rank, name, hour in zip(ranks, names, hours))]
+    height: int = 2 * TABLE_MARGIN + len(rows) * TABLE_ROW_HEIGHT + (TABLE_ROW_HEIGHT if footer else 0)
+
+    image = Image.new("RGB", (TABLE_WIDTH, height), "white")
+    draw = ImageDraw.Draw(image)
+
+    for row_index, row in enumerate(rows):
+        top: int = TABLE_MARGIN + row_index * TABLE_ROW_HEIGHT
+        row_font = bold_font if row_index in (0, len(rows) - 1) else font
+        left: int = TABLE_MARGIN
+
+        for column_index, text in enumerate(row):
+            width: int = column_widths[column_index]
+
+            draw.rectangle((left, top, left + width, top + TABLE_ROW_HEIGHT), fill=TABLE_HEADER_COLOR if row_index == 0 else TABLE_CELL_COLOR, outline="white")
+            draw.text((left + 8, top + TABLE_ROW_HEIGHT // 2), _fit_text(text, row_font, width - 16), fill=TABLE_TEXT_COLOR, font=row_font, anchor="lm")
+
+            left += width
+
+    if footer:
+        draw.text((TABLE_WIDTH // 2, height - TABLE_MARGIN - TABLE_ROW_HEIGHT // 2), footer, fill=TABLE_TEXT_COLOR, font=font, anchor="mm")
+
+    output: BytesIO = BytesIO()
+    image.save(output, format="png")
+
+    return output.getvalue()
@@ -0,0 +1,342 @@
+import json
+import sqlite3
+import logging
+
+from threading import Lock
+from contextlib import contextmanager
+from time import perf_counter
+
+from database import DatabaseManager, UserChanges, STATUSES
+from metrics import DB_OPERATIONS, DB_OPERATION_LATENCY, DB_ERRORS
+
+from typing import Dict, List, Tuple, Iterator
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT COLLATE NOCASE,
+    last_update REAL NOT NULL,
+    last_online REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS username_history (
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL COLLATE NOCASE,
+    PRIMARY KEY (user_id, username)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS username_history_username ON username_history (username);
+
+CREATE TABLE IF NOT EXISTS simple_time (
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    minutes REAL NOT NULL,
+    PRIMARY KEY (user_id, status)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rich_presence_time (
+    user_id INTEGER NOT NULL,
+    activity TEXT NOT NULL,
+    status TEXT NOT NULL,
+    minutes REAL NOT NULL,
+    PRIMARY KEY (user_id, activity, status)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    activity TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    online REAL NOT NULL DEFAULT 0,
+    idle REAL NOT NULL DEFAULT 0,
+    dnd REAL NOT NULL DEFAULT 0,
+    active INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_user_id_start_time ON sessions (user_id, start_time);
+CREATE INDEX IF NOT EXISTS sessions_activity_start_time ON sessions (activity, start_time);
+CREATE INDEX IF NOT EXISTS sessions_active ON sessions (user_id) WHERE active = 1;
+"""
+
+INSERT_USER: str = "INSERT OR IGNORE INTO users (user_id, username, last_update, last_online) VALUES (?, ?, ?, ?)"
+REPLACE_USER: str = "INSERT OR REPLACE INTO users (user_id, username, last_update, last_online) VALUES (?, ?, ?, ?)"
+INSERT_USERNAME: str = "INSERT OR IGNORE INTO username_history (user_id, username) VALUES (?, ?)"
+
+ADD_SIMPLE_TIME: str = """
+INSERT INTO simple_time (user_id, status, minutes) VALUES (?, ?, ?)
+ON CONFLICT (user_id, status) DO UPDATE SET minutes = minutes + excluded.minutes
+"""
+ADD_RICH_PRESENCE_TIME: str = """
+INSERT INTO rich_presence_time (user_id, activity, status, minutes) VALUES (?, ?, ?, ?)
+ON CONFLICT (user_id, activity, status) DO UPDATE SET minutes = minutes + excluded.minutes
+"""
+
+INSERT_SESSION: str = """
+INSERT OR IGNORE INTO sessions (session_id, user_id, activity, start_time, end_time, online, idle, dnd, active)
+VALUES (:_id, :user_id, :activity, :start_time, :end_time, :online, :idle, :dnd, :active)
+"""
+REPLACE_SESSION: str = """
+INSERT OR REPLACE INTO sessions (session_id, user_id, activity, start_time, end_time, online, idle, dnd, active)
+VALUES (:_id, :user_id, :activity, :start_time, :end_time, :online, :idle, :dnd, :active)
+"""
+UPDATE_SESSION: str = """
+UPDATE sessions SET end_time = :end_time, online = online + :online, idle = idle + :idle, dnd = dnd + :dnd
+WHERE session_id = :_id
+"""
+RICH_PRESENCE_TOTALS: str = """
+SELECT activity, SUM(minutes) AS minutes FROM rich_presence_time
+WHERE user_id IN (SELECT value FROM json_each(?))
+GROUP BY activity ORDER BY minutes DESC LIMIT ?
+"""
+SET_SESSION_ACTIVE: str = "UPDATE sessions SET active = ? WHERE session_id = ?"
+
+class SQLiteDatabaseManager(DatabaseManager):
+    """
+    Embedded SQLite storage backend in WAL mode, for deployments that don't want to run a MongoDB server.
+    Every user statistic gets a normalized row, so changes are applied as upserts of single rows.
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000, flush_interval: float = 60) -> None:
+        # One connection is shared between threads and guarded by a lock
+        self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self.connection.row_factory = sqlite3.Row
+        self.lock: Lock = Lock()
+
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript(SCHEMA)
+
+        super().__init__(cache_size, flush_interval)
+
+    @contextmanager
+    def _operation(self, command: str, transaction: bool = True) -> Iterator[None]:
+        start_time: float = perf_counter()
+
+        try:
+            with self.lock:
+                if transaction:
+                    with self.connection:
+                        yield
+                else:
+                    yield
+
+        except sqlite3.Error:
+            DB_ERRORS.inc(backend="sqlite", command=command)
+            raise
+
+        finally:
+            DB_OPERATIONS.inc(backend="sqlite", command=command)
+            DB_OPERATION_LATENCY.observe(perf_counter() - start_time, backend="sqlite", command=command)
+
+    def _query(self, sql: str, parameters: tuple | Dict = ()) -> List[sqlite3.Row]:
+        with self._operation("query", transaction=False):
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def _insert_users(self, users: Dict[int, Dict]) -> None:
+        if not users: return
+
+        with self._operation("insert_user"):
+            self.connection.executemany(INSERT_USER, [(user_id, user.get("username"), user["last_update"], user["last_online"]) for user_id, user in users.items()])
+
+    def _load_user(self, user_id: int) -> Dict | None:
+        rows: List[sqlite3.Row] = self._query("SELECT * FROM users WHERE user_id = ?", (user_id,))
+
+        if len(rows) == 0: return None
+
+        user: Dict = {
+            "_id": user_id,
+            "username": rows[0]["username"],
+            "last_update": rows[0]["last_update"],
+            "last_online": rows[0]["last_online"],
+            "active_sessions": [row["session_id"] for row in self._query("SELECT session_id FROM sessions WHERE user_id = ? AND active = 1", (user_id,))],
+            "simple_time": {status: 0 for status in STATUSES},
+            "rich_presence_time": {}
+        }
+
+        for row in self._query("SELECT status, minutes FROM simple_time WHERE user_id = ?", (user_id,)):
+            user["simple_time"][row["status"]] = row["minutes"]
+
+        for row in self._query("SELECT activity, status, minutes FROM rich_presence_time WHERE user_id = ?", (user_id,)):
+            user["rich_presence_time"].setdefault(row["activity"], {status: 0 for status in STATUSES})[row["status"]] = row["minutes"]
+
+        return user
+
+    def _load_users(self, user_ids: List[int], fields: Tuple[str, ...]) -> Dict[int, Dict]:
+        placeholders: str = ", ".join("?" * len(user_ids))
+        users: Dict[int, Dict] = {}
+
+        for row in self._query(f"SELECT * FROM users WHERE user_id IN ({placeholders})", tuple(user_ids)):
+            users[row["user_id"]] = {field: row[field] for field in fields if field in ("username", "last_update", "last_online")}
+
+        if "simple_time" in fields:
+            for user in users.values():
+                user["simple_time"] = {status: 0 for status in STATUSES}
+
+            for row in self._query(f"SELECT user_id, status, minutes FROM simple_time WHERE user_id IN ({placeholders})", tuple(user_ids)):
+                users[row["user_id"]]["simple_time"][row["status"]] = row["minutes"]
+
+        if "rich_presence_time" in fields:
+            for user in users.values():
+                user["rich_presence_time"] = {}
+
+            for row in self._query(f"SELECT user_id, activity, status, minutes FROM rich_presence_time WHERE user_id IN ({placeholders})", tuple(user_ids)):
+                users[row["user_id"]]["rich_presence_time"].setdefault(row["activity"], {status: 0 for status in STATUSES})[row["status"]] = row["minutes"]
+
+        if "active_sessions" in fields:
+            for user in users.values():
+                user["active_sessions"] = []
+
+            for row in self._query(f"SELECT user_id, session_id FROM sessions WHERE active = 1 AND user_id IN ({placeholders})", tuple(user_ids)):
+                users[row["user_id"]]["active_sessions"].append(row["session_id"])
+
+        return users
+
+    def _aggregate_rich_presence_totals(self, user_ids: List[int], limit: int | None) -> List[Tuple[str, float]]:
+        # The ids are bound as one JSON array, so large guilds don't hit SQLite's bound parameter limit
+        rows: List[sqlite3.Row] = self._query(RICH_PRESENCE_TOTALS, (json.dumps(user_ids), -1 if limit is None else limit))
+
+        return [(row["activity"], row["minutes"]) for row in rows]
+
+    def _load_active_session_names(self, user_id: int, active_sessions: List[str]) -> Dict[str, str]:
+        rows: List[sqlite3.Row] = self._query("SELECT session_id, activity FROM sessions WHERE user_id = ? AND active = 1", (user_id,))
+
+        return {row["session_id"]: row["activity"] for row in rows}
+
+    def _load_session_activities(self, session_ids: List[str]) -> Dict[str, str]:
+        if not session_ids: return {}
+
+        rows: List[sqlite3.Row] = self._query("SELECT session_id, activity FROM sessions WHERE session_id IN (SELECT value FROM json_each(?))", (json.dumps(session_ids),))
+
+        return {row["session_id"]: row["activity"] for row in rows}
+
+    def _session_row(self, session: Dict, active: bool) -> Dict:
+        return {
+            "_id": session["_id"],
+            "user_id": session["user_id"],
+            "activity": session["activity"],
+            "start_time": session["start_time"],
+            "end_time": session["end_time"],
+            "online": session["status"].get("online", 0),
+            "idle": session["status"].get("idle", 0),
+            "dnd": session["status"].get("dnd", 0),
+            "active": int(active)
+        }
+
+    def _write_changes(self, changes: List[UserChanges]) -> None:
+        with self._operation("write_changes"):
+            for user_changes in changes:
+                user_id: int = user_changes.user_id
+
+                for field, value in user_changes.fields.items():
+                    # Field names only ever come from UserState, never from user input
+                    self.connection.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
+
+                if "username" in user_changes.fields:
+                    self.connection.execute(INSERT_USERNAME, (user_id, user_changes.fields["username"]))
+
+                self.connection.executemany(ADD_SIMPLE_TIME, [(user_id, status, minutes) for status, minutes in user_changes.simple_time_deltas.items()])
+                self.connection.executemany(ADD_RICH_PRESENCE_TIME, [
+                    (user_id, activity, status, minutes) for activity, status_times in user_changes.rich_presence_deltas.items() for status, minutes in status_times.items()
+                ])
+
+                self.connection.executemany(INSERT_SESSION, [self._session_row(session, False) for session in user_changes.new_sessions.values()])
+                self.connection.executemany(UPDATE_SESSION, [
+                    {"_id": session_id, "end_time": delta["end_time"], **{status: delta["status"].get(status, 0) for status in ("online", "idle", "dnd")}}
+                    for session_id, delta in user_changes.session_deltas.items()
+                ])
+
+                self.connection.executemany(SET_SESSION_ACTIVE, [(1, session_id) for session_id in user_changes.added_sessions])
+                self.connection.executemany(SET_SESSION_ACTIVE, [(0, session_id) for session_id in user_changes.removed_sessions])
+
+    def _load_sessions(self, user_id: int) -> Dict[str, Dict] | None:
+        if len(self._query("SELECT 1 FROM users WHERE user_id = ?", (user_id,))) == 0: return None
+
+        return {
+            row["session_id"]: {
+                "name": row["activity"],
+                "status": {"online": row["online"], "idle": row["idle"], "dnd": row["dnd"]},
+                "start_time": row["start_time"],
+                "end_time": row["end_time"]
+            }
+            for row in self._query("SELECT * FROM sessions WHERE user_id = ? ORDER BY start_time", (user_id,))
+        }
+
+    def get_user_id(self, username: str) -> int | None:
+        rows: List[sqlite3.Row] = self._query("SELECT user_id FROM users WHERE username = ? ORDER BY last_update DESC LIMIT 1", (username,))
+
+        if len(rows) == 0:
+            rows = self._query("""
+                SELECT history.user_id FROM username_history AS history JOIN users ON users.user_id = history.user_id
+                WHERE history.username = ? ORDER BY users.last_update DESC LIMIT 1
+            """, (username,))
+
+        return rows[0]["user_id"] if len(rows) > 0 else None
+
+    def get_username_history(self, user_id: int) -> List[str]:
+        return [row["username"] for row in self._query("SELECT username FROM username_history WHERE user_id = ?", (user_id,))]
+
+    def iter_users(self) -> Iterator[Dict]:
+        for row in self._query("SELECT user_id FROM users ORDER BY user_id"):
+            user: Dict | None = self._load_user(row["user_id"])
+
+            if user is None: continue
+
+            user["username_history"] = self.get_username_history(row["user_id"])
+
+            yield user
+
+    def iter_sessions(self) -> Iterator[Dict]:
+        for row in self._query("SELECT * FROM sessions ORDER BY session_id"):
+            yield {
+                "_id": row["session_id"],
+                "user_id": row["user_id"],
+                "activity": row["activity"],
+                "status": {"online": row["online"], "idle": row["idle"], "dnd": row["dnd"]},
+                "start_time": row["start_time"],
+                "end_time": row["end_time"]
+            }
+
+    def import_users(self, users: List[Dict]) -> None:
+        with self._operation("import_users"):
+            for user in users:
+                user_id: int = user["_id"]
+
+                self.connection.execute(REPLACE_USER, (user_id, user.get("username"), user.get("last_update", 0), user.get("last_online", 0)))
+
+                self.connection.execute("DELETE FROM simple_time WHERE user_id = ?", (user_id,))
+                self.connection.execute("DELETE FROM rich_presence_time WHERE user_id = ?", (user_id,))
+
+                self.connection.executemany(INSERT_USERNAME, [(user_id, username) for username in user.get("username_history", [])])
+                self.connection.executemany(ADD_SIMPLE_TIME, [(user_id, status, minutes) for status, minutes in user.get("simple_time", {}).items()])
+                self.connection.executemany(ADD_RICH_PRESENCE_TIME, [
+                    (user_id, activity, status, minutes) for activity, status_times in user.get("rich_presence_time", {}).items() for status, minutes in status_times.items()
+                ])
+
+                # Sessions may be imported before or after their users, so the active flag is set from both sides
+                self.connection.execute("UPDATE sessions SET active = 0 WHERE user_id = ?", (user_id,))
+                self.connection.executemany(SET_SESSION_ACTIVE, [(1, session_id) for session_id in user.get("active_sessions", [])])
+
+    def set_rich_presence_times(self, rich_presence_times: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+        with self._operation("set_rich_presence_times"):
+            for user_id, rich_presence_time in rich_presence_times.items():
+                self.connection.execute("DELETE FROM rich_presence_time WHERE user_id = ?", (user_id,))
+                self.connection.executemany(ADD_RICH_PRESENCE_TIME, [
+                    (user_id, activity, status, minutes) for activity, status_times in rich_presence_time.items() for status, minutes in status_times.items()
+                ])
+
+    def import_sessions(self, sessions: List[Dict]) -> None:
+        with self._operation("import_sessions"):
+            for session in sessions:
+                active: bool = len(self.connection.execute("""
+                    SELECT 1 FROM sessions WHERE session_id = ? AND active = 1
+                """, (session["_id"],)).fetchall()) > 0
+
+                self.connection.execute(REPLACE_SESSION, self._session_row(session, active))
+
+    def _drop_all(self) -> None:
+        with self._operation("drop_all"):
+            for table in ("users", "username_history", "simple_time", "rich_presence_time", "sessions"):
+                self.connection.execute(f"DELETE FROM {table}")
+
+        logging.warning("[DATABASE] Deleted every row in the SQLite database!")
@@ -0,0 +1,36 @@
+import logging
+
+from time import perf_counter
+
+from typing import Dict
+
+class StartupTimer:
+    """
+    Times each startup phase (imports, database connect, Discord login, first sweep) so restart downtime can be tracked
+    """
+
+    def __init__(self) -> None:
+        self.start_time: float = perf_counter()
+        self.phase_start_time: float = self.start_time
+        self.phases: Dict[str, float] = {}
+
+        self.reported: bool = False
+
+    def mark(self, phase: str) -> None:
+        """
+        Ends the current phase, which started when the previous one ended
+        """
+
+        now: float = perf_counter()
+
+        self.phases[phase] = now - self.phase_start_time
+        self.phase_start_time = now
+
+    def report(self) -> None:
+        if self.reported: return
+
+        self.reported = True
+
+        phases: str = ", ".join(f"{phase}: {seconds:.2f}s" for phase, seconds in self.phases.items())
+
+        logging.info(f"[STARTUP] Ready in {perf_counter() - self.start_time:.2f}s ({phases})")
@@ -0,0 +1,49 @@
+from activity_index import ActivityIndex
+
+from typing import Dict, List
+
+def _index(user_activities: Dict[int, List[str]]) -> ActivityIndex:
+    index: ActivityIndex = ActivityIndex(lambda user_id: user_activities.get(user_id, []))
+
+    for user_id, names in user_activities.items():
+        for name in names:
+            index.add(user_id, name)
+
+    return index
+
+def test_matches_are_ranked_exact_prefix_substring_then_similar() -> None:
+    index: ActivityIndex = _index({1: ["Minecraft", "Minecraft Dungeons", "Modded Minecraft", "Counter-Strike 2"]})
+
+    assert index.search("minecraft") == ["Minecraft", "Minecraft Dungeons", "Modded Minecraft"]
+    assert index.best_match("counter strike") == "Counter-Strike 2"
+
+def test_typos_still_match() -> None:
+    index: ActivityIndex = _index({1: ["Helldivers 2", "Stormworks"]})
+
+    assert index.best_match("heldivers") == "Helldivers 2"
+    assert index.best_match("zzzz") == ""
+
+def test_short_queries_match_inside_names() -> None:
+    index: ActivityIndex = _index({1: ["Doom", "Control"]})
+
+    assert index.search("oo") == ["Doom"]
+
+def test_user_searches_only_see_their_own_names() -> None:
+    loaded: List[int] = []
+    user_activities: Dict[int, List[str]] = {1: ["Minecraft"], 2: ["Minecraft Dungeons"]}
+
+    def load_user_activities(user_id: int) -> List[str]:
+        loaded.append(user_id)
+        return user_activities[user_id]
+
+    index: ActivityIndex = ActivityIndex(load_user_activities)
+    index.add(2, "Minecraft Dungeons")
+
+    assert index.search("minecraft", 1) == ["Minecraft"]
+    assert index.search("minecraft", 2) == ["Minecraft Dungeons"]
+
+    # Names recorded after a user is loaded are added to them, without loading them again
+    index.add(1, "Minecraft Legends")
+
+    assert index.search("minecraft", 1) == ["Minecraft", "Minecraft Legends"]
+    assert loaded == [1, 2]
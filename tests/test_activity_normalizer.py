@@ -0,0 +1,82 @@
+import json
+import pytest
+
+from pathlib import Path
+
+from activity_normalizer import ActivityRules, ActivityNormalizer, remerge_database
+from sqlite_database import SQLiteDatabaseManager
+
+from typing import Dict
+
+def test_exact_names_match_as_is_then_normalized() -> None:
+    rules: ActivityRules = ActivityRules({"cs2": "Counter-Strike 2"})
+
+    assert rules.resolve("cs2") == "Counter-Strike 2"
+    assert rules.resolve("CS 2") == "Counter-Strike 2"
+    assert rules.resolve("cs3") == "cs3"
+
+def test_patterns_match_the_whole_name_in_file_order() -> None:
+    rules: ActivityRules = ActivityRules({"re:Civilization VI( \\(DX1[12]\\))?": "Civ 6", "glob:civ*": "Some Civ"})
+
+    assert rules.resolve("civilization vi (dx12)") == "Civ 6"
+    assert rules.resolve("Civilization VII") == "Some Civ"
+    assert rules.resolve("Play Civilization VI") == "Play Civilization VI"
+
+def test_shipped_rules_leave_civilization_vii_alone() -> None:
+    with open(Path(__file__).parent.parent / "activity_matches.json", "r") as activity_matches_file:
+        rules: ActivityRules = ActivityRules(json.loads(activity_matches_file.read()))
+
+    assert rules.resolve("Sid Meier's Civilization VI (DX11)") == "Sid Meier's Civilization VI"
+    assert rules.resolve("civilizationvi_dx11") == "Sid Meier's Civilization VI"
+    assert rules.resolve("Sid Meier's Civilization VII") == "Sid Meier's Civilization VII"
+    assert rules.resolve("civilizationvii") == "civilizationvii"
+
+@pytest.mark.parametrize("matches, name, target", [
+    ({"re:(?i)foo": "Foo", "re:(a)\\1": "Double A"}, "aa", "Double A"),
+    ({"re:(a)\\1": "Double A", "re:(b)\\1": "Double B"}, "bb", "Double B"),
+    ({"re:(?P<name>x)y": "XY", "re:(?P<name>z)y": "ZY"}, "zy", "ZY")
+])
+def test_rules_are_independent_of_each_other(matches, name, target) -> None:
+    assert ActivityRules(matches).resolve(name) == target
+
+def test_invalid_rule_is_reported_by_name() -> None:
+    with pytest.raises(ValueError, match="re:\\(unclosed"):
+        ActivityRules({"re:(unclosed": "Broken"})
+
+def test_bad_reload_keeps_previous_rules(tmp_path) -> None:
+    path = tmp_path / "activity_matches.json"
+    path.write_text(json.dumps({"cs2": "Counter-Strike 2"}))
+
+    normalizer: ActivityNormalizer = ActivityNormalizer(str(path))
+
+    path.write_text(json.dumps({"re:(unclosed": "Broken"}))
+    normalizer.modified_time = 0
+
+    assert not normalizer.reload_if_changed()
+    assert normalizer.normalize("cs2") == "Counter-Strike 2"
+
+def test_remerge_merges_stored_stats_and_keeps_the_rest(tmp_path) -> None:
+    database_manager: SQLiteDatabaseManager = SQLiteDatabaseManager(str(tmp_path / "activity_bot.db"), flush_interval=3600)
+    rules: ActivityRules = ActivityRules({"civ6": "Civilization VI", "glob:civilizationvi_*": "Civilization VI"})
+
+    database_manager.update_user_username(1, "Someone")
+    database_manager.increment_user_simple_time(1, "online", 7)
+    database_manager.increment_user_rich_presence_time(1, "civ6", "online", 10)
+    database_manager.increment_user_rich_presence_time(1, "civilizationvi_dx12", "idle", 5)
+    session_id: str = database_manager.new_user_session(1, "civ6", "online", 10)
+    database_manager.flush()
+
+    assert remerge_database(database_manager, rules.resolve, dry_run=True) == {"users": 1, "activities": 1, "sessions": 1}
+    assert "civ6" in database_manager.get_user(1)["rich_presence_time"]
+
+    assert remerge_database(database_manager, rules.resolve) == {"users": 1, "activities": 1, "sessions": 1}
+
+    user: Dict = database_manager.get_user(1)
+
+    assert user["rich_presence_time"] == {"Civilization VI": {"online": 10, "idle": 5, "dnd": 0, "offline": 0}}
+    assert user["simple_time"]["online"] == 7
+    assert user["username"] == "Someone"
+    assert user["active_sessions"] == [session_id]
+    assert database_manager.get_user_sessions(1)[session_id]["name"] == "Civilization VI"
+
+    database_manager.close()
@@ -0,0 +1,52 @@
+import pytest
+
+from analytics import GraphManager
+from render_service import RenderJob
+from sqlite_database import SQLiteDatabaseManager
+
+@pytest.fixture
+def graph_manager(tmp_path):
+    database_manager: SQLiteDatabaseManager = SQLiteDatabaseManager(str(tmp_path / "activity_bot.db"), flush_interval=3600)
+
+    # 30 activities, "Game 1" played 1 hour up to "Game 30" played 30 hours, split over two users
+    for hours in range(1, 31):
+        database_manager.increment_user_rich_presence_time(1 + hours % 2, f"Game {hours}", "online", hours * 60)
+
+    yield GraphManager(database_manager)
+
+    database_manager.close()
+
+TOTAL_HOURS: float = sum(range(1, 31))
+
+def test_table_pages(graph_manager: GraphManager) -> None:
+    ranks, names, hours, footer = graph_manager.get_server_rich_time_table([1, 2], "Server", page=2).args
+
+    assert ranks == [26, 27, 28, 29, 30, "-"]
+    assert names == ["Game 5", "Game 4", "Game 3", "Game 2", "Game 1", "Total"]
+    assert hours[-1] == TOTAL_HOURS
+    assert footer == "Page 2 of 2"
+
+def test_out_of_range_pages_are_clamped(graph_manager: GraphManager) -> None:
+    assert graph_manager.get_server_rich_time_table([1, 2], "Server", page=9).args[0][0] == 26
+    assert graph_manager.get_server_rich_time_table([1, 2], "Server", page=0).args[0][0] == 1
+
+def test_top_n_totals_every_activity(graph_manager: GraphManager) -> None:
+    for job in (graph_manager.get_server_rich_time_table([1, 2], "Server", 1, 3), graph_manager.get_user_rich_time_table(2, "Someone", 1, 3)):
+        ranks, names, hours, footer = job.args
+
+        assert ranks == [1, 2, 3, "-"]
+        assert names[-1] == "Total (all activities)"
+        assert footer == ""
+
+    assert graph_manager.get_server_rich_time_table([1, 2], "Server", 1, 3).args[2] == [30, 29, 28, TOTAL_HOURS]
+    assert graph_manager.get_user_rich_time_table(2, "Someone", 1, 3).args[2] == [29, 27, 25, sum(range(1, 31, 2))]
+
+def test_top_n_covering_everything_is_a_plain_total(graph_manager: GraphManager) -> None:
+    job: RenderJob = graph_manager.get_user_rich_time_table(1, "Someone", 1, 50)
+
+    assert job.args[1][-1] == "Total"
+    assert len(job.args[0]) == 16
+
+def test_empty_tables(graph_manager: GraphManager) -> None:
+    assert graph_manager.get_server_rich_time_table([99], "Server") == ""
+    assert graph_manager.get_user_rich_time_table(99, "Nobody") == ""
@@ -0,0 +1,27 @@
+import json
+
+from checkpoint import save_checkpoint, load_checkpoint
+
+def test_checkpoint_resumes_once(tmp_path) -> None:
+    path: str = str(tmp_path / "tracking_checkpoint.json")
+
+    save_checkpoint(path, {1: 100.0, 2: 200.0})
+
+    assert load_checkpoint(path, max_age=60) == {1: 100.0, 2: 200.0}
+    assert load_checkpoint(path, max_age=60) == {}
+
+def test_old_checkpoint_is_ignored(tmp_path) -> None:
+    path = tmp_path / "tracking_checkpoint.json"
+    path.write_text(json.dumps({"written_at": 0, "tracked": {"1": 100.0}}))
+
+    assert load_checkpoint(str(path), max_age=60) == {}
+    assert not path.exists()
+
+def test_missing_or_broken_checkpoint_starts_empty(tmp_path) -> None:
+    path = tmp_path / "tracking_checkpoint.json"
+
+    assert load_checkpoint(str(path), max_age=60) == {}
+
+    path.write_text("{not json")
+
+    assert load_checkpoint(str(path), max_age=60) == {}
@@ -0,0 +1,106 @@
+import pytest
+
+from sqlite_database import SQLiteDatabaseManager
+
+from typing import Dict
+
+@pytest.fixture
+def database_manager(tmp_path):
+    database_manager: SQLiteDatabaseManager = SQLiteDatabaseManager(str(tmp_path / "activity_bot.db"), cache_size=2, flush_interval=3600)
+
+    yield database_manager
+
+    database_manager.close()
+
+def _stored_online_minutes(database_manager: SQLiteDatabaseManager, user_id: int) -> float:
+    return database_manager._load_user(user_id)["simple_time"]["online"]
+
+def test_changes_are_only_written_on_flush(database_manager: SQLiteDatabaseManager) -> None:
+    database_manager.increment_user_simple_time(1, "online", 5)
+
+    assert _stored_online_minutes(database_manager, 1) == 0
+    assert database_manager.get_user_time_dict(1)["simple_time"]["online"] == 5
+
+    database_manager.flush()
+
+    assert _stored_online_minutes(database_manager, 1) == 5
+
+def test_failed_flush_keeps_the_changes(database_manager: SQLiteDatabaseManager, monkeypatch) -> None:
+    database_manager.increment_user_simple_time(1, "online", 5)
+    database_manager.new_user_session(1, "Game", "online", 5)
+
+    write_changes = database_manager._write_changes
+
+    def failing_write_changes(changes) -> None:
+        # More time is credited while the write is in flight
+        database_manager.increment_user_simple_time(1, "online", 2)
+        raise OSError("database unreachable")
+
+    monkeypatch.setattr(database_manager, "_write_changes", failing_write_changes)
+
+    with pytest.raises(OSError):
+        database_manager.flush()
+
+    monkeypatch.setattr(database_manager, "_write_changes", write_changes)
+    database_manager.flush()
+
+    assert _stored_online_minutes(database_manager, 1) == 7
+    assert database_manager.get_user_time_dict(1)["simple_time"]["online"] == 7
+    assert [session["name"] for session in database_manager.get_user_sessions(1).values()] == ["Game"]
+
+def test_tracked_users_outlive_the_cache_size(database_manager: SQLiteDatabaseManager) -> None:
+    database_manager.track_users([1, 2, 3])
+
+    for user_id in (4, 5, 6):
+        database_manager.add_user(user_id)
+        database_manager.get_user_time_dict(user_id)
+
+    cache_states: Dict = database_manager.cache.states
+
+    assert {1, 2, 3} <= set(cache_states)
+    # Only one untracked user fits next to them, the rest were evicted
+    assert len(cache_states) == 4
+
+def test_edited_users_are_not_evicted_before_flush(database_manager: SQLiteDatabaseManager) -> None:
+    for user_id in (1, 2, 3):
+        database_manager.increment_user_simple_time(user_id, "online", user_id)
+
+    assert {1, 2, 3} <= set(database_manager.cache.states)
+
+    database_manager.flush()
+
+    assert len(database_manager.cache.states) == 2
+    assert [_stored_online_minutes(database_manager, user_id) for user_id in (1, 2, 3)] == [1, 2, 3]
+
+def test_get_users_loads_only_the_requested_fields(database_manager: SQLiteDatabaseManager) -> None:
+    database_manager.increment_user_simple_time(1, "idle", 3)
+    database_manager.increment_user_rich_presence_time(2, "Game", "online", 4)
+    database_manager.reset_cache()
+
+    users: Dict[int, Dict] = database_manager.get_users([1, 2, 99], ("simple_time",))
+
+    assert set(users) == {1, 2}
+    assert all(set(user) == {"simple_time"} for user in users.values())
+    assert users[1]["simple_time"]["idle"] == 3
+
+    assert database_manager.get_users([2], ("rich_presence_time",))[2]["rich_presence_time"]["Game"]["online"] == 4
+
+def test_tracked_user_without_last_online_gets_one() -> None:
+    pytest.importorskip("discord")
+    pytest.importorskip("dateutil")
+
+    from benchmark import MemoryDatabaseManager
+
+    database_manager: MemoryDatabaseManager = MemoryDatabaseManager()
+
+    # Documents from before last_online existed
+    old_user: Dict = {"_id": 1, "username": "old", "username_history": ["old"], "last_update": 100.0, "active_sessions": [],
+                      "simple_time": {"online": 5}, "rich_presence_time": {}}
+    database_manager.import_users([old_user])
+
+    database_manager.track_users([1])
+
+    assert isinstance(database_manager.get_user_last_online(1), float)
+    assert database_manager.get_user_time_dict(1)["simple_time"]["online"] == 5
+
+    database_manager.close()
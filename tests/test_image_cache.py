@@ -0,0 +1,38 @@
+from image_cache import ImageCache
+
+def test_images_are_served_for_their_version_only() -> None:
+    cache: ImageCache = ImageCache(max_bytes=100, ttl=60)
+    cache.put(("graph", 1), 1, b"image")
+
+    assert cache.get(("graph", 1), 1) == b"image"
+    assert cache.get(("graph", 1), 2) is None
+    assert cache.get(("graph", 2), 1) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_least_recently_used_images_are_evicted_by_size() -> None:
+    cache: ImageCache = ImageCache(max_bytes=10, ttl=60)
+    cache.put("a", 1, b"aaaa")
+    cache.put("b", 1, b"bbbb")
+    cache.get("a", 1)
+    cache.put("c", 1, b"cccc")
+
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == b"aaaa"
+    assert cache.get("c", 1) == b"cccc"
+    assert (cache.size, cache.evictions) == (8, 1)
+
+def test_replacing_an_image_frees_its_old_size() -> None:
+    cache: ImageCache = ImageCache(max_bytes=10, ttl=60)
+    cache.put("a", 1, b"aaaa")
+    cache.put("a", 2, b"aa")
+
+    assert cache.size == 2
+    assert cache.get("a", 2) == b"aa"
+
+def test_oversized_and_expired_images_are_not_served() -> None:
+    cache: ImageCache = ImageCache(max_bytes=4, ttl=-1)
+    cache.put("big", 1, b"too big")
+    cache.put("a", 1, b"aa")
+
+    assert cache.get("big", 1) is None
+    assert cache.get("a", 1) is None
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("dateutil")
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+from types import SimpleNamespace
+
+from benchmark import MemoryDatabaseManager
+from bot import Server, SkipList, MemberRegistry, ActivityManager
+
+from typing import Dict, List
+
+def _member(user_id: int, guild: SimpleNamespace, status: str, activities: List[str]) -> SimpleNamespace:
+    return SimpleNamespace(id=user_id, name=f"user{user_id}", bot=False, guild=guild, status=SimpleNamespace(name=status),
+                           activities=[SimpleNamespace(name=name) for name in activities])
+
+@pytest.fixture
+def servers():
+    database_manager: MemoryDatabaseManager = MemoryDatabaseManager()
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+    member_locks: List[Lock] = [Lock() for _ in range(ActivityManager.MEMBER_LOCK_STRIPES)]
+    skip_list: SkipList = SkipList(checkpoint_interval=3600)
+
+    guilds: List[SimpleNamespace] = [SimpleNamespace(id=guild_id, name=f"Guild {guild_id}", members=[]) for guild_id in (1, 2)]
+    member_registry: MemberRegistry = MemberRegistry(cycle_length=3600, get_guild={guild.id: guild for guild in guilds}.get)
+
+    yield [Server(database_manager, guild, 0, lambda activity_name: activity_name, executor, 4, member_locks, skip_list, member_registry)
+           for guild in guilds]
+
+    executor.shutdown()
+    database_manager.close()
+
+def _deliver(servers: List[Server], user_id: int, before: Dict, after: Dict) -> None:
+    # discord.py dispatches on_presence_update once per guild the bot shares with the member
+    for server in servers:
+        server.process_presence_change(_member(user_id, server.guild, **before), _member(user_id, server.guild, **after))
+
+        # Session ids are the user id and start millisecond, so sessions opened by the copies must not share one
+        sleep(0.002)
+
+def test_presence_change_in_two_guilds_opens_one_session(servers: List[Server]) -> None:
+    database_manager: MemoryDatabaseManager = servers[0].database_manager
+
+    _deliver(servers, 1, {"status": "online", "activities": []}, {"status": "online", "activities": ["Game"]})
+    _deliver(servers, 1, {"status": "online", "activities": ["Game"]}, {"status": "online", "activities": []})
+
+    sessions: Dict = database_manager.get_user_sessions(1)
+
+    assert len(sessions) == 1
+    assert next(iter(sessions.values()))["name"] == "Game"
+    assert database_manager.get_active_sessions(1) == []
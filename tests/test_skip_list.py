@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("dateutil")
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time
+from types import SimpleNamespace
+
+from benchmark import MemoryDatabaseManager
+from bot import Server, SkipList, MemberRegistry, ActivityManager
+
+from typing import Dict, List
+
+ACCRUED_MINUTES: float = 10
+
+@pytest.fixture
+def server():
+    database_manager: MemoryDatabaseManager = MemoryDatabaseManager()
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+    member_locks: List[Lock] = [Lock() for _ in range(ActivityManager.MEMBER_LOCK_STRIPES)]
+    skip_list: SkipList = SkipList(checkpoint_interval=3600)
+
+    guild: SimpleNamespace = SimpleNamespace(id=1, name="Guild", members=[])
+    member_registry: MemberRegistry = MemberRegistry(cycle_length=3600, get_guild={guild.id: guild}.get)
+
+    database_manager.before_read = skip_list.materialize
+    database_manager.pending_time = skip_list.pending_time
+
+    yield Server(database_manager, guild, 0, lambda activity_name: activity_name, executor, 4, member_locks, skip_list, member_registry)
+
+    executor.shutdown()
+    database_manager.close()
+
+def _member(server: Server, status: str, activities: List[str]) -> SimpleNamespace:
+    return SimpleNamespace(id=1, name="user1", bot=False, guild=server.guild, status=SimpleNamespace(name=status),
+                           activities=[SimpleNamespace(name=name) for name in activities])
+
+def _skip_for(server: Server, minutes: float) -> None:
+    # As if every sweep since the member was processed had skipped them
+    since: float = time() - minutes * 60
+
+    server.skip_list.entries[1].since = since
+    server.database_manager.set_user_last_update(1, since)
+
+def test_unchanged_members_are_skipped(server: Server) -> None:
+    member: SimpleNamespace = _member(server, "online", ["Game"])
+    server.process_member(member)
+
+    assert server.skip_list.should_skip(1, server.fingerprint(member), time())
+    assert not server.skip_list.should_skip(1, server.fingerprint(_member(server, "idle", ["Game"])), time())
+    assert not server.skip_list.should_skip(1, server.fingerprint(member), time() + 3600)
+
+def test_server_reads_add_pending_time_without_writing_it(server: Server) -> None:
+    server.process_member(_member(server, "online", ["Game"]))
+    _skip_for(server, ACCRUED_MINUTES)
+
+    users: Dict[int, Dict] = server.database_manager.get_users([1])
+
+    assert users[1]["simple_time"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+    assert users[1]["rich_presence_time"]["Game"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+    assert server.database_manager.get_rich_presence_totals([1])[0][1] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+
+    # Nothing was credited, the member is still accruing from the same point
+    assert server.database_manager.get_user_time_dict(1)["simple_time"]["online"] == pytest.approx(0, abs=0.1)
+
+def test_single_user_reads_credit_pending_time(server: Server) -> None:
+    server.process_member(_member(server, "online", ["Game"]))
+    _skip_for(server, ACCRUED_MINUTES)
+
+    user: Dict = server.database_manager.get_user(1)
+
+    assert user["simple_time"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+    assert server.database_manager.get_user_time_dict(1)["rich_presence_time"]["Game"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+
+    # Credited once, a second read adds nothing
+    assert server.database_manager.get_users([1])[1]["simple_time"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+
+def test_skipped_time_is_credited_to_the_old_presence_on_change(server: Server) -> None:
+    server.process_member(_member(server, "online", ["Game"]))
+    _skip_for(server, ACCRUED_MINUTES)
+
+    server.process_presence_change(_member(server, "online", ["Game"]), _member(server, "idle", []))
+
+    user: Dict = server.database_manager.get_user_time_dict(1)
+
+    assert user["simple_time"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+    assert user["rich_presence_time"]["Game"]["online"] == pytest.approx(ACCRUED_MINUTES, abs=0.1)
+    assert user["active_sessions"] == []
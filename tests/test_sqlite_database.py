@@ -0,0 +1,83 @@
+import pytest
+
+from database import copy_database
+from sqlite_database import SQLiteDatabaseManager
+
+from typing import Dict, List
+
+@pytest.fixture
+def database_manager(tmp_path):
+    database_manager: SQLiteDatabaseManager = SQLiteDatabaseManager(str(tmp_path / "activity_bot.db"), flush_interval=3600)
+
+    yield database_manager
+
+    database_manager.close()
+
+def _reopen(database_manager: SQLiteDatabaseManager) -> Dict:
+    # Everything read after this comes from the database rather than the cache
+    database_manager.flush()
+    database_manager.reset_cache()
+
+    return database_manager.get_user(1)
+
+def test_statistics_survive_a_flush(database_manager: SQLiteDatabaseManager) -> None:
+    database_manager.increment_user_simple_time(1, "online", 2)
+    database_manager.increment_user_simple_time(1, "online", 3)
+    database_manager.increment_user_rich_presence_time(1, "Game", "dnd", 4)
+
+    user: Dict = _reopen(database_manager)
+
+    assert user["simple_time"] == {"online": 5, "idle": 0, "dnd": 0, "offline": 0}
+    assert user["rich_presence_time"] == {"Game": {"online": 0, "idle": 0, "dnd": 4, "offline": 0}}
+
+def test_sessions_open_update_and_close(database_manager: SQLiteDatabaseManager) -> None:
+    session_id: str = database_manager.new_user_session(1, "Game", "online", 1)
+    database_manager.update_session(1, session_id, "idle", 2)
+
+    assert _reopen(database_manager)["active_sessions"] == [session_id]
+
+    session: Dict = database_manager.get_user_sessions(1)[session_id]
+
+    assert session["name"] == "Game"
+    assert session["status"] == {"online": 1, "idle": 2, "dnd": 0}
+
+    database_manager.remove_active_session_id(1, session_id)
+
+    assert _reopen(database_manager)["active_sessions"] == []
+    assert session_id in database_manager.get_user_sessions(1)
+
+def test_usernames_are_found_case_insensitively(database_manager: SQLiteDatabaseManager) -> None:
+    database_manager.update_user_username(1, "OldName")
+    database_manager.flush()
+    database_manager.update_user_username(1, "NewName")
+    database_manager.flush()
+
+    assert database_manager.get_user_id("newname") == 1
+    assert database_manager.get_user_id("OLDNAME") == 1
+    assert database_manager.get_user_id("nobody") is None
+    assert sorted(database_manager.get_username_history(1)) == ["NewName", "OldName"]
+
+def test_rich_presence_totals_are_summed_and_cut_to_the_limit(database_manager: SQLiteDatabaseManager) -> None:
+    for user_id, activity_name, minutes in ((1, "A", 10), (2, "A", 5), (2, "B", 20), (3, "C", 1)):
+        database_manager.increment_user_rich_presence_time(user_id, activity_name, "online", minutes)
+
+    assert database_manager.get_rich_presence_totals([1, 2, 3]) == [("B", 20), ("A", 15), ("C", 1)]
+    assert database_manager.get_rich_presence_totals([1, 2], 1) == [("B", 20)]
+
+def test_copy_round_trip(database_manager: SQLiteDatabaseManager, tmp_path) -> None:
+    database_manager.update_user_username(1, "Someone")
+    database_manager.increment_user_rich_presence_time(1, "Game", "online", 3)
+    database_manager.new_user_session(1, "Game", "online", 3)
+    database_manager.flush()
+
+    copy: SQLiteDatabaseManager = SQLiteDatabaseManager(str(tmp_path / "copy.db"), flush_interval=3600)
+
+    assert copy_database(database_manager, copy) == (1, 1)
+
+    users: List[Dict] = list(copy.iter_users())
+
+    assert users == list(database_manager.iter_users())
+    assert copy.get_user_sessions(1) == database_manager.get_user_sessions(1)
+    assert copy.get_user(1)["active_sessions"] == database_manager.get_user(1)["active_sessions"]
+
+    copy.close()
@@ -1,10 +1,16 @@
 import flask
 
+from io import BytesIO
+from functools import partial
+
 from analytics import GraphManager
+from render_service import RenderService, RenderError
+from metrics import METRICS, PROMETHEUS_CONTENT_TYPE
 
 class WebServer:
-    def __init__(self, graph_manager: GraphManager, port: int) -> None:
+    def __init__(self, graph_manager: GraphManager, render_service: RenderService, port: int) -> None:
         self.graph_manager = graph_manager 
+        self.render_service = render_service
         self.port = port
 
         self.app = flask.Flask(__name__)
@@ -13,22 +19,30 @@ class WebServer:
         self.app.run(host='0.0.0.0', port=port)
         
     def setup_routes(self) -> None:
+        @self.app.route('/metrics')
+        def metrics():
+            return flask.Response(METRICS.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
         @self.app.route('/simple_status_graph')
         def simple_status_graph():
             user = flask.request.args.get('user')
 
-            if user is None: return flask.send_from_directory('images', 'user_not_specified.png')
+            if user is None: return "Please supply a user in the 'user' argument!", 400
 
             user_id = self.graph_manager.get_user_id(user)
 
-            if user_id is None: return flask.send_from_directory('images', 'user_not_found.png')
+            if user_id is None: return f"{user} is not found in the database. Please DM @captaindeathead for assistance.", 404
+
+            try:
+                graph: bytes | str = self.render_service.render_cached_sync((user_id, user), partial(self.graph_manager.dbManager.get_user_version, user_id),
+                                                                            self.graph_manager.get_user_simple_time, user_id, user)
+            except RenderError as e:
+                return f"Couldn't draw the graph, please try again later. ({str(e)})", 503
 
-            graph_file: str = self.graph_manager.get_user_simple_time(user_id, user)
+            if graph == "":
+                return f"{user} is not found in the database. Please DM @captaindeathead for assistance.", 404
 
-            if graph_file == "":
-                return f"{user} is not found in the database. Please DM @captaindeathead for assistance."
-            else:
-                return flask.send_file(graph_file)
+            return flask.send_file(BytesIO(graph), mimetype="image/png", download_name=f"{user_id}_simple_times.png")
 
         @self.app.route('/rich_status_graph')
         def rich_status_graph():